@@ -1,5 +1,4 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_mail import Mail
 from flask_bootstrap import Bootstrap
 from flask_moment import Moment
@@ -7,6 +6,14 @@ from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_pagedown import PageDown
 from config import config
+from .database import SQLAlchemy
+from .follow_graph import follow_graph
+from .render import renderer
+from .last_seen import last_seen
+from .identity import identity_cache
+from .credentials import credential_cache
+from .response_cache import response_cache
+from .fragments import fragment_cache
 
 
 db = SQLAlchemy()
@@ -29,6 +36,18 @@ def create_app(config_name):
 	moment.init_app(app)
 	login_manager.init_app(app)
 	pagedown.init_app(app)
+	follow_graph.init_app(app)
+	renderer.init_app(app)
+	last_seen.init_app(app)
+	identity_cache.init_app(app)
+	credential_cache.init_app(app)
+	response_cache.init_app(app)
+	fragment_cache.init_app(app)
+
+	from .email import mail_pool
+	mail_pool.init_app(app)
+	from .search import search_index
+	search_index.init_app(app)
 
 	from .main import main as main_blueprint
 	app.register_blueprint(main_blueprint)
@@ -2,4 +2,4 @@ from flask import Blueprint
 
 api = Blueprint('api', __name__)
 
-from . import authentication, comment, decorators, errors, post, user
\ No newline at end of file
+from . import authentication, comment, decorators, errors, export, post, search, user
\ No newline at end of file
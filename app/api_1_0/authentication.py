@@ -3,6 +3,7 @@ from flask_httpauth import HTTPBasicAuth
 from . import api
 from .errors import unauthorized, forbidden
 from ..models import AnonymousUser, User
+from ..credentials import credential_cache
 
 auth = HTTPBasicAuth()
 
@@ -22,12 +23,19 @@ def verify_password(email_or_token, password):
 		g.token_used = True
 		g.current_user = User.verify_auth_token(email_or_token)
 		return g.current_user is not None
+	g.token_used = False
+	user = credential_cache.get(email_or_token, password)
+	if user is not None:
+		g.current_user = user
+		return True
 	user = User.query.filter_by(email=email_or_token).first()
 	if user is None:
 		return False
 	g.current_user = user
-	g.token_used = False
-	return user.verify_password(password)
+	if not user.verify_password(password):
+		return False
+	credential_cache.set(email_or_token, password, user)
+	return True
 
 @auth.error_handler
 def error_handle():
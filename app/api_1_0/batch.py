@@ -0,0 +1,59 @@
+from flask import request, current_app
+from ..exceptions import ValidationError
+
+
+def batch_requested(name):
+	return name in request.args
+
+# ?ids=1,2,3 或 ?ids=1&ids=2, 去重后保持请求中的顺序
+def batch_keys(name, type=int):
+	keys = []
+	for value in request.args.getlist(name):
+		for key in value.split(','):
+			key = key.strip()
+			if not key:
+				continue
+			try:
+				key = type(key)
+			except ValueError:
+				raise ValidationError('invalid %s: %r' % (name, key))
+			if key not in keys:
+				keys.append(key)
+	limit = current_app.config['FLASK_API_BATCH_LIMIT']
+	if len(keys) > limit:
+		raise ValidationError('at most %d %s per request' % (limit, name))
+	return keys
+
+# 一条 IN 查询取回全部对象, 按 keys 的顺序返回, 并列出不存在的键
+def batch_lookup(query, column, keys):
+	if not keys:
+		return [], []
+	found = dict((getattr(item, column.key), item) for item in query.filter(column.in_(keys)))
+	return [found[key] for key in keys if key in found], \
+		[key for key in keys if key not in found]
+
+def batch_response(name, items, missing):
+	return {
+		name: items,
+		'missing': missing
+	}
+
+# 批量写入的请求体为 {"<name>": [...]}, 每一项单独校验, 结果按顺序逐项返回
+def batch_items(name):
+	data = request.get_json(silent=True)
+	items = data.get(name) if isinstance(data, dict) else None
+	if not isinstance(items, list):
+		raise ValidationError('%s must be a list' % name)
+	limit = current_app.config['FLASK_API_BATCH_LIMIT']
+	if len(items) > limit:
+		raise ValidationError('at most %d %s per request' % (limit, name))
+	return items
+
+def item_text(item, name):
+	value = item.get(name) if isinstance(item, dict) else None
+	if not isinstance(value, str) or not value.strip():
+		return None
+	return value
+
+def item_error(message, status=400):
+	return {'status': status, 'error': message}
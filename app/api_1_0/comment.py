@@ -1,27 +1,91 @@
 from . import api
-from ..models import Comment
-from flask import request, current_app, jsonify, url_for
+from .. import db
+from ..models import Comment, Post, Permission
+from ..queries import comments_with_commentators
+from .pagination import cursor_requested, keyset_paginate, cursor_response, page_url
+from .conditional import conditional, resource_version, collection_version
+from .batch import batch_requested, batch_keys, batch_lookup, batch_response, \
+	batch_items, item_text, item_error
+from .decorators import permission_required
+from .fields import serialize, with_expanded, expanded_timestamps, join_expanded
+from flask import request, current_app, jsonify, g
+
+
+def comments_version():
+	query = Comment.query
+	if batch_requested('ids'):
+		query = query.filter(Comment.id.in_(batch_keys('ids')))
+	query, columns = join_expanded(query, [Comment.updated_at],
+		Comment.commentator, Comment.post)
+	return collection_version(query, *columns)
+
+def comment_version(id):
+	comment = comments_with_commentators().filter(Comment.id == id).first_or_404()
+	return resource_version(comment.updated_at, comment.commentator.username,
+		*expanded_timestamps(comment))
 
 
 @api.route('/comments/')
+@conditional(comments_version)
 def get_comments():
+	if batch_requested('ids'):
+		comments, missing = batch_lookup(
+			with_expanded(comments_with_commentators(), Comment.post), Comment.id,
+			batch_keys('ids'))
+		return jsonify(batch_response('comments',
+			[serialize(comment) for comment in comments], missing))
+	if cursor_requested():
+		comments, cursor, total = keyset_paginate(
+			with_expanded(comments_with_commentators(), Comment.post),
+			(Comment.timestamp, Comment.id), current_app.config['POST_PER_PAGE'])
+		return jsonify(cursor_response('comments',
+			[serialize(comment) for comment in comments], 'api.get_comments',
+			cursor, total))
 	page = request.args.get('page', 1, type=int)
-	pagination = Comment.query.order_by(Comment.timestamp.asc()).paginate(page=page,
+	pagination = with_expanded(comments_with_commentators(), Comment.post).order_by(
+		Comment.timestamp.asc()).paginate(page=page,
 		per_page=current_app.config['POST_PER_PAGE'], error_out=False)
 	prev = None
 	if pagination.has_prev:
-		prev = url_for('api.get_comments', page=page - 1, _external=True)
+		prev = page_url('api.get_comments', page=page - 1)
 	next = None
 	if pagination.has_next:
-		next = url_for('api.get_comments', page=page + 1, _external=True)
+		next = page_url('api.get_comments', page=page + 1)
 	return jsonify({
-		'comments': [comment.to_json() for comment in pagination.items],
+		'comments': [serialize(comment) for comment in pagination.items],
 		'prev': prev,
 		'next': next,
 		'comments_count': pagination.total
 	})
 
+# 批量评论: {"comments": [{"post_id": 1, "body": ...}, ...]}, 一个事务写入
+@api.route('/comments/batch', methods=['POST'])
+@permission_required(Permission.COMMENT)
+def compose_comments():
+	items = batch_items('comments')
+	post_ids = [item.get('post_id') if isinstance(item, dict) else None for item in items]
+	post_ids = [id if isinstance(id, int) else None for id in post_ids]
+	posts = dict((post.id, post) for post in
+		Post.query.filter(Post.id.in_([id for id in post_ids if id is not None])))
+	comments = []
+	for item, post_id in zip(items, post_ids):
+		body = item_text(item, 'body')
+		post = posts.get(post_id)
+		if not body:
+			comments.append('comment can not be null')
+		elif post is None:
+			comments.append('post not found')
+		else:
+			comments.append(Comment(body=body, post=post, commentator=g.current_user))
+	db.session.add_all([comment for comment in comments if isinstance(comment, Comment)])
+	db.session.flush()
+	results = [{'status': 201, 'comment': serialize(comment)}
+		if isinstance(comment, Comment) else item_error(comment) for comment in comments]
+	db.session.commit()
+	return jsonify({'results': results})
+
 @api.route('/comment/<int:id>')
+@conditional(comment_version)
 def get_comment(id):
 	comment = Comment.query.get_or_404(id)
-	return jsonify(comment.to_json())
\ No newline at end of file
+	return jsonify(serialize(comment))
\ No newline at end of file
@@ -0,0 +1,59 @@
+import hashlib
+from datetime import datetime
+from functools import wraps
+from flask import request, current_app, make_response
+from .. import db
+
+
+def make_etag(*parts):
+	return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+def _latest(timestamps):
+	timestamps = [t for t in timestamps if t is not None]
+	return max(timestamps) if timestamps else None
+
+# 单个资源的版本: 行的 updated_at 加上 to_json 中用到的其他字段 (含展开的对象)
+def resource_version(updated_at, *extra):
+	timestamps = [updated_at] + [value for value in extra if isinstance(value, datetime)]
+	return make_etag(request.path, sorted(request.args.items(multi=True)), updated_at,
+		extra), _latest(timestamps)
+
+# 列表的版本: 行数和各时间列的最大值, 再加上分页参数.
+# 删除行、取消关注、屏蔽评论不会推进最大时间, 所以列表只用 ETag, 不给 Last-Modified
+def collection_version(query, *columns):
+	row = query.order_by(None).with_entities(db.func.count(),
+		*[db.func.max(column) for column in columns]).one()
+	return make_etag(request.path, sorted(request.args.items(multi=True)), tuple(row)), None
+
+def _is_fresh(etag, last_modified):
+	if request.if_none_match:
+		return request.if_none_match.contains(etag)
+	since = request.if_modified_since
+	if since is not None and last_modified is not None:
+		return last_modified <= since.replace(tzinfo=None)
+	return False
+
+# 条件 GET: version(**view_args) 返回 (etag, last_modified),
+# 客户端缓存仍然有效时直接返回 304, 不执行视图
+def conditional(version):
+	def decorate_function(func):
+		@wraps(func)
+		def decorator(*args, **kwargs):
+			if request.method not in ('GET', 'HEAD'):
+				return func(*args, **kwargs)
+			etag, last_modified = version(*args, **kwargs)
+			if last_modified is not None:
+				last_modified = last_modified.replace(microsecond=0)
+			if _is_fresh(etag, last_modified):
+				response = current_app.response_class(status=304)
+			else:
+				response = make_response(func(*args, **kwargs))
+				if response.status_code != 200:
+					return response
+			response.set_etag(etag)
+			if last_modified is not None:
+				response.last_modified = last_modified
+			response.cache_control.no_cache = True
+			return response
+		return decorator
+	return decorate_function
@@ -1,8 +1,12 @@
 from . import api
 from flask import jsonify
+from ..exceptions import ValidationError
 
 
-
+def bad_request(message):
+	response = jsonify({'error': 'bad request', 'message': message})
+	response.status_code = 400
+	return response
 
 def unauthorized(message):
 	response = jsonify({'error': 'unauthorized', 'message': message})
@@ -12,4 +16,8 @@ def unauthorized(message):
 def forbidden(message):
 	response = jsonify({'error': 'forbidden',  'message': message})
 	response.status_code = 403
-	return response
\ No newline at end of file
+	return response
+
+@api.errorhandler(ValidationError)
+def validation_error(e):
+	return bad_request(e.args[0])
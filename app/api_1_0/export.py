@@ -0,0 +1,28 @@
+from datetime import datetime
+from flask import request, current_app, abort, stream_with_context
+from . import api
+from ..models import Permission
+from ..export import EXPORTS, parse_since, export_lines, gzip_chunks
+from .decorators import permission_required
+
+
+# 管理员导出整表: /export/posts?since=2017-01-01T00:00:00, 每行一个 JSON 对象.
+# 客户端接受 gzip 时压缩输出; X-Export-Timestamp 可作为下一次增量导出的 since
+@api.route('/export/<kind>')
+@permission_required(Permission.ADMINISTER)
+def export(kind):
+	if kind not in EXPORTS:
+		abort(404)
+	since = parse_since(request.args.get('since'))
+	started = datetime.utcnow()
+	chunks = export_lines(kind, since, current_app.config['FLASK_EXPORT_BATCH_SIZE'])
+	gzip = request.accept_encodings['gzip'] > 0
+	if gzip:
+		chunks = gzip_chunks(chunks)
+	response = current_app.response_class(stream_with_context(chunks),
+		mimetype='application/x-ndjson')
+	if gzip:
+		response.headers['Content-Encoding'] = 'gzip'
+	response.vary.add('Accept-Encoding')
+	response.headers['X-Export-Timestamp'] = started.isoformat()
+	return response
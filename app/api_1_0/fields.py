@@ -0,0 +1,93 @@
+from flask import request
+from .. import db
+from ..exceptions import ValidationError
+
+
+# ?fields=body,author.username  只返回列出的字段, 点号指向展开对象中的字段
+# ?expand=author,post.author    把关联对象内嵌到结果中, 省去客户端再请求一次
+def _parse(value):
+	tree = {}
+	for path in value.split(','):
+		path = path.strip()
+		if not path:
+			continue
+		node = tree
+		for name in path.split('.'):
+			if not name:
+				raise ValidationError('invalid field %r' % path)
+			node = node.setdefault(name, {})
+	return tree
+
+def json_options():
+	options = getattr(request, 'json_options', None)
+	if options is None:
+		fields = request.args.get('fields')
+		options = request.json_options = {
+			'fields': _parse(fields) if fields else None,
+			'expand': _parse(request.args.get('expand', ''))
+		}
+	return options
+
+def expanded(name):
+	return name in json_options()['expand']
+
+def serialize(obj):
+	return obj.to_json(**json_options())
+
+# 请求展开关联对象时一并 join 进来, 避免列表中每条记录再查一次.
+# 多层展开 (post.author) 沿关系链接上 joinedload
+def _expand_loader(loader, model, expand):
+	for name in expand:
+		if name in model.json_expandable:
+			relationship = getattr(model, name)
+			_expand_loader(loader.joinedload(relationship),
+				relationship.property.mapper.class_, expand[name])
+	return loader
+
+def with_expanded(query, *relationships):
+	expand = json_options()['expand']
+	for relationship in relationships:
+		if relationship.key in expand:
+			query = query.options(_expand_loader(db.joinedload(relationship),
+				relationship.property.mapper.class_, expand[relationship.key]))
+	return query
+
+# 要计入版本的关联对象: 展开的, 加上不展开时 url 也引用其字段的 (json_linked)
+def _versioned(model, expand):
+	names = dict((name, expand[name]) for name in expand
+		if name in model.json_expandable)
+	for name in model.json_linked:
+		names.setdefault(name, {})
+	return names
+
+# 展开或引用的关联对象(含多层)的 updated_at, 计入单个资源的版本
+def expanded_timestamps(obj, expand=None):
+	if expand is None:
+		expand = json_options()['expand']
+	timestamps = []
+	for name, subtree in _versioned(type(obj), expand).items():
+		related = getattr(obj, name)
+		if related is not None:
+			timestamps.append(related.updated_at)
+			timestamps.extend(expanded_timestamps(related, subtree))
+	return timestamps
+
+# 列表的版本还要算上关联表 updated_at 的最大值: 展开时内嵌整个对象,
+# 不展开时 url 中也有作者的用户名. 多层展开逐层用别名 join
+def _join_expanded(query, columns, relationship, expand):
+	target = db.aliased(relationship.property.mapper.class_)
+	query = query.join(target, relationship)
+	columns.append(target.updated_at)
+	for name, subtree in _versioned(relationship.property.mapper.class_, expand).items():
+		query = _join_expanded(query, columns, getattr(target, name), subtree)
+	return query
+
+def join_expanded(query, columns, *relationships):
+	columns = list(columns)
+	expand = json_options()['expand']
+	for relationship in relationships:
+		if relationship.key in expand or \
+			relationship.key in relationship.class_.json_linked:
+			query = _join_expanded(query, columns, relationship,
+				expand.get(relationship.key, {}))
+	return query, columns
@@ -0,0 +1,73 @@
+import base64
+from datetime import datetime
+from flask import request, url_for
+from .. import db
+from ..exceptions import ValidationError
+
+CURSOR_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def cursor_requested():
+	return 'cursor' in request.args
+
+def encode_cursor(timestamp, id):
+	value = '%s|%d' % (timestamp.strftime(CURSOR_TIME_FORMAT), id)
+	return base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+	try:
+		value = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+		timestamp, id = value.split('|')
+		return datetime.strptime(timestamp, CURSOR_TIME_FORMAT), int(id)
+	except (ValueError, TypeError, UnicodeError):
+		raise ValidationError('invalid cursor')
+
+# 按 (timestamp, id) 做 keyset 分页, 不用 OFFSET, 总数只在 ?count=1 时计算.
+# 排序列不在结果对象上时 (例如按 timelines 的列排序文章), 用 keys 指定读取的属性名
+def keyset_paginate(query, columns, per_page, descending=False, keys=None):
+	timestamp_column, id_column = columns
+	timestamp_key, id_key = keys or (timestamp_column.key, id_column.key)
+	total = None
+	if request.args.get('count', 0, type=int):
+		total = query.order_by(None).count()
+	cursor = request.args.get('cursor')
+	if cursor:
+		timestamp, id = decode_cursor(cursor)
+		if descending:
+			query = query.filter(db.or_(timestamp_column < timestamp,
+				db.and_(timestamp_column == timestamp, id_column < id)))
+		else:
+			query = query.filter(db.or_(timestamp_column > timestamp,
+				db.and_(timestamp_column == timestamp, id_column > id)))
+	if descending:
+		query = query.order_by(None).order_by(timestamp_column.desc(), id_column.desc())
+	else:
+		query = query.order_by(None).order_by(timestamp_column.asc(), id_column.asc())
+	items = query.limit(per_page + 1).all()
+	next_cursor = None
+	if len(items) > per_page:
+		items = items[:per_page]
+		last = items[-1]
+		next_cursor = encode_cursor(getattr(last, timestamp_key), getattr(last, id_key))
+	return items, next_cursor, total
+
+# 上一页/下一页的链接带上 fields/expand/count, 翻页后返回的字段和第一页一致
+def page_url(endpoint, **kwargs):
+	for name in ('fields', 'expand', 'count'):
+		if name in request.args:
+			kwargs.setdefault(name, request.args[name])
+	return url_for(endpoint, _external=True, **kwargs)
+
+def cursor_response(name, items, endpoint, next_cursor, total, **kwargs):
+	if total is not None:
+		kwargs['count'] = 1
+	next = None
+	if next_cursor is not None:
+		next = page_url(endpoint, cursor=next_cursor, **kwargs)
+	response = {
+		name: items,
+		'next': next
+	}
+	if total is not None:
+		response[name + '_count'] = total
+	return response
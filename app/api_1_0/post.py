@@ -1,23 +1,61 @@
-from flask import request, g, current_app, jsonify, url_for
+from flask import request, g, current_app, jsonify
+from ..response_cache import response_cache
 from . import api
-from ..models import Post, Permission
+from ..models import Post, Permission, Comment
 from .decorators import permission_required
 from .errors import forbidden
+from .pagination import cursor_requested, keyset_paginate, cursor_response, page_url
+from .conditional import conditional, resource_version, collection_version
+from .batch import batch_requested, batch_keys, batch_lookup, batch_response, \
+	batch_items, item_text, item_error
+from .fields import serialize, with_expanded, expanded_timestamps, join_expanded
 from app import db
+from ..queries import posts_with_authors, comments_with_commentators
+
+
+def posts_version():
+	query = Post.query
+	if batch_requested('ids'):
+		query = query.filter(Post.id.in_(batch_keys('ids')))
+	query, columns = join_expanded(query, [Post.updated_at], Post.author)
+	return collection_version(query, *columns)
+
+def post_version(id):
+	post = posts_with_authors().filter(Post.id == id).first_or_404()
+	return resource_version(post.updated_at, post.author.username,
+		*expanded_timestamps(post))
+
+def post_comments_version(id):
+	query, columns = join_expanded(Post.query.get_or_404(id).comments,
+		[Comment.updated_at], Comment.commentator, Comment.post)
+	return collection_version(query, *columns)
+
 
 @api.route('/posts/')
+@conditional(posts_version)
+@response_cache.cached(['posts', 'users'], user=lambda: g.current_user)
 def get_posts():
+	if batch_requested('ids'):
+		posts, missing = batch_lookup(posts_with_authors(), Post.id, batch_keys('ids'))
+		return jsonify(batch_response('posts', [serialize(post) for post in posts],
+			missing))
+	if cursor_requested():
+		posts, cursor, total = keyset_paginate(posts_with_authors(),
+			(Post.timestamp, Post.id), current_app.config['POST_PER_PAGE'],
+			descending=True)
+		return jsonify(cursor_response('posts', [serialize(post) for post in posts],
+			'api.get_posts', cursor, total))
 	page = request.args.get('page', 1, type=int)
-	pagination = Post.query.order_by(Post.timestamp.desc()).paginate(page=page,
+	pagination = posts_with_authors().order_by(Post.timestamp.desc()).paginate(page=page,
 		per_page=current_app.config['POST_PER_PAGE'], error_out=False)
 	prev = None
 	next = None
 	if pagination.has_prev:
-		prev = url_for('api.get_posts', page=prev, _external=True)		
+		prev = page_url('api.get_posts', page=page - 1)
 	if pagination.has_next:
-		next = url_for('api.get_posts', page=next, _external=True)
+		next = page_url('api.get_posts', page=page + 1)
 	posts = {
-		'posts': [post.to_json() for post in pagination.items],
+		'posts': [serialize(post) for post in pagination.items],
 		'prev': prev,
 		'next': next,
 		'posts_count': pagination.total
@@ -35,13 +73,30 @@ def compose_post():
 	db.session.commit()
 	return jsonify({
 		'message': 'post success',
-		'post': post.to_json()
+		'post': serialize(post)
 	})
 
+# 批量发文: {"posts": [{"body": ...}, ...]}, 权限只检查一次, 全部在一个事务中写入.
+# 结果与请求逐项对应, 校验失败的项不影响其他项
+@api.route('/posts/batch', methods=['POST'])
+@permission_required(Permission.WRITE_ARTICLES)
+def compose_posts():
+	posts = []
+	for item in batch_items('posts'):
+		body = item_text(item, 'body')
+		posts.append(Post(body=body, author=g.current_user) if body else None)
+	db.session.add_all([post for post in posts if post is not None])
+	db.session.flush()
+	results = [{'status': 201, 'post': serialize(post)} if post is not None
+		else item_error('post can not be null') for post in posts]
+	db.session.commit()
+	return jsonify({'results': results})
+
 @api.route('/post/<int:id>')
+@conditional(post_version)
 def get_post(id):
 	post = Post.query.get_or_404(id)
-	return jsonify(post.to_json())
+	return jsonify(serialize(post))
 
 @api.route('/post/<int:id>', methods=['PUT'])
 @permission_required(Permission.WRITE_ARTICLES)
@@ -53,25 +108,33 @@ def edit_post(id):
 		return forbidden('post can not be null')
 	post.body = request.get_json().get('body')
 	db.session.add(post)
-	return jsonify(post.to_json())
+	return jsonify(serialize(post))
 
 @api.route('/post/<int:id>/comments/')
+@conditional(post_comments_version)
 def get_post_comments(id):
 	post = Post.query.get_or_404(id)
+	if cursor_requested():
+		comments, cursor, total = keyset_paginate(
+			with_expanded(comments_with_commentators(post.comments), Comment.post),
+			(Comment.timestamp, Comment.id),
+			current_app.config['FLASK_COMMENTS_PER_PAGE'])
+		return jsonify(cursor_response('comments',
+			[serialize(comment) for comment in comments], 'api.get_post_comments',
+			cursor, total, id=post.id))
 	page = request.args.get('page', 1, type=int)
-	pagination = post.comments.paginate(page=page,
+	pagination = with_expanded(comments_with_commentators(post.comments),
+		Comment.post).paginate(page=page,
 		per_page=current_app.config['FLASK_COMMENTS_PER_PAGE'], error_out=False)
 	prev = None
 	if pagination.has_prev:
-		prev = url_for('api.get_post_comments', id=post.id, page=page - 1,
-			_external=True)
+		prev = page_url('api.get_post_comments', id=post.id, page=page - 1)
 	next = None
 	if pagination.has_next:
-		next = url_for('api.get_post_comments', id=post.id, page=page + 1,
-			_external=True)
+		next = page_url('api.get_post_comments', id=post.id, page=page + 1)
 	return jsonify({
-		'comments': [comment.to_json() for comment in pagination.items],
+		'comments': [serialize(comment) for comment in pagination.items],
 		'prev': prev,
 		'next': next,
-		'comments_count': post.comments.count()
+		'comments_count': post.comments_count
 	})
\ No newline at end of file
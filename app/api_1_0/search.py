@@ -0,0 +1,21 @@
+from flask import request, jsonify
+from . import api
+from ..search import search_index
+from ..exceptions import ValidationError
+from .fields import serialize
+from .pagination import cursor_response
+
+
+# 全文搜索, 按相关度排序: /search?q=flask+sqlite, 翻页使用返回的 next
+@api.route('/search')
+def search():
+	q = request.args.get('q', '')
+	if not q.strip():
+		raise ValidationError('q is required')
+	results, cursor = search_index.search(q, request.args.get('cursor'))
+	return jsonify(cursor_response('results', [{
+		'type': result.kind,
+		'rank': result.score,
+		'snippet': result.highlight,
+		result.kind: serialize(result.item)
+	} for result in results], 'api.search', cursor, None, q=q))
@@ -1,57 +1,154 @@
 from . import api
-from ..models import User, Post, Follow, Comment
-from flask import jsonify, current_app, request, url_for, abort
+from .. import db
+from ..models import User, Post, Follow, Comment, Permission
+from ..queries import posts_with_authors
+from .pagination import cursor_requested, keyset_paginate, cursor_response, page_url
+from .conditional import conditional, resource_version, collection_version
+from .batch import batch_keys, batch_lookup, batch_response, batch_items, item_text, \
+	item_error
+from .decorators import permission_required
+from .fields import serialize, with_expanded, join_expanded
+from flask import jsonify, current_app, request, abort, g
+
+
+def _user_or_404(username):
+	user = User.query.filter_by(username=username).first()
+	if not user:
+		abort(404)
+	return user
+
+def users_version():
+	return collection_version(User.query.filter(
+		User.username.in_(batch_keys('usernames', str))), User.updated_at)
+
+def user_version(username):
+	return resource_version(_user_or_404(username).updated_at)
+
+def user_posts_version(username):
+	query, columns = join_expanded(_user_or_404(username).posts, [Post.updated_at],
+		Post.author)
+	return collection_version(query, *columns)
+
+def user_timeline_version(username):
+	query, columns = join_expanded(_user_or_404(username).followed_posts,
+		[Post.updated_at], Post.author)
+	return collection_version(query, *columns)
+
+def user_followed_by_version(username):
+	user = _user_or_404(username)
+	return collection_version(user.followed.filter(Follow.followed_id != user.id).
+		join(User, User.id == Follow.followed_id), Follow.timestamp, User.updated_at)
+
+def user_followers_version(username):
+	user = _user_or_404(username)
+	return collection_version(user.followers.filter(Follow.follower_id != user.id).
+		join(User, User.id == Follow.follower_id), Follow.timestamp, User.updated_at)
+
+def user_comments_version(username):
+	query, columns = join_expanded(_user_or_404(username).comments,
+		[Comment.updated_at], Comment.commentator, Comment.post)
+	return collection_version(query, *columns)
+
+
+# 按用户名批量查询: /users/?usernames=john,susan
+@api.route('/users/')
+@conditional(users_version)
+def get_users():
+	users, missing = batch_lookup(User.query, User.username,
+		batch_keys('usernames', str))
+	return jsonify(batch_response('users', [serialize(user) for user in users], missing))
+
+# 批量关注: {"follows": [{"username": "susan"}, ...]}, 当前用户关注列出的用户,
+# 已关注的返回 200, 新关注的返回 201, 全部在一个事务中写入
+@api.route('/follows/batch', methods=['POST'])
+@permission_required(Permission.FOLLOW)
+def follow_users():
+	usernames = [item_text(item, 'username') for item in batch_items('follows')]
+	users = dict((user.username, user) for user in
+		User.query.filter(User.username.in_([name for name in usernames if name])))
+	following = set(id for id, in db.session.query(Follow.followed_id).filter(
+		Follow.follower_id == g.current_user.id,
+		Follow.followed_id.in_([user.id for user in users.values()])))
+	follows = []
+	results = []
+	for username in usernames:
+		user = users.get(username)
+		if not username:
+			results.append(item_error('username is required'))
+		elif user is None:
+			results.append(item_error('user not found', 404))
+		elif user.id in following:
+			results.append({'status': 200, 'username': username})
+		else:
+			follows.append(Follow(follower=g.current_user, followed=user))
+			following.add(user.id)
+			results.append({'status': 201, 'username': username})
+	db.session.add_all(follows)
+	db.session.commit()
+	return jsonify({'results': results})
 
 # 用户信息
 @api.route('/user/<username>')
+@conditional(user_version)
 def get_user(username):
 	user = User.query.filter_by(username=username).first()
 	if not user:
 		abort(404)
-	return jsonify(user.to_json())
+	return jsonify(serialize(user))
 
 # 用户posts
 @api.route('/user/<username>/posts/')
+@conditional(user_posts_version)
 def get_user_posts(username):
 	user = User.query.filter_by(username=username).first()
 	if not user:
 		abort(404)
+	if cursor_requested():
+		posts, cursor, total = keyset_paginate(user.posts, (Post.timestamp, Post.id),
+			current_app.config['POST_PER_PAGE'], descending=True)
+		return jsonify(cursor_response('posts', [serialize(post) for post in posts],
+			'api.get_user_posts', cursor, total, username=username))
 	page = request.args.get('page', 1, type=int)
 	pagination = user.posts.order_by(Post.timestamp.desc()).paginate(page=page,
 		per_page=current_app.config['POST_PER_PAGE'], error_out=False)
 	prev = None
 	if pagination.has_prev:
-		prev = url_for('api.get_user_posts', username=username, page=page - 1,
-			_external=True)
+		prev = page_url('api.get_user_posts', username=username, page=page - 1)
 	next = None
 	if pagination.has_next:
-		next = url_for('api.get_user_posts', username=username, page=page + 1,
-			_external=True)
+		next = page_url('api.get_user_posts', username=username, page=page + 1)
 	return jsonify({
-		'posts': [post.to_json() for post in pagination.items],
+		'posts': [serialize(post) for post in pagination.items],
 		'prev': prev,
 		'next': next,
 		'posts_count': pagination.total
 	})
 
 @api.route('/user/<username>/timeline/')
+@conditional(user_timeline_version)
 def get_user_timeline(username):
 	user = User.query.filter_by(username=username).first()
 	if not user:
 		abort(404)
+	order = user.followed_posts_order
+	if cursor_requested():
+		posts, cursor, total = keyset_paginate(posts_with_authors(user.followed_posts),
+			order, current_app.config['POST_PER_PAGE'], descending=True,
+			keys=('timestamp', 'id'))
+		return jsonify(cursor_response('posts', [serialize(post) for post in posts],
+			'api.get_user_timeline', cursor, total, username=username))
 	page = request.args.get('page', 1, type=int)
-	pagination = user.followed_posts.order_by(Post.timestamp.desc()).paginate(page=page,
+	pagination = posts_with_authors(user.followed_posts).order_by(
+		order[0].desc()).paginate(page=page,
 		per_page=current_app.config['POST_PER_PAGE'], error_out=False)
 	prev = None
 	if pagination.has_prev:
-		prev = url_for('api.get_user_timeline', username=username, page=page - 1,
-			_external=True)
+		prev = page_url('api.get_user_timeline', username=username, page=page - 1)
 	next = None
 	if pagination.has_next:
-		next = url_for('api.get_user_timeline', username=username, page=page + 1,
-			_external=True)
+		next = page_url('api.get_user_timeline', username=username, page=page + 1)
 	return jsonify({
-		'posts': [post.to_json() for post in pagination.items],
+		'posts': [serialize(post) for post in pagination.items],
 		'prev': prev,
 		'next': next,
 		'posts_count': pagination.total
@@ -59,24 +156,29 @@ def get_user_timeline(username):
 
 # following名单
 @api.route('/user/<username>/followed-by/')
+@conditional(user_followed_by_version)
 def get_user_followed_by(username):
 	user = User.query.filter_by(username=username).first()
 	if not user:
 		abort(404)
+	if cursor_requested():
+		follows, cursor, total = keyset_paginate(
+			user.followed.filter(Follow.followed_id != user.id),
+			(Follow.timestamp, Follow.followed_id), current_app.config['PER_PAGE'])
+		return jsonify(cursor_response('users', [serialize(f.followed) for f in follows],
+			'api.get_user_followed_by', cursor, total, username=username))
 	page = request.args.get('page', 1, type=int)
 	pagination = user.followed.filter(Follow.followed_id != user.id).\
 		order_by(Follow.timestamp.asc()).paginate(page=page,
 		per_page=current_app.config['PER_PAGE'], error_out=False)
 	prev = None
 	if pagination.has_prev:
-		prev = url_for('api.get_user_followed_by', username=username, page=page - 1,
-			_external=True)
+		prev = page_url('api.get_user_followed_by', username=username, page=page - 1)
 	next = None
 	if pagination.has_next:
-		next = url_for('api.get_user_followed_by', username=username, page=page + 1,
-			_external=True)
+		next = page_url('api.get_user_followed_by', username=username, page=page + 1)
 	return jsonify({
-		'users': [f.followed.to_json() for f in pagination.items],
+		'users': [serialize(f.followed) for f in pagination.items],
 		'prev': prev,
 		'next': next,
 		'users_count': pagination.total
@@ -84,47 +186,58 @@ def get_user_followed_by(username):
 
 # follower
 @api.route('/user/<username>/followers/')
+@conditional(user_followers_version)
 def get_user_followers(username):
 	user = User.query.filter_by(username=username).first()
 	if not user:
 		abort(404)
+	if cursor_requested():
+		follows, cursor, total = keyset_paginate(
+			user.followers.filter(Follow.follower_id != user.id),
+			(Follow.timestamp, Follow.follower_id), current_app.config['POST_PER_PAGE'])
+		return jsonify(cursor_response('users', [serialize(f.follower) for f in follows],
+			'api.get_user_followers', cursor, total, username=username))
 	page = request.args.get('page', 1, type=int)
 	pagination = user.followers.filter(Follow.follower_id !=user.id).\
 		order_by(Follow.timestamp.asc()).paginate(page=page,
 		per_page=current_app.config['POST_PER_PAGE'], error_out=False)
 	prev = None
 	if pagination.has_prev:
-		prev = url_for('api.get_user_followers', username=username, page=page - 1,
-			_external=True)
+		prev = page_url('api.get_user_followers', username=username, page=page - 1)
 	next = None
 	if pagination.has_next:
-		next = url_for('api.get_user_followers', username=username, page=page + 1,
-			_external=True)
+		next = page_url('api.get_user_followers', username=username, page=page + 1)
 	return jsonify({
-		'users': [f.follower.to_json() for f in pagination.items],
+		'users': [serialize(f.follower) for f in pagination.items],
 		'prev': prev,
 		'next': next,
 		'users_count': pagination.total
 	})
 
 @api.route('/user/<username>/comments/', methods=['GET', 'POST'])
+@conditional(user_comments_version)
 def get_user_comments(username):
 	user = User.query.filter_by(username=username).first()
 	if not user:
 		abort(404)
+	if cursor_requested():
+		comments, cursor, total = keyset_paginate(with_expanded(user.comments, Comment.post),
+			(Comment.timestamp, Comment.id), current_app.config['POST_PER_PAGE'])
+		return jsonify(cursor_response('comments',
+			[serialize(comment) for comment in comments], 'api.get_user_comments',
+			cursor, total, username=username))
 	page = request.args.get('page', 1, type=int)
-	pagination = user.comments.order_by(Comment.timestamp.asc()).paginate(page=page,
+	pagination = with_expanded(user.comments, Comment.post).order_by(
+		Comment.timestamp.asc()).paginate(page=page,
 		per_page=current_app.config['POST_PER_PAGE'], error_out=False)
 	prev = None
 	if pagination.has_prev:
-		prev = url_for('api.get_user_comments', username=username, page=page - 1,
-			_external=True)
+		prev = page_url('api.get_user_comments', username=username, page=page - 1)
 	next = None
 	if pagination.has_next:
-		next = url_for('api.get_user_comments', username=username, page=page + 1,
-			_external=True)
+		next = page_url('api.get_user_comments', username=username, page=page + 1)
 	return jsonify({
-		'comments': [comment.to_json() for comment in pagination.items],
+		'comments': [serialize(comment) for comment in pagination.items],
 		'prev': prev,
 		'next': next,
 		'comments_count': pagination.total
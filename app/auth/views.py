@@ -6,7 +6,7 @@ from .forms import LoginForm, RegistrationForm, ChangePasswordForm, \
 	ChangeEmailForm, ResetPasswordForm, ConfirmNewPasswordForm
 from .. import login_manager, db
 from ..models import User
-from ..email import send_mail
+from ..email import queue_mail
 
 
 @auth.route('/login', methods=['GET', 'POST'])
@@ -35,10 +35,11 @@ def register():
 		user = User(email=form.email.data, username=form.username.data,
 			password=form.password.data)
 		db.session.add(user)
-		db.session.commit()
+		db.session.flush()
 		token = user.generate_confirmation_token()
-		send_mail(user.email, 'Confirm Your Account', 'auth/email/confirm',
+		queue_mail(user.email, 'Confirm Your Account', 'auth/email/confirm',
 			user=user, token=token)
+		db.session.commit()
 		flash('A confirmation email has been sent to you by email.')
 		flash('Please confirm your account before you login.')
 		return redirect(url_for('auth.login'))
@@ -69,8 +70,9 @@ def resend_email():
 	if current_user.is_anonymous or current_user.confirmed:
 		return redirect(url_for('main.index'))
 	token = current_user.generate_confirmation_token()
-	send_mail(current_user.email, 'Confirm Your Account', 'auth/email/confirm',
+	queue_mail(current_user.email, 'Confirm Your Account', 'auth/email/confirm',
 			user=current_user, token=token)
+	db.session.commit()
 	flash('A confirmation email has been sent to you by email.')
 	return redirect(url_for('.unconfirmed'))
 
@@ -94,8 +96,9 @@ def change_email():
 	form = ChangeEmailForm()
 	if form.validate_on_submit():
 		token = current_user.generate_change_email_token(form.email.data)
-		send_mail(form.email.data, 'Confirm your new email address', 
+		queue_mail(form.email.data, 'Confirm your new email address', 
 			'auth/email/change-email-confirm', user=current_user, token=token)
+		db.session.commit()
 		flash('A confirmation email has been sent to you.')
 	return render_template('auth/change-email.html', form=form)
 
@@ -115,8 +118,9 @@ def reset_password():
 		user = User.query.filter_by(email=form.email.data).first()
 		if user is not None:
 			token = user.generate_reset_password_token()
-			send_mail(user.email, 'reset password', 
+			queue_mail(user.email, 'reset password', 
 				'auth/email/reset-password-confirm', user=user, token=token)
+			db.session.commit()
 			flash('A email has sent to you, '
 				'please check your email box to reset password')
 	return render_template('auth/reset-password.html', form=form)
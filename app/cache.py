@@ -0,0 +1,56 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+# 线程安全的 LRU 缓存, 可选 TTL, 并记录命中率
+class LRUCache(object):
+	def __init__(self, maxsize=1024, ttl=None):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.hits = 0
+		self.misses = 0
+		self._entries = OrderedDict()
+		self._lock = Lock()
+
+	def get(self, key, default=None):
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None and (entry[0] is None or entry[0] > time.time()):
+				self._entries.move_to_end(key)
+				self.hits += 1
+				return entry[1]
+			if entry is not None:
+				del self._entries[key]
+			self.misses += 1
+			return default
+
+	def set(self, key, value, ttl=None):
+		ttl = ttl if ttl is not None else self.ttl
+		expires = time.time() + ttl if ttl is not None else None
+		with self._lock:
+			self._entries[key] = (expires, value)
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.maxsize:
+				self._entries.popitem(last=False)
+
+	def delete(self, key):
+		with self._lock:
+			self._entries.pop(key, None)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+	def __len__(self):
+		return len(self._entries)
+
+	def stats(self):
+		lookups = self.hits + self.misses
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+			'size': len(self._entries),
+			'maxsize': self.maxsize
+		}
@@ -0,0 +1,68 @@
+import hashlib
+import hmac
+from flask import current_app
+from werkzeug.security import generate_password_hash
+from .cache import LRUCache
+
+
+# HTTP Basic 认证的短期缓存: 以 HMAC(SECRET_KEY, email + 密码) 为键,
+# 记住验证通过的 (用户 id, 密码哈希), 避免每个请求都做一次慢哈希.
+# 密码哈希变了 (改密码 / 重新哈希) 缓存项即作废; 用户由 identity_cache 取出,
+# 命中时会对照数据库中的密码哈希, 其他进程改密码后下一个请求即返回 401
+class CredentialCache(object):
+	def __init__(self, app=None):
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		app.config.setdefault('FLASK_CREDENTIAL_CACHE_SIZE', 10000)
+		app.config.setdefault('FLASK_CREDENTIAL_CACHE_TTL', 60)
+		app.config.setdefault('FLASK_PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+		app.extensions['credential_cache'] = LRUCache(
+			app.config['FLASK_CREDENTIAL_CACHE_SIZE'], app.config['FLASK_CREDENTIAL_CACHE_TTL'])
+
+	@property
+	def cache(self):
+		return current_app.extensions['credential_cache']
+
+	def _key(self, email, password):
+		secret = current_app.config['SECRET_KEY']
+		return hmac.new(secret.encode('utf-8'),
+			(email + '\0' + password).encode('utf-8'), hashlib.sha256).digest()
+
+	def get(self, email, password):
+		key = self._key(email, password)
+		entry = self.cache.get(key)
+		if entry is None:
+			return None
+		from .identity import identity_cache
+		user = identity_cache.get_user(entry[0])
+		if user is None or user.email != email or user.password_hash != entry[1]:
+			self.cache.delete(key)
+			return None
+		return user
+
+	def set(self, email, password, user):
+		self.cache.set(self._key(email, password), (user.id, user.password_hash))
+
+	def clear(self):
+		self.cache.clear()
+
+	def stats(self):
+		return self.cache.stats()
+
+
+credential_cache = CredentialCache()
+
+
+def hash_password(password):
+	return generate_password_hash(password,
+		method=current_app.config['FLASK_PASSWORD_HASH_METHOD'])
+
+# 已保存的哈希与当前配置的算法/迭代次数不一致时需要重新哈希
+def password_needs_rehash(password_hash):
+	method = current_app.config['FLASK_PASSWORD_HASH_METHOD']
+	methods = current_app.extensions.setdefault('password_hash_methods', {})
+	if method not in methods:
+		methods[method] = hash_password('').split('$', 1)[0]
+	return password_hash.split('$', 1)[0] != methods[method]
@@ -0,0 +1,140 @@
+import os
+import random
+from functools import partial
+from threading import Lock
+from flask_sqlalchemy import SQLAlchemy as _SQLAlchemy, SignallingSession, \
+	_EngineConnector as _BaseConnector, get_state
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import Select, CompoundSelect
+
+
+def _is_file_sqlite(url):
+	return url.drivername.startswith('sqlite') and \
+		url.database not in (None, '', ':memory:')
+
+def _set_pragmas(pragmas, attached, dbapi_connection, connection_record):
+	cursor = dbapi_connection.cursor()
+	try:
+		for name, value in pragmas:
+			cursor.execute('PRAGMA %s = %s' % (name, value))
+		for name, path in attached:
+			cursor.execute('ATTACH DATABASE ? AS "%s"' % name, (path,))
+	finally:
+		cursor.close()
+
+
+class _EngineConnector(_BaseConnector):
+	def __init__(self, *args, **kwargs):
+		super(_EngineConnector, self).__init__(*args, **kwargs)
+		self._configured = None
+		self._configure_lock = Lock()
+
+	def get_engine(self):
+		engine = super(_EngineConnector, self).get_engine()
+		if self._configured is not engine:
+			with self._configure_lock:
+				if self._configured is not engine:
+					self._sa.configure_engine(self._app, engine, self._bind)
+					self._configured = engine
+		return engine
+
+
+# 读写分离: 配置了 FLASK_DB_REPLICAS 时, 只读查询发往其中一个只读副本;
+# 一旦本 session 有写入(flush 或 UPDATE/DELETE 等语句), 之后的读也都走主库,
+# 直到请求结束 session 被移除, 避免读到副本尚未同步的数据
+class RoutingSession(SignallingSession):
+	def get_bind(self, mapper=None, clause=None):
+		replicas = self.app.config.get('FLASK_DB_REPLICAS')
+		if replicas and not self.info.get('use_primary'):
+			if self._flushing or not isinstance(clause, (Select, CompoundSelect)):
+				self.info['use_primary'] = True
+			elif mapper is None or \
+				get_state(self.app).db.table_bind_key(mapper.mapped_table, self.app) is None:
+				replica = self.info.get('replica')
+				if replica is None:
+					replica = self.info['replica'] = random.choice(replicas)
+				return get_state(self.app).db.get_engine(self.app, bind=replica)
+		return super(RoutingSession, self).get_bind(mapper, clause)
+
+	def use_primary(self):
+		self.info['use_primary'] = True
+
+	# 不切换整个 session, 只让一条必须读到最新数据的语句走主库:
+	# db.session.execute(stmt, bind=db.session().primary_bind(Model.__mapper__))
+	def primary_bind(self, mapper=None):
+		return super(RoutingSession, self).get_bind(mapper)
+
+
+# 在 Flask-SQLAlchemy 的基础上: SQLite 文件库按 FLASK_SQLITE_PRAGMAS 在每个新连接上
+# 设置 PRAGMA, 配置了 SQLALCHEMY_POOL_SIZE 时使用连接池而不是 NullPool
+class SQLAlchemy(_SQLAlchemy):
+	def create_session(self, options):
+		return RoutingSession(self, **options)
+
+	def make_connector(self, app, bind=None):
+		return _EngineConnector(self, app, bind)
+
+	def apply_driver_hacks(self, app, info, options):
+		super(SQLAlchemy, self).apply_driver_hacks(app, info, options)
+		if _is_file_sqlite(info) and options.get('pool_size'):
+			options['poolclass'] = QueuePool
+			options.setdefault('connect_args', {})['check_same_thread'] = False
+
+	def configure_engine(self, app, engine, bind=None):
+		if not _is_file_sqlite(engine.url):
+			return
+		pragmas = sorted((app.config.get('FLASK_SQLITE_PRAGMAS') or {}).items())
+		attached = self.attached_databases(app, bind)
+		if pragmas or attached:
+			event.listen(engine, 'connect', partial(_set_pragmas, pragmas, attached))
+
+	# FLASK_TABLE_BINDS 把表名映射到 SQLALCHEMY_BINDS 的键, 优先于模型的 __bind_key__
+	def table_bind_key(self, table, app=None):
+		binds = self.get_app(app).config.get('FLASK_TABLE_BINDS') or {}
+		return binds.get(table.name, table.info.get('bind_key'))
+
+	def get_tables_for_bind(self, bind=None):
+		return [table for table in self.Model.metadata.tables.values()
+			if self.table_bind_key(table) == bind]
+
+	# 存放了表的 bind (不含只读副本), migrations/env.py 按它们分别生成迁移
+	def table_binds(self, app=None):
+		return sorted(set(key for key in (self.table_bind_key(table, app)
+			for table in self.Model.metadata.tables.values()) if key is not None))
+
+	# 拆分出去的 SQLite 库互相 ATTACH, 这样任意一个连接都能用不带前缀的表名
+	# 做跨库 JOIN. 每张表只存在于一个库中, 所以表名不会有歧义.
+	# 注意 ATTACH 进来的库是另一个连接上的独立读事务: 本 session 在另一个 bind
+	# 的连接上尚未提交的写入, 跨库读取时看不到, 要在提交之后才可见
+	def attached_databases(self, app, bind=None):
+		keys = set((app.config.get('FLASK_TABLE_BINDS') or {}).values())
+		if not keys or (bind is not None and bind not in keys):
+			return []
+		uris = dict((key, app.config['SQLALCHEMY_BINDS'][key]) for key in keys)
+		uris[None] = app.config['SQLALCHEMY_DATABASE_URI']
+		attached = []
+		for key, uri in sorted(uris.items(), key=lambda item: item[0] or ''):
+			url = make_url(uri)
+			if key == bind or not _is_file_sqlite(url):
+				continue
+			attached.append((key or 'primary', os.path.join(app.root_path, url.database)))
+		return attached
+
+	# 当前生效的数据库设置, 供 manager.py dbinfo 使用
+	def diagnostics(self, app=None, bind=None):
+		app = self.get_app(app)
+		engine = self.get_engine(app, bind)
+		info = {
+			'url': repr(engine.url),
+			'pool': type(engine.pool).__name__,
+			'pool_status': engine.pool.status(),
+			'track_modifications': app.config['SQLALCHEMY_TRACK_MODIFICATIONS']
+		}
+		if engine.dialect.name == 'sqlite':
+			with engine.connect() as connection:
+				info['pragmas'] = dict((name, connection.execute('PRAGMA %s' % name).scalar())
+					for name in ('journal_mode', 'synchronous', 'busy_timeout',
+						'mmap_size', 'cache_size', 'temp_store'))
+		return info
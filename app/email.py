@@ -1,18 +1,233 @@
+import atexit
+import json
+import time
+from threading import Thread, Lock
 from flask import current_app, render_template
-from threading import Thread
 from flask_mail import Message
-from . import mail
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event
+from . import mail, db
 
-def send_mail(to, subject, template, **kwargs):
+try:
+	from queue import Queue, Empty, Full
+except ImportError:
+	from Queue import Queue, Empty, Full
+
+
+class _PoolState(object):
+	def __init__(self, app):
+		self.app = app
+		self.queue = Queue(app.config['FLASK_MAIL_QUEUE_SIZE'])
+		self.workers = []
+		self.lock = Lock()
+		self.sent = 0
+		self.failed = 0
+		self.dropped = 0
+		self.connections = 0
+		self.latency = 0.0
+		self.max_latency = 0.0
+
+
+# 固定数量的发信线程从有界队列取信, 每个 SMTP 连接连续发送多封.
+# 队列满时 send_mail 最多阻塞 FLASK_MAIL_QUEUE_TIMEOUT 秒
+class MailPool(object):
+	def __init__(self, app=None):
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		app.config.setdefault('FLASK_MAIL_WORKERS', 2)
+		app.config.setdefault('FLASK_MAIL_QUEUE_SIZE', 1000)
+		app.config.setdefault('FLASK_MAIL_QUEUE_TIMEOUT', 5)
+		app.config.setdefault('FLASK_MAIL_PER_CONNECTION', 50)
+		app.config.setdefault('FLASK_MAIL_IDLE_TIMEOUT', 2)
+		app.config.setdefault('FLASK_MAIL_OUTBOX', False)
+		app.config.setdefault('FLASK_MAIL_OUTBOX_LEASE', 300)
+		app.config.setdefault('FLASK_MAIL_MAX_ATTEMPTS', 5)
+		app.config.setdefault('FLASK_MAIL_RETRY_BACKOFF', 30)
+		app.config.setdefault('FLASK_BASE_URL', 'http://localhost:5000')
+		app.extensions['mail_pool'] = _PoolState(app)
+		atexit.register(self.shutdown, app)
+
+	def _state(self, app=None):
+		return (app or current_app).extensions['mail_pool']
+
+	def _start(self, state):
+		with state.lock:
+			if state.workers:
+				return
+			for i in range(state.app.config['FLASK_MAIL_WORKERS']):
+				thr = Thread(target=self._work, name='send_mail-%d' % i, args=(state,))
+				thr.daemon = True
+				thr.start()
+				state.workers.append(thr)
+
+	def submit(self, msg):
+		state = self._state()
+		self._start(state)
+		try:
+			state.queue.put((time.time(), msg),
+				timeout=state.app.config['FLASK_MAIL_QUEUE_TIMEOUT'])
+		except Full:
+			with state.lock:
+				state.dropped += 1
+			current_app.logger.error('mail queue is full, dropped mail to %s',
+				', '.join(msg.recipients))
+			return False
+		return True
+
+	def _work(self, state):
+		app = state.app
+		with app.app_context():
+			while True:
+				item = state.queue.get()
+				if item is None:
+					state.queue.task_done()
+					return
+				if not self._send_batch(state, item):
+					return
+
+	# 打开一个连接, 连续发送直到达到上限、队列空闲或出错
+	def _send_batch(self, state, item):
+		app = state.app
+		per_connection = app.config['FLASK_MAIL_PER_CONNECTION']
+		idle = app.config['FLASK_MAIL_IDLE_TIMEOUT']
+		sent = 0
+		try:
+			with mail.connect() as connection:
+				with state.lock:
+					state.connections += 1
+				while True:
+					current, item = item, None
+					if not self._send(state, connection, current):
+						break
+					sent += 1
+					if sent >= per_connection:
+						break
+					try:
+						item = state.queue.get(timeout=idle)
+					except Empty:
+						break
+					if item is None:
+						state.queue.task_done()
+						return False
+		except Exception:
+			app.logger.exception('SMTP connection failed')
+			if item is not None:
+				self._failed(state, item)
+		return True
+
+	def _send(self, state, connection, item):
+		queued_at, msg = item
+		try:
+			connection.send(msg)
+		except Exception:
+			state.app.logger.exception('sending mail failed')
+			self._failed(state, item)
+			return False
+		latency = time.time() - queued_at
+		with state.lock:
+			state.sent += 1
+			state.latency += latency
+			state.max_latency = max(state.max_latency, latency)
+		state.queue.task_done()
+		return True
+
+	def _failed(self, state, item):
+		with state.lock:
+			state.failed += 1
+		state.app.logger.error('mail to %s was not sent', ', '.join(item[1].recipients))
+		state.queue.task_done()
+
+	def flush(self, app=None):
+		self._state(app).queue.join()
+
+	def shutdown(self, app=None, timeout=10):
+		state = self._state(app)
+		with state.lock:
+			workers, state.workers = state.workers, []
+		for thr in workers:
+			state.queue.put(None)
+		deadline = time.time() + timeout
+		for thr in workers:
+			thr.join(max(0, deadline - time.time()))
+
+	def stats(self):
+		state = self._state()
+		return {
+			'queued': state.queue.qsize(),
+			'workers': len(state.workers),
+			'sent': state.sent,
+			'failed': state.failed,
+			'dropped': state.dropped,
+			'connections': state.connections,
+			'avg_latency': state.latency / state.sent if state.sent else 0.0,
+			'max_latency': state.max_latency
+		}
+
+
+mail_pool = MailPool()
+
+
+def make_message(to, subject, template, **kwargs):
 	msg = Message(current_app.config['FLASK_SUBJECT_PREFIX'] + subject, recipients=[to])
 	msg.html = render_template(template + '.html', **kwargs)
 	msg.body = render_template(template + '.txt', **kwargs)
-	thr = Thread(target=async_send_mail, name='send_mail', args=(current_app._get_current_object(), msg))
-	thr.start()
-	return thr
+	return msg
+
+def send_mail(to, subject, template, **kwargs):
+	return mail_pool.submit(make_message(to, subject, template, **kwargs))
+
+# 随当前事务发送邮件: 开启 FLASK_MAIL_OUTBOX 时写入 outbox 表,
+# 否则在事务提交后交给发信线程池, 回滚则不发
+def queue_mail(to, subject, template, user, **kwargs):
+	if current_app.config['FLASK_MAIL_OUTBOX']:
+		from .models import Outbox
+		Outbox.enqueue(to, subject, template, user, **kwargs)
+	else:
+		db.session.info.setdefault('pending_mail', []).append(
+			make_message(to, subject, template, user=user, **kwargs))
+
+def _submit_pending_mail(session):
+	for msg in session.info.pop('pending_mail', ()):
+		mail_pool.submit(msg)
+
+def _drop_pending_mail(session):
+	session.info.pop('pending_mail', None)
 
-def async_send_mail(app, msg):
-	with app.app_context():
-		mail.send(msg)
+event.listen(SignallingSession, 'after_commit', _submit_pending_mail)
+event.listen(SignallingSession, 'after_rollback', _drop_pending_mail)
 
 
+# 投递一批 outbox 中的邮件, 返回处理的条数
+def deliver_outbox(worker, batch_size=50):
+	from .models import Outbox, User
+	config = current_app.config
+	batch = Outbox.claim(worker, batch_size, config['FLASK_MAIL_OUTBOX_LEASE'])
+	if not batch:
+		return 0
+	try:
+		with mail.connect() as connection:
+			for item in batch:
+				try:
+					context = json.loads(item.context)
+					context['user'] = User.query.get(context.pop('user_id'))
+					with current_app.test_request_context(base_url=config['FLASK_BASE_URL']):
+						msg = make_message(item.recipient, item.subject, item.template,
+							**context)
+					connection.send(msg)
+				except Exception as e:
+					current_app.logger.exception('delivering outbox mail %s failed', item.id)
+					item.mark_failed(repr(e), config['FLASK_MAIL_MAX_ATTEMPTS'],
+						config['FLASK_MAIL_RETRY_BACKOFF'])
+				else:
+					item.mark_sent()
+				db.session.commit()
+	except Exception as e:
+		current_app.logger.exception('SMTP connection failed')
+		for item in batch:
+			if item.claimed_by == worker:
+				item.mark_failed(repr(e), config['FLASK_MAIL_MAX_ATTEMPTS'],
+					config['FLASK_MAIL_RETRY_BACKOFF'])
+		db.session.commit()
+	return len(batch)
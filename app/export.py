@@ -0,0 +1,79 @@
+import json
+import zlib
+from datetime import datetime
+from . import db
+from .exceptions import ValidationError
+from .models import User, Post, Comment
+
+# 导出的列: 直接读表, 不经过 ORM 对象和 to_json
+EXPORTS = {
+	'users': (User, ('id', 'username', 'email', 'role_id', 'confirmed', 'name',
+		'location', 'about_me', 'member_since', 'last_seen', 'updated_at', 'avatar_hash',
+		'posts_count', 'comments_count', 'followed_count', 'followers_count')),
+	'posts': (Post, ('id', 'author_id', 'body', 'body_html', 'timestamp', 'updated_at',
+		'comments_count')),
+	'comments': (Comment, ('id', 'post_id', 'author_id', 'body', 'body_html',
+		'disabled', 'timestamp', 'updated_at'))
+}
+
+SINCE_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+
+
+def parse_since(value):
+	if not value:
+		return None
+	for format in SINCE_FORMATS:
+		try:
+			return datetime.strptime(value, format)
+		except ValueError:
+			pass
+	raise ValidationError('invalid since: %r' % value)
+
+def _default(value):
+	if isinstance(value, datetime):
+		return value.isoformat()
+	raise TypeError(repr(value))
+
+# 按主键 keyset 分批读取, 每批 batch_size 行, 内存占用与总行数无关;
+# since 只导出 updated_at 不早于该时间的行, 用于增量同步
+def export_rows(kind, since=None, batch_size=1000):
+	if kind not in EXPORTS:
+		raise ValidationError('unknown export: %s' % kind)
+	model, names = EXPORTS[kind]
+	table = model.__table__
+	columns = [table.c[name] for name in names]
+	query = db.select(columns).order_by(table.c.id).limit(batch_size)
+	if since is not None:
+		query = query.where(table.c.updated_at >= since)
+	last_id = 0
+	while True:
+		rows = db.session.execute(query.where(table.c.id > last_id),
+			mapper=model.__mapper__).fetchall()
+		for row in rows:
+			yield dict(zip(names, row))
+		if len(rows) < batch_size:
+			break
+		last_id = rows[-1].id
+
+# 每行一个 JSON 对象, 攒够 chunk_size 字节再输出一块
+def export_lines(kind, since=None, batch_size=1000, chunk_size=64 * 1024):
+	buffer = []
+	size = 0
+	for row in export_rows(kind, since, batch_size):
+		line = (json.dumps(row, default=_default, sort_keys=True) + '\n').encode('utf-8')
+		buffer.append(line)
+		size += len(line)
+		if size >= chunk_size:
+			yield b''.join(buffer)
+			buffer = []
+			size = 0
+	if buffer:
+		yield b''.join(buffer)
+
+def gzip_chunks(chunks, level=6):
+	compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+	for chunk in chunks:
+		data = compressor.compress(chunk)
+		if data:
+			yield data
+	yield compressor.flush()
@@ -0,0 +1,155 @@
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from threading import Lock
+from flask import current_app
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+
+# 只读的用户 id 集合: 有序 array 存储, id 足够密集时再建一个位图, 查询 O(1)
+class IdSet(object):
+	def __init__(self, ids=()):
+		ids = sorted(set(ids))
+		self._ids = array('l', ids)
+		self._bitmap = None
+		if ids and ids[-1] < len(ids) * 64:
+			bitmap = bytearray(ids[-1] // 8 + 1)
+			for id in ids:
+				bitmap[id >> 3] |= 1 << (id & 7)
+			self._bitmap = bitmap
+
+	def __contains__(self, id):
+		if self._bitmap is not None:
+			index = id >> 3
+			return 0 <= index < len(self._bitmap) and \
+				bool(self._bitmap[index] & (1 << (id & 7)))
+		i = bisect_left(self._ids, id)
+		return i < len(self._ids) and self._ids[i] == id
+
+	def __len__(self):
+		return len(self._ids)
+
+	def __iter__(self):
+		return iter(self._ids)
+
+	def intersection(self, other):
+		if len(other) < len(self):
+			self, other = other, self
+		return IdSet(id for id in self if id in other)
+
+
+class _GraphState(object):
+	def __init__(self, maxsize, ttl):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.entries = OrderedDict()
+		# 正在加载的键: [加载中的线程数, 代数], 加载期间被失效则代数加一
+		self.loading = {}
+		self.lock = Lock()
+
+
+# 进程内的关注关系缓存: 按需从 follows 表加载, LRU 淘汰,
+# Follow 行变化时失效, TTL 限制其他进程写入带来的过期时间
+class FollowGraph(object):
+	def __init__(self, app=None):
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		app.config.setdefault('FLASK_FOLLOW_CACHE_SIZE', 10000)
+		app.config.setdefault('FLASK_FOLLOW_CACHE_TTL', 300)
+		app.extensions['follow_graph'] = _GraphState(
+			app.config['FLASK_FOLLOW_CACHE_SIZE'], app.config['FLASK_FOLLOW_CACHE_TTL'])
+
+	@property
+	def _state(self):
+		return current_app.extensions['follow_graph']
+
+	def _get(self, key, load):
+		state = self._state
+		now = time.time()
+		with state.lock:
+			entry = state.entries.get(key)
+			if entry is not None and entry[0] > now:
+				state.entries.move_to_end(key)
+				return entry[1]
+			loading = state.loading.setdefault(key, [0, 0])
+			loading[0] += 1
+			generation = loading[1]
+		ids = None
+		try:
+			ids = IdSet(load())
+		finally:
+			with state.lock:
+				loading[0] -= 1
+				if not loading[0]:
+					del state.loading[key]
+				# 加载期间发生过失效, 结果可能已过期, 只返回不缓存
+				if ids is not None and loading[1] == generation:
+					state.entries[key] = (now + state.ttl, ids)
+					state.entries.move_to_end(key)
+					while len(state.entries) > state.maxsize:
+						state.entries.popitem(last=False)
+		return ids
+
+	def following(self, user_id):
+		from .models import Follow
+		return self._get(('following', user_id), lambda: [id for id, in
+			Follow.query.with_entities(Follow.followed_id).filter_by(follower_id=user_id)])
+
+	def followers(self, user_id):
+		from .models import Follow
+		return self._get(('followers', user_id), lambda: [id for id, in
+			Follow.query.with_entities(Follow.follower_id).filter_by(followed_id=user_id)])
+
+	def is_following(self, user_id, other_id):
+		return other_id in self.following(user_id)
+
+	def is_followed_by(self, user_id, other_id):
+		return other_id in self.followers(user_id)
+
+	def following_count(self, user_id):
+		return len(self.following(user_id))
+
+	def followers_count(self, user_id):
+		return len(self.followers(user_id))
+
+	def mutual(self, user_id):
+		return self.following(user_id).intersection(self.followers(user_id))
+
+	def invalidate(self, *user_ids):
+		state = self._state
+		with state.lock:
+			for user_id in user_ids:
+				for key in (('following', user_id), ('followers', user_id)):
+					state.entries.pop(key, None)
+					if key in state.loading:
+						state.loading[key][1] += 1
+
+	def clear(self):
+		state = self._state
+		with state.lock:
+			state.entries.clear()
+			for loading in state.loading.values():
+				loading[1] += 1
+
+	def on_follow_change(self, mapper, connection, target):
+		self.invalidate(target.follower_id, target.followed_id)
+		session = object_session(target)
+		if session is not None:
+			session.info.setdefault('follow_graph_dirty', set()).update(
+				(target.follower_id, target.followed_id))
+
+	def on_session_end(self, session, *args):
+		dirty = session.info.pop('follow_graph_dirty', None)
+		if dirty:
+			self.invalidate(*dirty)
+
+
+follow_graph = FollowGraph()
+
+event.listen(SignallingSession, 'after_commit', follow_graph.on_session_end)
+event.listen(SignallingSession, 'after_rollback', follow_graph.on_session_end)
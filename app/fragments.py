@@ -0,0 +1,39 @@
+from flask import current_app, request
+from jinja2 import Markup
+from .cache import LRUCache
+
+
+# 模板片段缓存, 在模板中这样使用:
+#	{% call fragment_cache('post', post.id, post.updated_at) %}...{% endcall %}
+# 键由调用方给出的版本信息组成, 内容变化后键随之变化, 旧片段由 LRU 淘汰
+class FragmentCache(object):
+	def __init__(self, app=None):
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		app.config.setdefault('FLASK_FRAGMENT_CACHE', True)
+		app.config.setdefault('FLASK_FRAGMENT_CACHE_SIZE', 4096)
+		app.extensions['fragment_cache'] = LRUCache(app.config['FLASK_FRAGMENT_CACHE_SIZE'])
+		app.add_template_global(self.fragment, 'fragment_cache')
+
+	@property
+	def cache(self):
+		return current_app.extensions['fragment_cache']
+
+	def fragment(self, *key, **kwargs):
+		caller = kwargs.pop('caller')
+		if not current_app.config['FLASK_FRAGMENT_CACHE']:
+			return caller()
+		key = key + (request.is_secure,)
+		html = self.cache.get(key)
+		if html is None:
+			html = caller()
+			self.cache.set(key, html)
+		return Markup(html)
+
+	def stats(self):
+		return self.cache.stats()
+
+
+fragment_cache = FragmentCache()
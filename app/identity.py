@@ -0,0 +1,88 @@
+from flask import current_app
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from .cache import LRUCache
+
+
+def _columns(instance):
+	return dict((attr.key, getattr(instance, attr.key))
+		for attr in inspect(instance).mapper.column_attrs)
+
+def _restore(model, columns):
+	instance = model.__mapper__.class_manager.new_instance()
+	for key, value in columns.items():
+		set_committed_value(instance, key, value)
+	make_transient_to_detached(instance)
+	return instance
+
+
+# 跨请求缓存用户及其角色的快照, 供 load_user 和 token 认证使用.
+# 命中时只按主键查一次 VERSION_COLUMNS, 与快照一致就用 merge(load=False)
+# 直接放回 session, 不再加载整行和角色. 这样其他进程改了密码、邮箱、确认状态
+# 或角色后立即生效; 其余资料字段和角色本身的权限最多过期 TTL 秒.
+# 配置了只读副本时, 版本检查和未命中时的加载都走主库, 不受副本延迟影响
+class IdentityCache(object):
+	VERSION_COLUMNS = ('email', 'password_hash', 'confirmed', 'role_id')
+
+	def __init__(self, app=None):
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		app.config.setdefault('FLASK_IDENTITY_CACHE_SIZE', 10000)
+		app.config.setdefault('FLASK_IDENTITY_CACHE_TTL', 300)
+		app.extensions['identity_cache'] = LRUCache(
+			app.config['FLASK_IDENTITY_CACHE_SIZE'], app.config['FLASK_IDENTITY_CACHE_TTL'])
+
+	@property
+	def cache(self):
+		return current_app.extensions['identity_cache']
+
+	def get_user(self, user_id):
+		from . import db
+		from .models import User, Role
+		if user_id is None:
+			return None
+		snapshot = self.cache.get(user_id)
+		if snapshot is not None and self._version(user_id) != \
+			tuple(snapshot[0][name] for name in self.VERSION_COLUMNS):
+			self.invalidate(user_id)
+			snapshot = None
+		if snapshot is None:
+			db.session().use_primary()
+			user = User.query.options(db.joinedload(User.role)).get(user_id)
+			if user is not None:
+				self.cache.set(user_id, (_columns(user),
+					_columns(user.role) if user.role is not None else None))
+			return user
+		user = _restore(User, snapshot[0])
+		role = _restore(Role, snapshot[1]) if snapshot[1] is not None else None
+		set_committed_value(user, 'role', role)
+		return db.session.merge(user, load=False)
+
+	def _version(self, user_id):
+		from . import db
+		from .models import User
+		row = db.session.execute(db.select([getattr(User, name)
+			for name in self.VERSION_COLUMNS]).where(User.id == user_id),
+			bind=db.session().primary_bind(User.__mapper__)).first()
+		return tuple(row) if row is not None else None
+
+	def invalidate(self, user_id):
+		self.cache.delete(user_id)
+
+	def clear(self):
+		self.cache.clear()
+
+	def stats(self):
+		return self.cache.stats()
+
+	def on_user_change(self, mapper, connection, target):
+		self.invalidate(target.id)
+
+	def on_role_change(self, mapper, connection, target):
+		self.clear()
+
+
+identity_cache = IdentityCache()
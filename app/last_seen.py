@@ -0,0 +1,111 @@
+import atexit
+import time
+from datetime import datetime
+from threading import Lock, Timer
+from flask import current_app
+from sqlalchemy.orm.attributes import set_committed_value
+
+
+class _BufferState(object):
+	def __init__(self, interval, batch_size):
+		self.interval = interval
+		self.batch_size = batch_size
+		self.pending = {}
+		self.last_flush = time.time()
+		self.lock = Lock()
+		self.timer = None
+		self.flushes = 0
+		self.flushed_rows = 0
+		self.flush_seconds = 0.0
+		self.last_flush_seconds = 0.0
+
+
+# last_seen 先记在内存里, 每隔 FLASK_LAST_SEEN_INTERVAL 秒或攒够
+# FLASK_LAST_SEEN_BATCH 个用户再用一次批量 UPDATE 写回.
+# 有待写入的数据时启动一个定时器, 空闲的进程也会在 INTERVAL 秒内写回
+class LastSeenBuffer(object):
+	def __init__(self, app=None):
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		app.config.setdefault('FLASK_LAST_SEEN_INTERVAL', 60)
+		app.config.setdefault('FLASK_LAST_SEEN_BATCH', 500)
+		app.extensions['last_seen'] = _BufferState(
+			app.config['FLASK_LAST_SEEN_INTERVAL'], app.config['FLASK_LAST_SEEN_BATCH'])
+		atexit.register(self._flush_at_exit, app)
+
+	@property
+	def _state(self):
+		return current_app.extensions['last_seen']
+
+	def touch(self, user):
+		state = self._state
+		now = datetime.utcnow()
+		set_committed_value(user, 'last_seen', now)
+		with state.lock:
+			state.pending[user.id] = now
+			due = len(state.pending) >= state.batch_size or \
+				time.time() - state.last_flush >= state.interval
+			if not due and state.timer is None:
+				state.timer = Timer(state.interval, self._flush_on_timer,
+					(current_app._get_current_object(),))
+				state.timer.daemon = True
+				state.timer.start()
+		if due:
+			self.flush()
+
+	def flush(self):
+		from . import db
+		from .models import User
+		state = self._state
+		with state.lock:
+			pending, state.pending = state.pending, {}
+			state.last_flush = time.time()
+		if not pending:
+			return 0
+		start = time.time()
+		users = User.__table__
+		with db.engine.begin() as connection:
+			connection.execute(users.update().
+				where(users.c.id == db.bindparam('_id')).
+				values(last_seen=db.bindparam('_last_seen')),
+				[{'_id': id, '_last_seen': seen} for id, seen in pending.items()])
+		elapsed = time.time() - start
+		with state.lock:
+			state.flushes += 1
+			state.flushed_rows += len(pending)
+			state.flush_seconds += elapsed
+			state.last_flush_seconds = elapsed
+		current_app.logger.debug('flushed last_seen of %d users in %.1f ms',
+			len(pending), elapsed * 1000)
+		return len(pending)
+
+	def stats(self):
+		state = self._state
+		return {
+			'pending': len(state.pending),
+			'flushes': state.flushes,
+			'flushed_rows': state.flushed_rows,
+			'flush_seconds': state.flush_seconds,
+			'last_flush_seconds': state.last_flush_seconds
+		}
+
+	def _flush_on_timer(self, app):
+		with app.app_context():
+			with self._state.lock:
+				self._state.timer = None
+			try:
+				self.flush()
+			except Exception:
+				app.logger.exception('flushing last_seen failed')
+
+	def _flush_at_exit(self, app):
+		with app.app_context():
+			try:
+				self.flush()
+			except Exception:
+				app.logger.exception('flushing last_seen at exit failed')
+
+
+last_seen = LastSeenBuffer()
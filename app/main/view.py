@@ -1,16 +1,23 @@
 from flask import render_template, url_for, redirect, session, current_app, abort, \
-	flash, request, make_response
+	flash, request, make_response, jsonify
 from flask_login import login_required, current_user
-from .. import db
+from .. import db, renderer, last_seen, identity_cache, credential_cache, \
+	response_cache, fragment_cache
+from ..email import mail_pool
 from . import main
 from ..models import Role, User, Permission, Post, Follow, Comment
 from .forms import PostForm, EditProfileForm, EditProfileAdminForm, CommentForm
 from ..email import send_mail
 from ..decorators import admin_required, permission_required
+from ..queries import posts_with_authors, comments_with_commentators
+from ..search import search_index
+from ..exceptions import ValidationError
 
 @main.route('/', methods=['GET', 'POST'])
+@response_cache.cached(['posts', 'users'])
 def index():
-	form = PostForm()
+	# 只给登录用户创建表单, 匿名访问不生成 CSRF token, 页面可以缓存
+	form = PostForm() if current_user.is_authenticated else None
 	show_all = bool(request.cookies.get('show_all', 1))
 	if current_user.can(Permission.WRITE_ARTICLES) and \
 		form.validate_on_submit():
@@ -23,14 +30,17 @@ def index():
 		# posts = Post.query.filter(Post.author_id != current_user.id,
 		# 	Post.author_id.in_([u.followed_id for u in current_user.followed.all()])).\
 		# 	order_by(Post.timestamp.desc())
-		posts = current_user.followed_posts
+		timestamp, id = current_user.followed_posts_order
+		posts = current_user.followed_posts.order_by(timestamp.desc())
 	else:
 		posts = Post.query.order_by(Post.timestamp.desc())
-	pagination = posts.paginate(page=page, per_page=current_app.config['PER_PAGE'])
+	pagination = posts_with_authors(posts).paginate(page=page,
+		per_page=current_app.config['PER_PAGE'])
 	return render_template('index.html', form=form, posts=pagination.items, 
 		pagination=pagination)
 
 @main.route('/user/<username>')
+@response_cache.cached(['posts', 'users'])
 def user_profile(username):
 	user = User.query.filter_by(username=username).first()
 	if user is None:
@@ -99,10 +109,13 @@ def manage_account():
 		pagination=pagination)
 
 @main.route('/post/<int:id>', methods=['GET', 'POST'])
+@response_cache.cached(lambda id: ['post:%d' % id, 'users'])
 def post_link(id):
 	post = Post.query.get_or_404(id)
-	form = CommentForm()
-	if form.validate_on_submit():
+	form = None
+	if current_user.is_authenticated or request.method == 'POST':
+		form = CommentForm()
+	if form is not None and form.validate_on_submit():
 		if current_user.is_anonymous:
 			flash('please login to comment this post.')
 			return redirect(url_for('auth.login'))
@@ -114,8 +127,9 @@ def post_link(id):
 		return redirect(url_for('.post_link', id=post.id, page=-1))
 	page = request.args.get('page', 1, type=int)
 	if page == -1:
-		page = (post.comments.count() - 1) // current_app.config['FLASK_COMMENTS_PER_PAGE'] + 1
-	pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(page=page,
+		page = (post.comments_count - 1) // current_app.config['FLASK_COMMENTS_PER_PAGE'] + 1
+	pagination = comments_with_commentators(post.comments).order_by(
+		Comment.timestamp.asc()).paginate(page=page,
 		per_page=current_app.config['FLASK_COMMENTS_PER_PAGE'], error_out=False)
 	comments = pagination.items
 	return render_template('post-link-page.html', posts=[post], form=form,
@@ -178,6 +192,16 @@ def user_following(username):
 	return render_template('following.html', user=user, users=pagination.items,
 		pagination=pagination)
 
+@main.route('/search')
+@response_cache.cached(['posts', 'users'])
+def search():
+	q = request.args.get('q', '')
+	try:
+		results, cursor = search_index.search(q, request.args.get('cursor'))
+	except ValidationError:
+		abort(400)
+	return render_template('search.html', q=q, results=results, cursor=cursor)
+
 @main.route('/show-all')
 # @login_required
 def show_all():
@@ -197,7 +221,8 @@ def show_followed():
 @permission_required(Permission.MODERATE_COMMENTS)
 def moderate():
 	page = request.args.get('page', 1, type=int)
-	pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(page=page,
+	pagination = comments_with_commentators().order_by(
+		Comment.timestamp.desc()).paginate(page=page,
 		per_page=current_app.config['FLASK_COMMENTS_PER_PAGE'], error_out=False)
 	comments = pagination.items
 	return render_template('moderate.html', comments=comments, pagination=pagination,
@@ -221,4 +246,18 @@ def moderate_disable(id):
 	comment.disabled = True
 	db.session.add(comment)
 	db.session.commit()
-	return redirect(url_for('.moderate', page=request.args.get('page', 1, type=int)))
\ No newline at end of file
+	return redirect(url_for('.moderate', page=request.args.get('page', 1, type=int)))
+
+@main.route('/admin/stats')
+@login_required
+@admin_required
+def stats():
+	return jsonify({
+		'render_cache': renderer.stats(),
+		'last_seen': last_seen.stats(),
+		'identity_cache': identity_cache.stats(),
+		'credential_cache': credential_cache.stats(),
+		'mail': mail_pool.stats(),
+		'response_cache': response_cache.stats(),
+		'fragment_cache': fragment_cache.stats()
+	})
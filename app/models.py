@@ -1,15 +1,20 @@
 import hashlib
-import bleach
+import json
 from flask import current_app, request, url_for
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash
 from flask_login import UserMixin, AnonymousUserMixin
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from . import db, login_manager
-from datetime import datetime
+from .follow_graph import follow_graph
+from .render import renderer
+from .last_seen import last_seen
+from .identity import identity_cache
+from .credentials import hash_password, password_needs_rehash
+from .search import search_index
+from datetime import datetime, timedelta
 from forgery_py import forgery
 from random import randrange
-from markdown import markdown
 
 
 class Permission:
@@ -19,12 +24,60 @@ class Permission:
 	MODERATE_COMMENTS = 0x08
 	ADMINISTER = 0x80
 
+# 表拆分到不同的库后, 事件中对其他表的读写要用该表所在库在本事务中的连接,
+# 否则两个连接会互相等待对方的锁
+def _connection_for(connection, model):
+	if not current_app.config['FLASK_TABLE_BINDS']:
+		return connection
+	return db.session.connection(mapper=model.__mapper__)
+
+# 计数列由下面的事件维护, 漂移时用 manager.py recount 修正
+def _update_counter(connection, model, id, column, delta):
+	if id is None:
+		return
+	connection = _connection_for(connection, model)
+	table = model.__table__
+	connection.execute(table.update().where(table.c.id == id).
+		values({column: table.c[column] + delta}))
+	if model is User:
+		identity_cache.invalidate(id)
+
+# to_json 的公共部分: fields 为 None 时输出全部字段, 否则只计算其中列出的字段;
+# expand 中列出的关联对象直接内嵌, 不展开时只给出 url.
+# fields/expand 都是 {字段名: 下一层} 的嵌套字典
+def _to_json(obj, fields, expand):
+	json_obj = {}
+	for name, getter in obj.json_fields.items():
+		if fields is not None and name not in fields:
+			continue
+		if expand and name in expand and name in obj.json_expandable:
+			related = getattr(obj, name)
+			json_obj[name] = related.to_json(fields and fields[name] or None,
+				expand[name]) if related is not None else None
+		else:
+			json_obj[name] = getter(obj)
+	return json_obj
+
 class Follow(db.Model):
 	__tablename__ = 'follows'
 	follower_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
-	followed_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+	followed_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True,
+		index=True)
 	timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+	@staticmethod
+	def on_insert(mapper, connection, target):
+		_update_counter(connection, User, target.follower_id, 'followed_count', 1)
+		_update_counter(connection, User, target.followed_id, 'followers_count', 1)
+
+	@staticmethod
+	def on_delete(mapper, connection, target):
+		_update_counter(connection, User, target.follower_id, 'followed_count', -1)
+		_update_counter(connection, User, target.followed_id, 'followers_count', -1)
+
+	def cache_tags(self):
+		return ['users']
+
 class Role(db.Model):
 	__tablename__ = 'roles'
 	id = db.Column(db.Integer, primary_key=True)
@@ -67,7 +120,13 @@ class User(db.Model, UserMixin):
 	about_me = db.Column(db.Text())
 	member_since = db.Column(db.DateTime(), default=datetime.utcnow)
 	last_seen = db.Column(db.DateTime(), default=datetime.utcnow)
+	updated_at = db.Column(db.DateTime, index=True, default=datetime.utcnow,
+		onupdate=datetime.utcnow)
 	avatar_hash = db.Column(db.String(128))
+	posts_count = db.Column(db.Integer, default=0, server_default='0')
+	comments_count = db.Column(db.Integer, default=0, server_default='0')
+	followed_count = db.Column(db.Integer, default=0, server_default='0')
+	followers_count = db.Column(db.Integer, default=0, server_default='0')
 	posts = db.relationship('Post', backref='author', lazy='dynamic')
 	followers = db.relationship('Follow', backref=db.backref('followed', lazy='joined'),
 		foreign_keys=[Follow.followed_id], lazy='dynamic', cascade='all, delete-orphan')
@@ -84,8 +143,8 @@ class User(db.Model, UserMixin):
 				self.role = Role.query.filter_by(default=True).first()
 		if self.email is not None and self.avatar_hash is None:		
 			self.avatar_hash = hashlib.md5(self.email.encode('utf-8')).hexdigest()
-		if not self.is_following(self):
-			self.follow(self)
+		# 关注自己, 不在这里提交, 与用户行一起由调用方提交
+		db.session.add(Follow(follower=self, followed=self))
 
 	@property
 	def password(self):
@@ -93,10 +152,17 @@ class User(db.Model, UserMixin):
 
 	@password.setter
 	def password(self, password):
-		self.password_hash = generate_password_hash(password)
+		self.password_hash = hash_password(password)
 
+	# 验证通过后, 若哈希参数与当前配置不同则按新参数重新哈希
 	def verify_password(self, password):
-		return check_password_hash(self.password_hash, password)
+		if not check_password_hash(self.password_hash, password):
+			return False
+		if self.id is not None and password_needs_rehash(self.password_hash):
+			self.password = password
+			db.session.add(self)
+			db.session.commit()
+		return True
 
 	def generate_confirmation_token(self, expiration=3600):
 		s = Serializer(current_app.config['SECRET_KEY'], expiration)
@@ -162,7 +228,7 @@ class User(db.Model, UserMixin):
 			data = s.loads(token)
 		except:
 			return None
-		return User.query.get(data.get('id'))
+		return identity_cache.get_user(data.get('id'))
 
 	def can(self, permissions):
 		return self.role is not None and \
@@ -173,9 +239,7 @@ class User(db.Model, UserMixin):
 		return self.can(Permission.ADMINISTER)
 
 	def ping(self):
-		self.last_seen = datetime.utcnow()
-		db.session.add(self)
-		db.session.commit()
+		last_seen.touch(self)
 
 	def generate_avatar(self, size=100, default='identicon', rating='g'):
 		if request.is_secure:
@@ -201,26 +265,38 @@ class User(db.Model, UserMixin):
 			db.session.add(user)
 		db.session.commit()
 
+	# 写操作以数据库为准, 关注关系缓存只用于读
 	def follow(self, user):
-		if self.is_following(user):
+		if self.followed.filter_by(followed_id=user.id).first() is not None:
 			return True
 		follow = Follow(follower=self, followed=user)
 		db.session.add(follow)
 		db.session.commit()
 
 	def is_following(self, user):
-		return self.followed.filter_by(followed_id=user.id).first() is not None
+		if self.id is None or user.id is None:
+			return False
+		return follow_graph.is_following(self.id, user.id)
 
 	def unfollow(self, user):
-		if not self.is_following(user):
-			return True
 		unfollow = self.followed.filter_by(followed_id=user.id).first()
+		if unfollow is None:
+			return True
 		db.session.delete(unfollow)
 		db.session.commit()
 		return True
 
 	def is_followed_by(self, user):
-		return self.followers.filter_by(follower_id=user.id).first() is not None
+		if self.id is None or user.id is None:
+			return False
+		return follow_graph.is_followed_by(self.id, user.id)
+
+	def is_mutual_follow(self, user):
+		return self.is_following(user) and self.is_followed_by(user)
+
+	@property
+	def mutual_follow_ids(self):
+		return follow_graph.mutual(self.id)
 
 	@staticmethod
 	def follow_yourself():
@@ -228,35 +304,63 @@ class User(db.Model, UserMixin):
 			if not user.is_following(user):
 				user.follow(user)
 
+	@staticmethod
+	def recount():
+		users = User.__table__
+		db.session.execute(users.update().values(
+			posts_count=db.select([db.func.count(Post.id)]).
+				where(Post.author_id == users.c.id).as_scalar(),
+			comments_count=db.select([db.func.count(Comment.id)]).
+				where(Comment.author_id == users.c.id).as_scalar(),
+			followed_count=db.select([db.func.count()]).select_from(Follow.__table__).
+				where(Follow.follower_id == users.c.id).as_scalar(),
+			followers_count=db.select([db.func.count()]).select_from(Follow.__table__).
+				where(Follow.followed_id == users.c.id).as_scalar()),
+			mapper=User.__mapper__)
+		db.session.commit()
+
 	@property
 	def followed_posts(self):
+		if current_app.config['FLASK_TIMELINE_ENABLED']:
+			return Timeline.posts_for(self)
 		return Post.query.join(Follow, Follow.followed_id == Post.author_id).\
 			filter_by(follower_id=self.id)
 
-	def to_json(self):
-		json_user = {
-			'url': url_for('api.get_user', username=self.username, _external=True),
-			'username': self.username,
-			'full_name': self.name,
-			'location': self.location,
-			'last_seen': self.last_seen,
-			'member_since': self.member_since,
-			'about_me': self.about_me,
-			'avatar': self.generate_avatar(size=100),
-			'posts': url_for('api.get_user_posts', username=self.username,
-				_external=True),
-			'comments': url_for('api.get_user_comments', username=self.username,
-				_external=True),
-			'posts_count': self.posts.count(),
-			'comments_count': self.comments.count(),
-			'following': url_for('api.get_user_followed_by', username=self.username,
-				_external=True),
-			'followers': url_for('api.get_user_followers', username=self.username,
-				_external=True),
-			'following_count': self.followed.count() - 1,
-			'followers_count': self.followers.count() - 1
-		}
-		return json_user
+	# followed_posts 的排序列 (时间, id), 取出的文章上对应属性为 timestamp 和 id
+	@property
+	def followed_posts_order(self):
+		if current_app.config['FLASK_TIMELINE_ENABLED']:
+			return Timeline.order_for(self)
+		return Post.timestamp, Post.id
+
+	json_fields = {
+		'url': lambda user: url_for('api.get_user', username=user.username,
+			_external=True),
+		'username': lambda user: user.username,
+		'full_name': lambda user: user.name,
+		'location': lambda user: user.location,
+		'last_seen': lambda user: user.last_seen,
+		'member_since': lambda user: user.member_since,
+		'about_me': lambda user: user.about_me,
+		'avatar': lambda user: user.generate_avatar(size=100),
+		'posts': lambda user: url_for('api.get_user_posts', username=user.username,
+			_external=True),
+		'comments': lambda user: url_for('api.get_user_comments',
+			username=user.username, _external=True),
+		'posts_count': lambda user: user.posts_count,
+		'comments_count': lambda user: user.comments_count,
+		'following': lambda user: url_for('api.get_user_followed_by',
+			username=user.username, _external=True),
+		'followers': lambda user: url_for('api.get_user_followers',
+			username=user.username, _external=True),
+		'following_count': lambda user: user.followed_count - 1,
+		'followers_count': lambda user: user.followers_count - 1
+	}
+	json_expandable = ()
+	json_linked = ()
+
+	def to_json(self, fields=None, expand=None):
+		return _to_json(self, fields, expand)
 
 	def __repr__(self):
 		return 'In user %s' % self.username
@@ -269,14 +373,22 @@ class AnonymousUser(AnonymousUserMixin):
 	def is_administrator(self):
 		return False
 
+	def cache_tags(self):
+		return ['users']
+
 class Post(db.Model):
 	__tablename__ = 'posts'
 	id = db.Column(db.Integer, primary_key=True)
 	body = db.Column(db.Text)
 	body_html = db.Column(db.Text)
 	timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
-	author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+	updated_at = db.Column(db.DateTime, index=True, default=datetime.utcnow,
+		onupdate=datetime.utcnow)
+	author_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+	comments_count = db.Column(db.Integer, default=0, server_default='0')
 	comments = db.relationship('Comment', backref='post', lazy='dynamic')
+	allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code', 'em', 'i',
+		'li', 'ol', 'pre', 'strong', 'ul', 'h1', 'h2', 'h3', 'p']
 
 	@staticmethod
 	def generate_fake_posts():
@@ -288,25 +400,57 @@ class Post(db.Model):
 				db.session.add(post)
 		db.session.commit()
 
+	@staticmethod
+	def recount():
+		posts = Post.__table__
+		db.session.execute(posts.update().values(
+			comments_count=db.select([db.func.count(Comment.id)]).
+				where(Comment.post_id == posts.c.id).as_scalar()),
+			mapper=Post.__mapper__)
+		db.session.commit()
+
 	@staticmethod
 	def on_change_body(target, value, oldvalue, initiator):
-		allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code', 'em', 'i',
-			'li', 'ol', 'pre', 'strong', 'ul', 'h1', 'h2', 'h3', 'p']
-		target.body_html = bleach.linkify(bleach.clean(markdown(value,
-			output_format='html'), tags=allowed_tags, strip=True))
-
-	def to_json(self):
-		json_post = {
-			'url': url_for('api.get_post', id=self.id, _external=True),
-			'body': self.body,
-			'body_html': self.body_html,
-			'timestamp': self.timestamp,
-			'author': url_for('api.get_user', username=self.author.username,
-				_external=True),
-			'comments': url_for('api.get_post_comments', id=self.id, _external=True),
-			'comment_count': self.comments.count()
-		}
-		return json_post
+		if renderer.deferred():
+			target.body_html = None
+		else:
+			target.body_html = renderer.render(value, 'post')
+
+	@staticmethod
+	def on_insert(mapper, connection, target):
+		_update_counter(connection, User, target.author_id, 'posts_count', 1)
+		search_index.add(connection, 'post', target.id, target.body)
+
+	@staticmethod
+	def on_update(mapper, connection, target):
+		if db.inspect(target).attrs.body.history.has_changes():
+			search_index.add(connection, 'post', target.id, target.body)
+
+	@staticmethod
+	def on_delete(mapper, connection, target):
+		_update_counter(connection, User, target.author_id, 'posts_count', -1)
+		search_index.remove(connection, 'post', target.id)
+
+	def cache_tags(self):
+		return ['posts', 'post:%d' % self.id]
+
+	json_fields = {
+		'url': lambda post: url_for('api.get_post', id=post.id, _external=True),
+		'body': lambda post: post.body,
+		'body_html': lambda post: post.body_html,
+		'timestamp': lambda post: post.timestamp,
+		'author': lambda post: url_for('api.get_user', username=post.author.username,
+			_external=True),
+		'comments': lambda post: url_for('api.get_post_comments', id=post.id,
+			_external=True),
+		'comment_count': lambda post: post.comments_count
+	}
+	json_expandable = ('author',)
+	# 不展开时 url 里用到了作者的用户名
+	json_linked = ('author',)
+
+	def to_json(self, fields=None, expand=None):
+		return _to_json(self, fields, expand)
 
 class Comment(db.Model):
 	__tablename__ = 'comments'
@@ -314,31 +458,286 @@ class Comment(db.Model):
 	body = db.Column(db.Text)
 	body_html = db.Column(db.Text)
 	timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+	updated_at = db.Column(db.DateTime, index=True, default=datetime.utcnow,
+		onupdate=datetime.utcnow)
 	disabled = db.Column(db.Boolean)
-	author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-	post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
+	author_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+	post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), index=True)
+	allowed_tags = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i', 'strong']
 
 	@staticmethod
 	def on_change_body(target, value, oldvalue, initiator):
-		allowed_tags = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i', 'strong']
-		target.body_html = bleach.linkify(bleach.clean(markdown(value,
-			output_format='html'), tags=allowed_tags, strip=True))
-
-	def to_json(self):
-		json_comment = {
-			'url': url_for('api.get_comment', id=self.id, _external=True),
-			'body': self.body,
-			'body_html': self.body_html,
-			'timestamp': self.timestamp,
-			'commentator': url_for('api.get_user', username=self.commentator.username,
-				_external=True),
-			'post': url_for('api.get_post', id=self.post.id)
-		}
-		return json_comment
+		if renderer.deferred():
+			target.body_html = None
+		else:
+			target.body_html = renderer.render(value, 'comment')
 
+	@staticmethod
+	def on_insert(mapper, connection, target):
+		_update_counter(connection, User, target.author_id, 'comments_count', 1)
+		_update_counter(connection, Post, target.post_id, 'comments_count', 1)
+		if not target.disabled:
+			search_index.add(_connection_for(connection, Post), 'comment', target.id,
+				target.body)
+
+	# 被屏蔽的评论从搜索索引中移除, 恢复后重新加入
+	@staticmethod
+	def on_update(mapper, connection, target):
+		attrs = db.inspect(target).attrs
+		if attrs.body.history.has_changes() or attrs.disabled.history.has_changes():
+			search_index.add(_connection_for(connection, Post), 'comment', target.id,
+				None if target.disabled else target.body)
 
+	@staticmethod
+	def on_delete(mapper, connection, target):
+		_update_counter(connection, User, target.author_id, 'comments_count', -1)
+		_update_counter(connection, Post, target.post_id, 'comments_count', -1)
+		search_index.remove(_connection_for(connection, Post), 'comment', target.id)
+
+	def cache_tags(self):
+		if self.post_id is None:
+			return ['posts']
+		return ['posts', 'post:%d' % self.post_id]
+
+	json_fields = {
+		'url': lambda comment: url_for('api.get_comment', id=comment.id, _external=True),
+		'body': lambda comment: comment.body,
+		'body_html': lambda comment: comment.body_html,
+		'timestamp': lambda comment: comment.timestamp,
+		'commentator': lambda comment: url_for('api.get_user',
+			username=comment.commentator.username, _external=True),
+		'post': lambda comment: url_for('api.get_post', id=comment.post_id)
+	}
+	json_expandable = ('commentator', 'post')
+	json_linked = ('commentator',)
+
+	def to_json(self, fields=None, expand=None):
+		return _to_json(self, fields, expand)
+
+# 物化的首页时间线(写时扇出), 粉丝过多的作者仍在读时合并
+class Timeline(db.Model):
+	__tablename__ = 'timelines'
+	user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+	post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), primary_key=True,
+		index=True)
+	timestamp = db.Column(db.DateTime)
+	__table_args__ = (db.Index('ix_timelines_user_id_timestamp', 'user_id', 'timestamp'),)
+
+	@staticmethod
+	def enabled():
+		return current_app.config['FLASK_TIMELINE_ENABLED']
+
+	@staticmethod
+	def fans_out(connection, author_id):
+		followers = _connection_for(connection, User).execute(db.select([User.followers_count]).
+			where(User.id == author_id)).scalar()
+		return (followers or 0) <= current_app.config['FLASK_TIMELINE_FANOUT_LIMIT']
+
+	# 关注的作者中粉丝数超过 FANOUT_LIMIT, 需要读时合并的那些
+	@staticmethod
+	def popular_ids(user):
+		return [author_id for author_id, in db.session.query(Follow.followed_id).
+			join(User, User.id == Follow.followed_id).
+			filter(Follow.follower_id == user.id,
+				User.followers_count > current_app.config['FLASK_TIMELINE_FANOUT_LIMIT'])]
+
+	@staticmethod
+	def posts_for(user):
+		timeline = Post.query.join(Timeline, Timeline.post_id == Post.id).\
+			filter(Timeline.user_id == user.id)
+		popular_ids = Timeline.popular_ids(user)
+		if not popular_ids:
+			return timeline
+		return timeline.union(Post.query.filter(Post.author_id.in_(popular_ids)))
+
+	# 排序用的 (时间, id) 列: 只读物化时间线时按 timelines 的列排序,
+	# 可以直接在 ix_timelines_user_id_timestamp 上做范围扫描
+	@staticmethod
+	def order_for(user):
+		if Timeline.popular_ids(user):
+			return Post.timestamp, Post.id
+		return Timeline.timestamp, Timeline.post_id
+
+	@staticmethod
+	def on_post_insert(mapper, connection, target):
+		if not Timeline.enabled() or not Timeline.fans_out(connection, target.author_id):
+			return
+		connection = _connection_for(connection, Timeline)
+		connection.execute(Timeline.__table__.insert().from_select(
+			['user_id', 'post_id', 'timestamp'],
+			db.select([Follow.follower_id, db.literal(target.id),
+				db.literal(target.timestamp, db.DateTime)]).
+			where(Follow.followed_id == target.author_id)))
+		Timeline.trim_followers(connection, target.author_id)
+
+	@staticmethod
+	def on_post_delete(mapper, connection, target):
+		if Timeline.enabled():
+			_connection_for(connection, Timeline).execute(Timeline.__table__.delete().
+				where(Timeline.post_id == target.id))
+
+	@staticmethod
+	def on_follow_insert(mapper, connection, target):
+		if not Timeline.enabled() or not Timeline.fans_out(connection, target.followed_id):
+			return
+		Timeline.backfill(_connection_for(connection, Timeline),
+			target.follower_id, target.followed_id)
+
+	@staticmethod
+	def on_follow_delete(mapper, connection, target):
+		if not Timeline.enabled():
+			return
+		_connection_for(connection, Timeline).execute(Timeline.__table__.delete().where(db.and_(
+			Timeline.user_id == target.follower_id,
+			Timeline.post_id.in_(db.select([Post.id]).
+				where(Post.author_id == target.followed_id)))))
+
+	@staticmethod
+	def backfill(connection, user_id, author_id):
+		recent = db.select([Post.id, Post.timestamp]).\
+			where(Post.author_id == author_id).\
+			order_by(Post.timestamp.desc()).\
+			limit(current_app.config['FLASK_TIMELINE_LENGTH']).alias()
+		existing = db.select([Timeline.post_id]).where(Timeline.user_id == user_id)
+		connection.execute(Timeline.__table__.insert().from_select(
+			['user_id', 'post_id', 'timestamp'],
+			db.select([db.literal(user_id), recent.c.id, recent.c.timestamp]).
+				where(recent.c.id.notin_(existing))))
+		Timeline.trim(connection, user_id)
+
+	# 第 LENGTH 新的条目的时间, 条目不足 LENGTH 时为 NULL. 沿索引只走 LENGTH 步
+	@staticmethod
+	def cutoff(user_id):
+		timelines = Timeline.__table__.alias()
+		return db.select([timelines.c.timestamp]).where(timelines.c.user_id == user_id).\
+			order_by(timelines.c.timestamp.desc()).\
+			limit(1).offset(current_app.config['FLASK_TIMELINE_LENGTH'] - 1).as_scalar()
+
+	# 只保留最新的 LENGTH 条, 与第 LENGTH 条时间相同的条目一并保留
+	@staticmethod
+	def trim(connection, user_id, cutoff=None):
+		if cutoff is None:
+			cutoff = connection.execute(db.select([Timeline.cutoff(user_id)])).scalar()
+			if cutoff is None:
+				return
+		connection.execute(Timeline.__table__.delete().where(db.and_(
+			Timeline.user_id == user_id, Timeline.timestamp < cutoff)))
+
+	# 扇出后裁剪所有粉丝的时间线: 一次查出各自的截止时间, 只对超长的执行删除
+	@staticmethod
+	def trim_followers(connection, author_id):
+		for user_id, cutoff in connection.execute(db.select([Follow.follower_id,
+			Timeline.cutoff(Follow.follower_id)]).
+			where(Follow.followed_id == author_id)).fetchall():
+			if cutoff is not None:
+				Timeline.trim(connection, user_id, cutoff)
+
+	@staticmethod
+	def rebuild():
+		connection = db.session.connection()
+		connection.execute(Timeline.__table__.delete())
+		for follower_id, followed_id in db.session.query(Follow.follower_id,
+			Follow.followed_id).all():
+			if Timeline.fans_out(connection, followed_id):
+				Timeline.backfill(connection, follower_id, followed_id)
+		db.session.commit()
+
+
+# 待发送的邮件, 与触发它的用户变更在同一事务中写入, 由 manager.py mail_worker 投递
+class Outbox(db.Model):
+	__tablename__ = 'outbox'
+	id = db.Column(db.Integer, primary_key=True)
+	recipient = db.Column(db.String(64))
+	subject = db.Column(db.String(128))
+	template = db.Column(db.String(128))
+	context = db.Column(db.Text)
+	status = db.Column(db.String(16), default='pending')
+	attempts = db.Column(db.Integer, default=0)
+	next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+	claimed_by = db.Column(db.String(64))
+	claimed_until = db.Column(db.DateTime)
+	last_error = db.Column(db.Text)
+	created_at = db.Column(db.DateTime, default=datetime.utcnow)
+	sent_at = db.Column(db.DateTime)
+	__table_args__ = (db.Index('ix_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),)
+
+	@staticmethod
+	def enqueue(to, subject, template, user, **kwargs):
+		context = dict(kwargs, user_id=user.id)
+		for key, value in context.items():
+			if isinstance(value, bytes):
+				context[key] = value.decode('utf-8')
+		mail = Outbox(recipient=to, subject=subject, template=template,
+			context=json.dumps(context))
+		db.session.add(mail)
+		return mail
+
+	# 用租约认领一批到期的邮件, 租约过期未完成的会被其他 worker 重新认领.
+	# 挑选 id 也要读主库, 副本上可能还是已经发出的邮件
+	@staticmethod
+	def claim(worker, batch_size, lease):
+		db.session().use_primary()
+		now = datetime.utcnow()
+		table = Outbox.__table__
+		ids = db.select([table.c.id]).where(db.and_(
+			table.c.status == 'pending', table.c.next_attempt_at <= now,
+			db.or_(table.c.claimed_until == None, table.c.claimed_until < now))).\
+			order_by(table.c.id).limit(batch_size)
+		claimed = db.session.execute(table.update().where(db.and_(
+			table.c.id.in_([id for id, in db.session.execute(ids)]),
+			db.or_(table.c.claimed_until == None, table.c.claimed_until < now))).
+			values(claimed_by=worker, claimed_until=now + timedelta(seconds=lease))).rowcount
+		db.session.commit()
+		if not claimed:
+			return []
+		return Outbox.query.filter_by(claimed_by=worker, status='pending').\
+			order_by(Outbox.id).all()
+
+	def mark_sent(self):
+		self.status = 'sent'
+		self.sent_at = datetime.utcnow()
+		self.claimed_by = self.claimed_until = None
+		db.session.add(self)
+
+	# 失败后按指数退避重试, 超过最大次数则标记为 failed
+	def mark_failed(self, error, max_attempts, backoff):
+		self.attempts = (self.attempts or 0) + 1
+		self.last_error = error
+		if self.attempts >= max_attempts:
+			self.status = 'failed'
+		else:
+			self.next_attempt_at = datetime.utcnow() + \
+				timedelta(seconds=backoff * 2 ** (self.attempts - 1))
+		self.claimed_by = self.claimed_until = None
+		db.session.add(self)
+
+renderer.add_policy('post', Post.allowed_tags)
+renderer.add_policy('comment', Comment.allowed_tags)
+renderer.defer(Post, 'post')
+renderer.defer(Comment, 'comment')
 db.event.listen(Post.body, 'set', Post.on_change_body)
 db.event.listen(Comment.body, 'set', Comment.on_change_body)
+db.event.listen(User, 'after_update', identity_cache.on_user_change)
+db.event.listen(User, 'after_delete', identity_cache.on_user_change)
+db.event.listen(Role, 'after_update', identity_cache.on_role_change)
+db.event.listen(Role, 'after_delete', identity_cache.on_role_change)
+db.event.listen(Follow, 'after_insert', Follow.on_insert)
+db.event.listen(Follow, 'after_delete', Follow.on_delete)
+db.event.listen(Follow, 'after_insert', follow_graph.on_follow_change)
+db.event.listen(Follow, 'after_delete', follow_graph.on_follow_change)
+db.event.listen(Post, 'after_insert', Post.on_insert)
+db.event.listen(Post, 'after_delete', Post.on_delete)
+db.event.listen(Comment, 'after_insert', Comment.on_insert)
+db.event.listen(Comment, 'after_delete', Comment.on_delete)
+db.event.listen(Post, 'after_update', Post.on_update)
+db.event.listen(Post.__table__, 'after_create', search_index.on_create)
+db.event.listen(Post.__table__, 'after_drop', search_index.on_drop)
+db.event.listen(Comment, 'after_update', Comment.on_update)
+db.event.listen(Post, 'after_insert', Timeline.on_post_insert)
+db.event.listen(Post, 'after_delete', Timeline.on_post_delete)
+db.event.listen(Follow, 'after_insert', Timeline.on_follow_insert)
+db.event.listen(Follow, 'after_delete', Timeline.on_follow_delete)
+
 @login_manager.user_loader
 def load_user(user_id):
-	return User.query.get(int(user_id))
+	return identity_cache.get_user(int(user_id))
@@ -0,0 +1,14 @@
+from . import db
+from .models import Post, Comment
+
+
+# 列表页一次性把作者/评论者 join 进来, 避免每条记录再查一次
+def posts_with_authors(query=None):
+	if query is None:
+		query = Post.query
+	return query.options(db.joinedload(Post.author))
+
+def comments_with_commentators(query=None):
+	if query is None:
+		query = Comment.query
+	return query.options(db.joinedload(Comment.commentator))
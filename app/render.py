@@ -0,0 +1,148 @@
+import atexit
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import repeat
+from threading import Lock
+from bleach.linkifier import Linker
+from bleach.sanitizer import Cleaner
+from flask import current_app, has_app_context
+from flask_sqlalchemy import SignallingSession
+from markdown import markdown
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from .cache import LRUCache
+
+
+# Markdown -> 安全 HTML. 每种标签策略预先建好 Cleaner/Linker,
+# 结果按 (策略, 正文) 的哈希放进 LRU, 相同内容只渲染一次
+class BodyRenderer(object):
+	def __init__(self, app=None, maxsize=2048):
+		self.policies = {}
+		self.cache = LRUCache(maxsize)
+		self._executor = None
+		self._executor_lock = Lock()
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		app.config.setdefault('FLASK_RENDER_CACHE_SIZE', 2048)
+		app.config.setdefault('FLASK_ASYNC_RENDER', False)
+		app.config.setdefault('FLASK_RENDER_WORKERS', 2)
+		self.cache.maxsize = app.config['FLASK_RENDER_CACHE_SIZE']
+
+	def add_policy(self, name, tags):
+		digest = hashlib.sha1(repr(sorted(tags)).encode('utf-8')).hexdigest()
+		self.policies[name] = (digest, Cleaner(tags=tags, strip=True), Linker(), tags)
+
+	def render(self, body, policy):
+		digest, cleaner, linker, tags = self.policies[policy]
+		key = hashlib.sha1((digest + body).encode('utf-8')).hexdigest()
+		html = self.cache.get(key)
+		if html is None:
+			html = linker.linkify(cleaner.clean(markdown(body, output_format='html')))
+			self.cache.set(key, html)
+		return html
+
+	def stats(self):
+		return self.cache.stats()
+
+	# 异步模式: 先提交原始 body, 事务提交后由后台线程补上 body_html
+	def deferred(self):
+		return has_app_context() and current_app.config['FLASK_ASYNC_RENDER']
+
+	def defer(self, model, policy):
+		def schedule(mapper, connection, target):
+			if target.body is None or target.body_html is not None or \
+				not self.deferred():
+				return
+			session = object_session(target)
+			session.info.setdefault('pending_render', []).append((
+				current_app._get_current_object(), model.__table__, target.id,
+				target.body, policy, target.cache_tags()))
+		event.listen(model, 'after_insert', schedule)
+		event.listen(model, 'after_update', schedule)
+
+	def executor(self):
+		with self._executor_lock:
+			if self._executor is None:
+				self._executor = ThreadPoolExecutor(
+					current_app.config['FLASK_RENDER_WORKERS'])
+			return self._executor
+
+	# 解释器退出时线程池已不再接受任务, 这时直接在当前线程渲染
+	def on_commit(self, session):
+		for job in session.info.pop('pending_render', ()):
+			try:
+				self.executor().submit(self._render_later, *job)
+			except RuntimeError:
+				self._render_later(*job)
+
+	# 等待已提交的渲染全部写回, 下次提交时重新创建线程池
+	def flush(self):
+		with self._executor_lock:
+			executor, self._executor = self._executor, None
+		if executor is not None:
+			executor.shutdown(wait=True)
+
+	def on_rollback(self, session):
+		session.info.pop('pending_render', None)
+
+	def _render_later(self, app, table, id, body, policy, tags):
+		from . import db
+		from .response_cache import response_cache
+		try:
+			html = self.render(body, policy)
+			with app.app_context():
+				db.get_engine(app, db.table_bind_key(table)).execute(table.update().
+					where(db.and_(table.c.id == id, table.c.body == body)).
+					values(body_html=html))
+				response_cache.invalidate(*tags)
+		except Exception:
+			app.logger.exception('rendering %s %s failed', table.name, id)
+
+	# 标签策略变化后, 用进程池重新渲染全部已保存的正文
+	def rerender(self, model, policy, workers=None, batch_size=1000):
+		from . import db
+		table = model.__table__
+		tags = self.policies[policy][3]
+		workers = workers or os.cpu_count() or 1
+		last_id = 0
+		count = 0
+		with ProcessPoolExecutor(workers) as pool:
+			while True:
+				rows = db.session.execute(db.select([table.c.id, table.c.body]).
+					where(table.c.id > last_id).order_by(table.c.id).
+					limit(batch_size)).fetchall()
+				if not rows:
+					break
+				htmls = pool.map(render_body, [row.body for row in rows], repeat(tags),
+					chunksize=max(1, len(rows) // (workers * 4)))
+				db.session.execute(table.update().
+					where(table.c.id == db.bindparam('_id')).
+					values(body_html=db.bindparam('_html')),
+					[{'_id': row.id, '_html': html} for row, html in zip(rows, htmls)])
+				db.session.commit()
+				last_id = rows[-1].id
+				count += len(rows)
+		return count
+
+
+renderer = BodyRenderer()
+
+event.listen(SignallingSession, 'after_commit', renderer.on_commit)
+event.listen(SignallingSession, 'after_rollback', renderer.on_rollback)
+# 进程退出前把排队中的渲染写完, 不丢弃
+atexit.register(renderer.flush)
+
+
+# 进程池里使用的渲染函数, 每个子进程各自持有一个 BodyRenderer
+_process_renderer = BodyRenderer()
+
+def render_body(body, tags):
+	if body is None:
+		return None
+	policy = repr(sorted(tags))
+	if policy not in _process_renderer.policies:
+		_process_renderer.add_policy(policy, tags)
+	return _process_renderer.render(body, policy)
@@ -0,0 +1,204 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+import uuid
+from functools import wraps
+from threading import Lock
+from flask import current_app, request, session, make_response
+from flask_login import current_user
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event
+from .cache import LRUCache
+
+
+class SimpleBackend(object):
+	def __init__(self, maxsize=1024):
+		self.cache = LRUCache(maxsize)
+
+	def get(self, key):
+		return self.cache.get(key)
+
+	def set(self, key, value, ttl=None):
+		self.cache.set(key, value, ttl)
+
+	def clear(self):
+		self.cache.clear()
+
+
+# 多个进程共享的文件缓存, 每个键一个 pickle 文件, 原子替换写入
+class FileSystemBackend(object):
+	def __init__(self, directory):
+		self.directory = directory
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+	def _path(self, key):
+		return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+	def get(self, key):
+		try:
+			with open(self._path(key), 'rb') as f:
+				expires, value = pickle.load(f)
+		except (IOError, OSError, EOFError, pickle.UnpicklingError):
+			return None
+		if expires is not None and expires <= time.time():
+			return None
+		return value
+
+	def set(self, key, value, ttl=None):
+		expires = time.time() + ttl if ttl is not None else None
+		fd, tmp = tempfile.mkstemp(dir=self.directory)
+		try:
+			with os.fdopen(fd, 'wb') as f:
+				pickle.dump((expires, value), f, pickle.HIGHEST_PROTOCOL)
+			os.rename(tmp, self._path(key))
+		except Exception:
+			if os.path.exists(tmp):
+				os.remove(tmp)
+			raise
+
+	def clear(self):
+		for name in os.listdir(self.directory):
+			os.remove(os.path.join(self.directory, name))
+
+
+class _CacheState(object):
+	def __init__(self, backend, ttl):
+		self.backend = backend
+		self.ttl = ttl
+		self.locks = {}
+		self.lock = Lock()
+		self.hits = 0
+		self.misses = 0
+
+
+# 匿名用户的整页/接口响应缓存. 每个缓存项记录生成时各标签的版本号,
+# 相关的行在事务提交后更换标签版本, 旧缓存项随之失效.
+# 同一个键同时只有一个请求在生成, 其余请求等待后直接读缓存
+class ResponseCache(object):
+	def __init__(self, app=None):
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		app.config.setdefault('FLASK_RESPONSE_CACHE', 'simple')
+		app.config.setdefault('FLASK_RESPONSE_CACHE_SIZE', 1024)
+		app.config.setdefault('FLASK_RESPONSE_CACHE_DIR',
+			os.path.join(tempfile.gettempdir(), 'flasky-response-cache'))
+		app.config.setdefault('FLASK_RESPONSE_CACHE_TTL', 60)
+		kind = app.config['FLASK_RESPONSE_CACHE']
+		if kind == 'filesystem':
+			backend = FileSystemBackend(app.config['FLASK_RESPONSE_CACHE_DIR'])
+		elif kind == 'simple':
+			backend = SimpleBackend(app.config['FLASK_RESPONSE_CACHE_SIZE'])
+		else:
+			backend = None
+		app.extensions['response_cache'] = _CacheState(backend,
+			app.config['FLASK_RESPONSE_CACHE_TTL'])
+
+	@property
+	def _state(self):
+		return current_app.extensions['response_cache']
+
+	def _generations(self, backend, tags):
+		generations = []
+		for tag in tags:
+			generation = backend.get('tag:' + tag)
+			if generation is None:
+				generation = uuid.uuid4().hex
+				backend.set('tag:' + tag, generation)
+			generations.append(generation)
+		return generations
+
+	def invalidate(self, *tags):
+		backend = self._state.backend
+		if backend is not None:
+			for tag in tags:
+				backend.set('tag:' + tag, uuid.uuid4().hex)
+
+	def clear(self):
+		backend = self._state.backend
+		if backend is not None:
+			backend.clear()
+
+	def _lock_for(self, state, key):
+		with state.lock:
+			entry = state.locks.setdefault(key, [Lock(), 0])
+			entry[1] += 1
+			return entry
+
+	def _release(self, state, key, entry):
+		with state.lock:
+			entry[1] -= 1
+			if not entry[1]:
+				del state.locks[key]
+
+	# tags 是标签列表, 或根据视图参数返回标签列表的函数;
+	# user 返回当前用户, 只有匿名用户的 GET 请求会被缓存
+	def cached(self, tags, user=lambda: current_user):
+		def decorate_function(func):
+			@wraps(func)
+			def decorator(*args, **kwargs):
+				state = self._state
+				if state.backend is None or request.method != 'GET' or \
+					not user().is_anonymous or '_flashes' in session:
+					return func(*args, **kwargs)
+				key = 'page:%s|%s|%r' % (request.host_url, request.path,
+					sorted(request.args.items(multi=True)))
+				view_tags = tags(*args, **kwargs) if callable(tags) else tags
+				entry = self._lock_for(state, key)
+				try:
+					with entry[0]:
+						generations = self._generations(state.backend, view_tags)
+						cached = state.backend.get(key)
+						if cached is not None and cached[0] == generations:
+							state.hits += 1
+							return current_app.response_class(cached[1],
+								headers=cached[2], status=200)
+						state.misses += 1
+						response = make_response(func(*args, **kwargs))
+						if response.status_code == 200 and not session.modified and \
+							'Set-Cookie' not in response.headers and \
+							not response.is_streamed:
+							state.backend.set(key, (generations, response.get_data(),
+								list(response.headers.items())), state.ttl)
+						return response
+				finally:
+					self._release(state, key, entry)
+			return decorator
+		return decorate_function
+
+	def stats(self):
+		state = self._state
+		lookups = state.hits + state.misses
+		return {
+			'backend': type(state.backend).__name__,
+			'hits': state.hits,
+			'misses': state.misses,
+			'hit_rate': float(state.hits) / lookups if lookups else 0.0
+		}
+
+	# 模型通过 cache_tags() 声明其变化会影响哪些标签
+	def on_flush(self, session, flush_context):
+		tags = session.info.setdefault('response_cache_tags', set())
+		for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+			cache_tags = getattr(obj, 'cache_tags', None)
+			if cache_tags is not None:
+				tags.update(cache_tags())
+
+	def on_commit(self, session):
+		tags = session.info.pop('response_cache_tags', None)
+		if tags:
+			self.invalidate(*tags)
+
+	def on_rollback(self, session):
+		session.info.pop('response_cache_tags', None)
+
+
+response_cache = ResponseCache()
+
+event.listen(SignallingSession, 'after_flush', response_cache.on_flush)
+event.listen(SignallingSession, 'after_commit', response_cache.on_commit)
+event.listen(SignallingSession, 'after_rollback', response_cache.on_rollback)
@@ -0,0 +1,172 @@
+import base64
+import re
+from flask import current_app, has_app_context
+from jinja2 import Markup, escape
+from . import db
+from .exceptions import ValidationError
+
+# 文章和评论共用一张 FTS5 表, rowid 的最低位区分类型:
+# 文章 id * 2, 评论 id * 2 + 1
+KINDS = ('post', 'comment')
+HIGHLIGHT_START = u'\x02'
+HIGHLIGHT_END = u'\x03'
+
+
+def _rowid(kind, id):
+	return id * 2 + KINDS.index(kind)
+
+def _split_rowid(rowid):
+	return KINDS[rowid % 2], rowid // 2
+
+def encode_cursor(score, rowid):
+	value = '%r|%d' % (score, rowid)
+	return base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+	try:
+		value = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+		score, rowid = value.split('|')
+		return float(score), int(rowid)
+	except (ValueError, TypeError, UnicodeError):
+		raise ValidationError('invalid cursor')
+
+# 用户输入只取出其中的词并逐个加引号, 多个词之间为 AND,
+# 避免 FTS5 查询语法 (AND/OR/NEAR/引号/*) 造成语法错误
+def match_expression(q):
+	terms = re.findall(r'\w+', q or '', re.UNICODE)
+	return ' '.join('"%s"' % term for term in terms)
+
+def highlight(snippet):
+	return Markup(escape(snippet).replace(HIGHLIGHT_START, Markup('<mark>')).
+		replace(HIGHLIGHT_END, Markup('</mark>')))
+
+
+class SearchResult(object):
+	def __init__(self, kind, item, score, rowid, snippet):
+		self.kind = kind
+		self.item = item
+		self.score = score
+		self.rowid = rowid
+		self.snippet = snippet
+
+	@property
+	def highlight(self):
+		return highlight(self.snippet)
+
+
+# 基于 SQLite FTS5 的全文搜索. 索引表由 Post/Comment 的 mapper 事件
+# 在同一事务中更新, manager.py reindex 整体重建
+class SearchIndex(object):
+	table = 'search_index'
+
+	def __init__(self, app=None):
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		app.config.setdefault('FLASK_SEARCH_TOKENIZER', 'porter unicode61')
+		app.config.setdefault('FLASK_SEARCH_PER_PAGE', 20)
+
+	def create(self, connection):
+		tokenizer = current_app.config['FLASK_SEARCH_TOKENIZER'] \
+			if has_app_context() else 'porter unicode61'
+		connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS %s "
+			"USING fts5(body, tokenize='%s')" % (self.table, tokenizer))
+
+	# 随 posts 表一起创建和删除
+	def on_create(self, target, connection, **kw):
+		if connection.dialect.name == 'sqlite':
+			self.create(connection)
+
+	def on_drop(self, target, connection, **kw):
+		if connection.dialect.name == 'sqlite':
+			connection.execute('DROP TABLE IF EXISTS %s' % self.table)
+
+	def add(self, connection, kind, id, body):
+		if connection.dialect.name != 'sqlite':
+			return
+		rowid = _rowid(kind, id)
+		connection.execute('DELETE FROM %s WHERE rowid = ?' % self.table, (rowid,))
+		if body:
+			connection.execute('INSERT INTO %s (rowid, body) VALUES (?, ?)' % self.table,
+				(rowid, body))
+
+	def remove(self, connection, kind, id):
+		if connection.dialect.name == 'sqlite':
+			connection.execute('DELETE FROM %s WHERE rowid = ?' % self.table,
+				(_rowid(kind, id),))
+
+	# 清空后用 INSERT ... SELECT 重新填充, 被屏蔽的评论不进索引.
+	# 索引表不存在时 (升级前建的库) 先创建
+	def rebuild(self):
+		connection = self._connection()
+		self.create(connection)
+		connection.execute('DELETE FROM %s' % self.table)
+		connection.execute('INSERT INTO %s (rowid, body) SELECT id * 2, body '
+			'FROM posts WHERE body IS NOT NULL' % self.table)
+		connection.execute('INSERT INTO %s (rowid, body) SELECT id * 2 + 1, body '
+			'FROM comments WHERE body IS NOT NULL AND NOT coalesce(disabled, 0)'
+			% self.table)
+		connection.execute("INSERT INTO %s (%s) VALUES ('optimize')" %
+			(self.table, self.table))
+		count = connection.execute('SELECT count(*) FROM %s' % self.table).scalar()
+		db.session.commit()
+		return count
+
+	def _connection(self):
+		from .models import Post
+		return db.session.connection(mapper=Post.__mapper__)
+
+	# 按 bm25 排序 (越小越相关), 以 (score, rowid) 做 keyset 分页;
+	# 返回 (结果列表, 下一页 cursor)
+	def search(self, q, cursor=None, per_page=None):
+		from .models import Post, Comment
+		from .queries import posts_with_authors, comments_with_commentators
+		expression = match_expression(q)
+		if not expression:
+			return [], None
+		per_page = per_page or current_app.config['FLASK_SEARCH_PER_PAGE']
+		sql = 'SELECT rowid, score FROM (SELECT rowid, bm25(%s) AS score FROM %s ' \
+			'WHERE %s MATCH :q)' % (self.table, self.table, self.table)
+		params = {'q': expression, 'limit': per_page + 1}
+		if cursor:
+			params['score'], params['rowid'] = decode_cursor(cursor)
+			sql += ' WHERE score > :score OR (score = :score AND rowid > :rowid)'
+		sql += ' ORDER BY score, rowid LIMIT :limit'
+		connection = self._connection()
+		rows = connection.execute(db.text(sql), params).fetchall()
+		next_cursor = None
+		if len(rows) > per_page:
+			rows = rows[:per_page]
+			next_cursor = encode_cursor(rows[-1].score, rows[-1].rowid)
+		if not rows:
+			return [], None
+		snippets = dict(connection.execute(db.text(
+			'SELECT rowid, snippet(%s, 0, :start, :end, :ellipsis, 16) FROM %s '
+			'WHERE %s MATCH :q AND rowid IN (%s)' % (self.table, self.table, self.table,
+				', '.join(str(row.rowid) for row in rows))),
+			{'q': expression, 'start': HIGHLIGHT_START, 'end': HIGHLIGHT_END,
+				'ellipsis': u'…'}).fetchall())
+		ids = {'post': [], 'comment': []}
+		for row in rows:
+			kind, id = _split_rowid(row.rowid)
+			ids[kind].append(id)
+		items = {}
+		if ids['post']:
+			for post in posts_with_authors().filter(Post.id.in_(ids['post'])):
+				items['post', post.id] = post
+		if ids['comment']:
+			for comment in comments_with_commentators().filter(
+				Comment.id.in_(ids['comment'])):
+				items['comment', comment.id] = comment
+		results = []
+		for row in rows:
+			kind, id = _split_rowid(row.rowid)
+			item = items.get((kind, id))
+			if item is not None:
+				results.append(SearchResult(kind, item, row.score, row.rowid,
+					snippets.get(row.rowid, '')))
+		return results, next_cursor
+
+
+search_index = SearchIndex()
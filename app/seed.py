@@ -0,0 +1,187 @@
+import hashlib
+import os
+import random
+from bisect import bisect
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from itertools import accumulate, repeat
+from flask import current_app
+from forgery_py.dictionaries_loader import get_dictionary
+from . import db
+from .credentials import hash_password
+from .models import Role, User, Post, Comment, Follow, Timeline
+from .render import renderer, render_body
+from .search import search_index
+
+
+def _words(name):
+	return [line.strip() for line in get_dictionary(name) if line.strip()]
+
+
+class _Text(object):
+	def __init__(self, rng):
+		self.rng = rng
+		self.sentences = _words('lorem_ipsum')
+		self.first_names = _words('male_first_names') + _words('female_first_names')
+		self.last_names = _words('last_names')
+		self.cities = _words('cities')
+
+	def paragraph(self, low=1, high=6):
+		return ' '.join(self.rng.choice(self.sentences)
+			for i in range(self.rng.randint(low, high)))
+
+	def name(self):
+		return '%s %s' % (self.rng.choice(self.first_names), self.rng.choice(self.last_names))
+
+	def city(self):
+		return self.rng.choice(self.cities)
+
+
+# 按幂律分布抽取 id: 排名 r 的权重为 1 / r^alpha, 少数用户拥有大部分粉丝/文章
+class _PowerLaw(object):
+	def __init__(self, ids, alpha, rng):
+		self.ids = list(ids)
+		rng.shuffle(self.ids)
+		self.cumulative = list(accumulate(1.0 / (rank + 1) ** alpha
+			for rank in range(len(self.ids))))
+		self.rng = rng
+
+	def pick(self):
+		return self.ids[bisect(self.cumulative, self.rng.random() * self.cumulative[-1])]
+
+
+# 批量生成压测数据: 直接用 Core executemany 写入, 不经过 ORM 事件,
+# 正文用进程池渲染; 写完后统一重算计数、时间线和搜索索引.
+# 相同的参数和 seed 生成相同的数据
+class Seeder(object):
+	def __init__(self, seed=1, workers=None, batch_size=5000, days=365, alpha=1.0,
+		log=None):
+		self.rng = random.Random(seed)
+		self.text = _Text(self.rng)
+		self.workers = workers or os.cpu_count() or 1
+		self.batch_size = batch_size
+		self.alpha = alpha
+		self.end = datetime(2017, 1, 1)
+		self.start = self.end - timedelta(days=days)
+		self.log = log or (lambda message: None)
+
+	def _next_id(self, model):
+		return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+	def _timestamp(self, after=None):
+		start = after or self.start
+		return start + timedelta(seconds=self.rng.random() *
+			(self.end - start).total_seconds())
+
+	def _insert(self, model, rows):
+		if rows:
+			db.session.execute(model.__table__.insert(), rows, mapper=model.__mapper__)
+			db.session.commit()
+
+	def _render(self, pool, rows, policy):
+		tags = renderer.policies[policy][3]
+		htmls = pool.map(render_body, [row['body'] for row in rows], repeat(tags),
+			chunksize=max(1, len(rows) // (self.workers * 4)))
+		for row, html in zip(rows, htmls):
+			row['body_html'] = html
+
+	def users(self, count):
+		first = self._next_id(User)
+		role_id = Role.query.filter_by(default=True).first().id
+		password_hash = hash_password('password')
+		rows = []
+		for id in range(first, first + count):
+			email = 'user%d@example.com' % id
+			member_since = self._timestamp()
+			rows.append({
+				'id': id,
+				'username': 'user%d' % id,
+				'email': email,
+				'role_id': role_id,
+				'password_hash': password_hash,
+				'confirmed': True,
+				'name': self.text.name(),
+				'location': self.text.city(),
+				'about_me': self.text.paragraph(1, 2),
+				'member_since': member_since,
+				'last_seen': self._timestamp(member_since),
+				'updated_at': member_since,
+				'avatar_hash': hashlib.md5(email.encode('utf-8')).hexdigest()
+			})
+			if len(rows) >= self.batch_size:
+				self._insert(User, rows)
+				rows = []
+		self._insert(User, rows)
+		self.log('%d users' % count)
+		return list(range(first, first + count))
+
+	# 每个用户关注自己, 另外按幂律挑选平均 per_user 个关注对象
+	def follows(self, user_ids, per_user):
+		targets = _PowerLaw(user_ids, self.alpha, self.rng)
+		rows = []
+		count = 0
+		for follower_id in user_ids:
+			followed = set([follower_id])
+			wanted = min(len(user_ids) - 1, int(self.rng.expovariate(1.0 / per_user))) \
+				if per_user else 0
+			while len(followed) < wanted + 1:
+				followed.add(targets.pick())
+			for followed_id in sorted(followed):
+				rows.append({'follower_id': follower_id, 'followed_id': followed_id,
+					'timestamp': self._timestamp()})
+			if len(rows) >= self.batch_size:
+				count += len(rows)
+				self._insert(Follow, rows)
+				rows = []
+		count += len(rows)
+		self._insert(Follow, rows)
+		self.log('%d follows' % count)
+		return count
+
+	def posts(self, pool, user_ids, count):
+		authors = _PowerLaw(user_ids, self.alpha, self.rng)
+		first = self._next_id(Post)
+		for start in range(first, first + count, self.batch_size):
+			rows = []
+			for id in range(start, min(start + self.batch_size, first + count)):
+				timestamp = self._timestamp()
+				rows.append({'id': id, 'author_id': authors.pick(),
+					'body': self.text.paragraph(), 'timestamp': timestamp,
+					'updated_at': timestamp})
+			self._render(pool, rows, 'post')
+			self._insert(Post, rows)
+			self.log('%d/%d posts' % (min(start + self.batch_size, first + count) - first,
+				count))
+		return list(range(first, first + count))
+
+	def comments(self, pool, user_ids, post_ids, count):
+		posts = _PowerLaw(post_ids, self.alpha, self.rng)
+		first = self._next_id(Comment)
+		for start in range(first, first + count, self.batch_size):
+			rows = []
+			for id in range(start, min(start + self.batch_size, first + count)):
+				timestamp = self._timestamp()
+				rows.append({'id': id, 'author_id': self.rng.choice(user_ids),
+					'post_id': posts.pick(), 'body': self.text.paragraph(1, 2),
+					'timestamp': timestamp, 'updated_at': timestamp, 'disabled': False})
+			self._render(pool, rows, 'comment')
+			self._insert(Comment, rows)
+			self.log('%d/%d comments' % (min(start + self.batch_size, first + count) - first,
+				count))
+		return count
+
+	def run(self, users, posts, comments, follows):
+		Role.insert_roles()
+		user_ids = self.users(users)
+		self.follows(user_ids, follows)
+		with ProcessPoolExecutor(self.workers) as pool:
+			post_ids = self.posts(pool, user_ids, posts)
+			if post_ids:
+				self.comments(pool, user_ids, post_ids, comments)
+		User.recount()
+		Post.recount()
+		self.log('counters recomputed')
+		if current_app.config['FLASK_TIMELINE_ENABLED']:
+			Timeline.rebuild()
+			self.log('timelines rebuilt')
+		self.log('%d documents indexed' % search_index.rebuild())
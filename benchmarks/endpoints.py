@@ -0,0 +1,374 @@
+"""Benchmark the main pages and API endpoints against a seeded dataset.
+
+Every endpoint is requested through the Flask test client (latency and SQL
+statements per request) and through a threaded WSGI server over HTTP
+(latency and throughput under concurrency). Results are written as JSON and
+checked two ways; the exit status is 1 if any check fails:
+
+* budgets.json holds hard limits on SQL statements per request.
+* baseline.json holds latency and throughput recorded on a reference run.
+  p95 may grow and throughput may drop by the --headroom factor. These checks
+  are skipped for endpoints with fewer than --min-samples requests, where a
+  p95 is mostly noise.
+
+    python benchmarks/endpoints.py --dataset small --output results.json
+    python benchmarks/endpoints.py --dataset small --save-baseline
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from base64 import b64encode
+from datetime import datetime
+
+try:
+	from http.client import HTTPConnection
+except ImportError:
+	from httplib import HTTPConnection
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('FLASK_ADMIN', 'admin@example.com')
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# users, posts, comments, 平均关注数
+DATASETS = {
+	'tiny': (50, 300, 600, 5),
+	'small': (500, 5000, 10000, 10),
+	'medium': (5000, 50000, 100000, 20)
+}
+
+# (名称, 根据数据集生成 URL 的函数, 是否带认证)
+ENDPOINTS = [
+	('index', lambda data, rng: '/', False),
+	('index_page_5', lambda data, rng: '/?page=5', False),
+	('post_link', lambda data, rng: '/post/%d' % rng.choice(data['posts']), False),
+	('user_profile', lambda data, rng: '/user/%s' % rng.choice(data['users']), False),
+	('search', lambda data, rng: '/search?q=%s' % rng.choice(data['terms']), False),
+	('api_posts', lambda data, rng: '/api/v1.0/posts/', True),
+	('api_posts_cursor', lambda data, rng: '/api/v1.0/posts/?cursor=', True),
+	('api_post', lambda data, rng: '/api/v1.0/post/%d' % rng.choice(data['posts']), True),
+	('api_post_comments', lambda data, rng: '/api/v1.0/post/%d/comments/' %
+		rng.choice(data['posts']), True),
+	('api_posts_batch', lambda data, rng: '/api/v1.0/posts/?ids=%s' %
+		','.join(str(id) for id in rng.sample(data['posts'], 20)), True),
+	('api_user', lambda data, rng: '/api/v1.0/user/%s' % rng.choice(data['users']), True),
+	('api_user_posts', lambda data, rng: '/api/v1.0/user/%s/posts/' %
+		rng.choice(data['users']), True),
+	('api_user_timeline', lambda data, rng: '/api/v1.0/user/%s/timeline/?cursor=' %
+		rng.choice(data['users']), True),
+	('api_comments_expand', lambda data, rng: '/api/v1.0/comments/?cursor=&expand=post',
+		True),
+	('api_search', lambda data, rng: '/api/v1.0/search?q=%s' % rng.choice(data['terms']),
+		True)
+]
+
+
+class QueryCounter(object):
+	def __init__(self):
+		self.count = 0
+
+	def __call__(self, *args, **kwargs):
+		self.count += 1
+
+
+def make_app(path, response_cache):
+	from app import create_app
+	app = create_app('testing')
+	app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+	app.config['FLASK_SQLITE_PRAGMAS'] = {'journal_mode': 'WAL', 'synchronous': 'NORMAL',
+		'busy_timeout': 5000}
+	app.config['FLASK_RESPONSE_CACHE'] = 'simple' if response_cache else None
+	from app import response_cache as cache
+	cache.init_app(app)
+	return app
+
+def seed(app, dataset, seed):
+	from app import db
+	from app.models import User, Post
+	users, posts, comments, follows = DATASETS[dataset]
+	with app.app_context():
+		db.create_all()
+		from app.seed import Seeder
+		Seeder(seed).run(users, posts, comments, follows)
+		return {
+			'users': [name for name, in db.session.query(User.username)],
+			'posts': [id for id, in db.session.query(Post.id)],
+			'terms': ['lorem', 'ipsum+dolor', 'vestibulum', 'sapien', 'nulla'],
+			'auth': 'Basic ' + b64encode(('%s:password' %
+				User.query.first().email).encode('utf-8')).decode('ascii')
+		}
+
+def summarize(latencies, elapsed=None):
+	latencies = sorted(latencies)
+	def pct(p):
+		return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 3)
+	result = {
+		'requests': len(latencies),
+		'p50_ms': pct(0.5),
+		'p95_ms': pct(0.95),
+		'p99_ms': pct(0.99),
+		'max_ms': round(latencies[-1] * 1000, 3)
+	}
+	if elapsed:
+		result['throughput'] = round(len(latencies) / elapsed, 1)
+	return result
+
+def run_client(app, data, requests, rng):
+	counter = QueryCounter()
+	event.listen(Engine, 'before_cursor_execute', counter)
+	client = app.test_client()
+	results = {}
+	try:
+		for name, url, auth in ENDPOINTS:
+			headers = {'Authorization': data['auth']} if auth else {}
+			for i in range(3):
+				client.get(url(data, rng), headers=headers)
+			latencies = []
+			queries = []
+			start = time.time()
+			for i in range(requests):
+				before = counter.count
+				t = time.time()
+				response = client.get(url(data, rng), headers=headers)
+				latencies.append(time.time() - t)
+				queries.append(counter.count - before)
+				if response.status_code != 200:
+					raise RuntimeError('%s returned %d' % (name, response.status_code))
+			results[name] = summarize(latencies, time.time() - start)
+			results[name]['queries'] = round(sum(queries) / float(len(queries)), 2)
+			results[name]['max_queries'] = max(queries)
+	finally:
+		event.remove(Engine, 'before_cursor_execute', counter)
+	return results
+
+def run_server(app, data, requests, concurrency, seed):
+	from werkzeug.serving import make_server, WSGIRequestHandler
+	# 不打印访问日志
+	class QuietHandler(WSGIRequestHandler):
+		def log_request(self, *args, **kwargs):
+			pass
+	server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	results = {}
+	try:
+		for name, url, auth in ENDPOINTS:
+			headers = {'Authorization': data['auth']} if auth else {}
+			latencies = []
+			lock = threading.Lock()
+			def worker(index):
+				rng = random.Random(seed * 1000 + index)
+				connection = HTTPConnection('127.0.0.1', server.server_port)
+				for i in range(requests // concurrency):
+					t = time.time()
+					connection.request('GET', url(data, rng), headers=headers)
+					response = connection.getresponse()
+					response.read()
+					elapsed = time.time() - t
+					if response.status != 200:
+						raise RuntimeError('%s returned %d' % (name, response.status))
+					with lock:
+						latencies.append(elapsed)
+				connection.close()
+			workers = [threading.Thread(target=worker, args=(i,))
+				for i in range(concurrency)]
+			start = time.time()
+			for w in workers:
+				w.start()
+			for w in workers:
+				w.join()
+			if len(latencies) < concurrency * (requests // concurrency):
+				raise RuntimeError('%s: some requests failed' % name)
+			results[name] = summarize(latencies, time.time() - start)
+	finally:
+		server.shutdown()
+	return results
+
+# 预算文件: {"<dataset>": {"client": {"<endpoint>": {"max_queries": ...}}}},
+# 是与机器无关的硬性上限
+def check_budgets(results, budgets):
+	failures = []
+	for mode, endpoints in sorted(budgets.items()):
+		for name, limits in sorted(endpoints.items()):
+			measured = results.get(mode, {}).get(name)
+			if measured is None:
+				continue
+			for metric, limit in sorted(limits.items()):
+				if measured[metric] > limit:
+					failures.append('%s %s: %s %s > %s' % (mode, name, metric,
+						measured[metric], limit))
+	return failures
+
+# 基线文件: {"<dataset>": {"concurrency": ..., "client": {"<endpoint>": {"p95_ms": ...}},
+# "server": {"<endpoint>": {"p95_ms": ..., "throughput": ...}}}}, 是参考机器上实测的结果.
+# 允许 p95 增长到 headroom 倍、吞吐量降到 1/headroom, 样本太少时不比较
+def check_baseline(results, baseline, headroom, min_samples, concurrency):
+	failures = []
+	notes = []
+	for mode, endpoints in sorted(results.items()):
+		if mode == 'server' and baseline.get('concurrency') != concurrency:
+			notes.append('server: baseline was recorded with concurrency %s, not %s' %
+				(baseline.get('concurrency'), concurrency))
+			continue
+		few = []
+		for name, measured in sorted(endpoints.items()):
+			reference = baseline.get(mode, {}).get(name)
+			if reference is None:
+				notes.append('%s %s: no baseline' % (mode, name))
+				continue
+			if measured['requests'] < min_samples:
+				few.append(name)
+				continue
+			for metric, value in sorted(reference.items()):
+				if metric == 'throughput':
+					limit = round(value / headroom, 1)
+					if measured[metric] < limit:
+						failures.append('%s %s: throughput %.1f < %.1f (baseline %.1f)' %
+							(mode, name, measured[metric], limit, value))
+				else:
+					limit = round(value * headroom, 3)
+					if measured[metric] > limit:
+						failures.append('%s %s: %s %s > %s (baseline %s)' % (mode, name,
+							metric, measured[metric], limit, value))
+		if few:
+			notes.append('%s: latency not checked for %d endpoints with fewer than %d '
+				'samples' % (mode, len(few), min_samples))
+	return failures, notes
+
+def save_baseline(path, dataset, report):
+	baseline = {}
+	if os.path.exists(path):
+		with open(path) as f:
+			baseline = json.load(f)
+	entry = {
+		'requests': report['requests'],
+		'concurrency': report['concurrency'],
+		'created': report['created'],
+		'python': report['python'],
+		'platform': report['platform']
+	}
+	# 单线程客户端的吞吐量只是延迟的倒数, 只记录 p95
+	metrics = {'client': ('p95_ms',), 'server': ('p95_ms', 'throughput')}
+	for mode, endpoints in report['results'].items():
+		entry[mode] = dict((name, dict((metric, measured[metric])
+			for metric in metrics[mode])) for name, measured in endpoints.items())
+	# 只运行了一种模式时保留另一种模式原来的基线
+	for mode in ('client', 'server'):
+		if mode not in entry and mode in baseline.get(dataset, {}):
+			entry[mode] = baseline[dataset][mode]
+	baseline[dataset] = entry
+	with open(path, 'w') as f:
+		json.dump(baseline, f, indent=2, sort_keys=True)
+		f.write('\n')
+
+def print_table(mode, results):
+	print('\n%s' % mode)
+	print('%-22s %8s %8s %8s %9s %8s' % ('endpoint', 'p50 ms', 'p95 ms', 'p99 ms',
+		'req/s', 'queries'))
+	for name, _, _ in ENDPOINTS:
+		r = results[name]
+		print('%-22s %8.2f %8.2f %8.2f %9.1f %8s' % (name, r['p50_ms'], r['p95_ms'],
+			r['p99_ms'], r.get('throughput', 0), r.get('queries', '-')))
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+	parser.add_argument('--dataset', choices=sorted(DATASETS), default='small')
+	parser.add_argument('--seed', type=int, default=1)
+	parser.add_argument('--requests', type=int, default=100,
+		help='Requests per endpoint and mode')
+	parser.add_argument('--concurrency', type=int, default=4)
+	parser.add_argument('--mode', choices=('client', 'server', 'both'), default='both')
+	parser.add_argument('--response-cache', action='store_true', default=False,
+		help='Keep the anonymous response cache enabled')
+	parser.add_argument('--output', default=None, help='Write the results as JSON')
+	parser.add_argument('--budgets', default=os.path.join(HERE, 'budgets.json'))
+	parser.add_argument('--no-budgets', dest='budgets', action='store_const', const=None)
+	parser.add_argument('--baseline', default=os.path.join(HERE, 'baseline.json'))
+	parser.add_argument('--headroom', type=float, default=1.5,
+		help='Allowed p95 growth and throughput drop relative to the baseline')
+	parser.add_argument('--min-samples', type=int, default=100,
+		help='Requests per endpoint needed before latency is checked')
+	parser.add_argument('--save-baseline', action='store_true', default=False,
+		help='Record this run as the baseline for the dataset instead of checking it')
+	args = parser.parse_args(argv)
+	if args.save_baseline and args.requests < args.min_samples:
+		parser.error('--save-baseline needs at least --min-samples %d requests' %
+			args.min_samples)
+
+	fd, path = tempfile.mkstemp(suffix='.sqlite')
+	os.close(fd)
+	try:
+		app = make_app(path, args.response_cache)
+		start = time.time()
+		data = seed(app, args.dataset, args.seed)
+		print('seeded %s dataset in %.1f s' % (args.dataset, time.time() - start))
+		results = {}
+		if args.mode in ('client', 'both'):
+			results['client'] = run_client(app, data, args.requests, random.Random(args.seed))
+			print_table('client', results['client'])
+		if args.mode in ('server', 'both'):
+			results['server'] = run_server(app, data, args.requests, args.concurrency,
+				args.seed)
+			print_table('server', results['server'])
+	finally:
+		for suffix in ('', '-wal', '-shm'):
+			if os.path.exists(path + suffix):
+				os.remove(path + suffix)
+
+	report = {
+		'dataset': args.dataset,
+		'sizes': dict(zip(('users', 'posts', 'comments', 'follows'),
+			DATASETS[args.dataset])),
+		'seed': args.seed,
+		'requests': args.requests,
+		'concurrency': args.concurrency,
+		'response_cache': args.response_cache,
+		'created': datetime.utcnow().isoformat(),
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'results': results
+	}
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent=2, sort_keys=True)
+	if args.save_baseline:
+		save_baseline(args.baseline, args.dataset, report)
+		print('\nsaved %s baseline to %s' % (args.dataset, args.baseline))
+	if not args.budgets:
+		return 0
+	with open(args.budgets) as f:
+		budgets = json.load(f).get(args.dataset, {})
+	failures = check_budgets(results, budgets)
+	if not args.save_baseline:
+		baseline = {}
+		if os.path.exists(args.baseline):
+			with open(args.baseline) as f:
+				baseline = json.load(f).get(args.dataset, {})
+		if baseline:
+			latency_failures, notes = check_baseline(results, baseline, args.headroom,
+				args.min_samples, args.concurrency)
+			failures += latency_failures
+			for note in notes:
+				print('NOTE %s' % note)
+		else:
+			print('NOTE no %s baseline in %s, latency not checked' % (args.dataset,
+				args.baseline))
+	for failure in failures:
+		print('BUDGET EXCEEDED %s' % failure)
+	if failures:
+		return 1
+	print('\nall budgets met')
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,122 @@
+"""Measure full-text search on a large generated dataset: index build time,
+ranked query latency for common and rare terms, cursor paging, the cost the
+index adds to inserts, and a LIKE scan for comparison.
+
+    python benchmarks/search.py --rows 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('FLASK_ADMIN', 'admin@example.com')
+
+
+def make_app(path):
+	from app import create_app
+	app = create_app('testing')
+	app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+	app.config['FLASK_SQLITE_PRAGMAS'] = {'journal_mode': 'WAL', 'synchronous': 'OFF'}
+	return app
+
+def vocabulary(size, rng):
+	letters = 'abcdefghijklmnopqrstuvwxyz'
+	words = set()
+	while len(words) < size:
+		words.add(''.join(rng.choice(letters) for i in range(rng.randint(3, 9))))
+	return sorted(words)
+
+# 词频近似 Zipf 分布, 排在前面的词是常见词
+def generate(rows, words, rng, length=20, batch=10000):
+	weights = [1.0 / (rank + 1) for rank in range(len(words))]
+	for start in range(0, rows, batch):
+		count = min(batch, rows - start)
+		picks = rng.choices(words, weights, k=count * length)
+		yield [' '.join(picks[i * length:(i + 1) * length]) for i in range(count)]
+
+def timed(func, *args):
+	start = time.time()
+	result = func(*args)
+	return result, time.time() - start
+
+def percentiles(samples):
+	samples = sorted(samples)
+	def pct(p):
+		return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+	return pct(0.5), pct(0.95), pct(0.99)
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+	parser.add_argument('--rows', type=int, default=1000000)
+	parser.add_argument('--words', type=int, default=50000)
+	parser.add_argument('--queries', type=int, default=200)
+	parser.add_argument('--inserts', type=int, default=1000)
+	parser.add_argument('--seed', type=int, default=1)
+	args = parser.parse_args()
+
+	from app import db
+	from app.models import Role, User, Post
+	from app.search import search_index
+	rng = random.Random(args.seed)
+	fd, path = tempfile.mkstemp(suffix='.sqlite')
+	os.close(fd)
+	app = make_app(path)
+	try:
+		with app.app_context():
+			db.create_all()
+			Role.insert_roles()
+			user = User(email='bench@example.com', username='bench', password='bench')
+			db.session.add(user)
+			db.session.commit()
+			words = vocabulary(args.words, rng)
+			start = time.time()
+			for bodies in generate(args.rows, words, rng):
+				db.session.execute(Post.__table__.insert(),
+					[{'body': body, 'author_id': user.id} for body in bodies])
+			db.session.commit()
+			print('loaded %d posts in %.1f s' % (args.rows, time.time() - start))
+			count, seconds = timed(search_index.rebuild)
+			print('indexed %d documents in %.1f s (%.0f docs/s)' % (count, seconds,
+				count / seconds))
+
+			for name, pool in (('common', words[:20]), ('rare', words[-1000:]),
+				('two terms', None)):
+				samples = []
+				for i in range(args.queries):
+					q = ' '.join(rng.sample(words[:200], 2)) if pool is None \
+						else rng.choice(pool)
+					samples.append(timed(search_index.search, q)[1])
+				print('%-10s p50 %7.2f ms  p95 %7.2f ms  p99 %7.2f ms' % (
+					(name,) + percentiles(samples)))
+
+			cursor = None
+			samples = []
+			for page in range(10):
+				(results, cursor), seconds = timed(search_index.search, words[0], cursor)
+				samples.append(seconds)
+				if cursor is None:
+					break
+			print('paging    %d pages of %r, p50 %.2f ms' % (len(samples), words[0],
+				percentiles(samples)[0]))
+
+			like = Post.query.filter(Post.body.like('%' + words[-1] + '%'))
+			_, seconds = timed(like.count)
+			print('LIKE scan  %.2f ms' % (seconds * 1000))
+
+			bodies = next(generate(args.inserts, words, rng))
+			start = time.time()
+			for body in bodies:
+				db.session.add(Post(body=body, author=user))
+			db.session.commit()
+			print('ORM insert %.3f ms/post including index maintenance' % (
+				(time.time() - start) * 1000 / args.inserts))
+	finally:
+		for suffix in ('', '-wal', '-shm'):
+			if os.path.exists(path + suffix):
+				os.remove(path + suffix)
+
+if __name__ == '__main__':
+	main()
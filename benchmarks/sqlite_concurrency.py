@@ -0,0 +1,121 @@
+"""Compare SQLite throughput of the default and the tuned (ProductionConfig)
+engine settings with several worker processes reading and writing at once.
+
+    python benchmarks/sqlite_concurrency.py --workers 4 --seconds 10
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('FLASK_ADMIN', 'admin@example.com')
+
+from sqlalchemy.exc import OperationalError
+from config import ProductionConfig
+
+PROFILES = {
+	'default': {
+		'FLASK_SQLITE_PRAGMAS': None,
+		'SQLALCHEMY_POOL_SIZE': None,
+		'SQLALCHEMY_MAX_OVERFLOW': None
+	},
+	'tuned': {
+		'FLASK_SQLITE_PRAGMAS': ProductionConfig.FLASK_SQLITE_PRAGMAS,
+		'SQLALCHEMY_POOL_SIZE': ProductionConfig.SQLALCHEMY_POOL_SIZE,
+		'SQLALCHEMY_MAX_OVERFLOW': ProductionConfig.SQLALCHEMY_MAX_OVERFLOW
+	}
+}
+
+
+def make_app(path, profile):
+	from app import create_app
+	app = create_app('testing')
+	app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+	app.config.update(PROFILES[profile])
+	return app
+
+def setup(path, profile, users):
+	from app import db
+	from app.models import Role, User
+	app = make_app(path, profile)
+	with app.app_context():
+		db.create_all()
+		Role.insert_roles()
+		for i in range(users):
+			db.session.add(User(email='user%d@example.com' % i, username='user%d' % i,
+				password='password'))
+		db.session.commit()
+
+def work(path, profile, seconds, write_ratio, seed, results):
+	from app import db
+	from app.models import Post, User
+	from app.queries import posts_with_authors
+	app = make_app(path, profile)
+	rng = random.Random(seed)
+	reads = writes = locked = 0
+	latencies = []
+	with app.app_context():
+		user_ids = [id for id, in db.session.query(User.id)]
+		deadline = time.time() + seconds
+		while time.time() < deadline:
+			start = time.time()
+			try:
+				if rng.random() < write_ratio:
+					db.session.add(Post(body='benchmark post %d' % rng.randrange(10 ** 6),
+						author_id=rng.choice(user_ids)))
+					db.session.commit()
+					writes += 1
+				else:
+					posts_with_authors().order_by(Post.timestamp.desc()).limit(20).all()
+					db.session.commit()
+					reads += 1
+			except OperationalError:
+				db.session.rollback()
+				locked += 1
+			latencies.append(time.time() - start)
+	results.put((reads, writes, locked, latencies))
+
+def run(profile, workers, seconds, write_ratio, users):
+	fd, path = tempfile.mkstemp(suffix='.sqlite')
+	os.close(fd)
+	try:
+		setup(path, profile, users)
+		results = multiprocessing.Queue()
+		procs = [multiprocessing.Process(target=work,
+			args=(path, profile, seconds, write_ratio, i, results)) for i in range(workers)]
+		for proc in procs:
+			proc.start()
+		totals = [results.get() for proc in procs]
+		for proc in procs:
+			proc.join()
+	finally:
+		for suffix in ('', '-wal', '-shm'):
+			if os.path.exists(path + suffix):
+				os.remove(path + suffix)
+	reads = sum(r[0] for r in totals)
+	writes = sum(r[1] for r in totals)
+	locked = sum(r[2] for r in totals)
+	latencies = sorted(l for r in totals for l in r[3])
+	def pct(p):
+		return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 \
+			if latencies else 0.0
+	print('%-8s %8.1f ops/s  reads %6d  writes %6d  locked %4d  p50 %7.2f ms  p99 %7.2f ms' % (
+		profile, (reads + writes) / float(seconds), reads, writes, locked, pct(0.5), pct(0.99)))
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+	parser.add_argument('--workers', type=int, default=4)
+	parser.add_argument('--seconds', type=float, default=5)
+	parser.add_argument('--write-ratio', type=float, default=0.2)
+	parser.add_argument('--users', type=int, default=50)
+	parser.add_argument('--profile', choices=sorted(PROFILES), action='append')
+	args = parser.parse_args()
+	for profile in args.profile or sorted(PROFILES):
+		run(profile, args.workers, args.seconds, args.write_ratio, args.users)
+
+if __name__ == '__main__':
+	main()
@@ -9,10 +9,62 @@ class Config:
 	SECRET_KEY = 'This is a very hard to guess key'
 	MAIL_DEFAULT_SENDER = '<Flask> ' + os.environ.get('FLASK_ADMIN')
 	FLASK_SUBJECT_PREFIX = '[Flasky]'
-	SQLALCHEMY_TRACK_MODIFICATIONS = True
+	SQLALCHEMY_TRACK_MODIFICATIONS = False
 	PER_PAGE = 10
 	POST_PER_PAGE = 5
 	FLASK_COMMENTS_PER_PAGE = 5
+	# 物化首页时间线: 粉丝数超过 FANOUT_LIMIT 的作者改为读时合并
+	FLASK_TIMELINE_ENABLED = False
+	FLASK_TIMELINE_FANOUT_LIMIT = 1000
+	FLASK_TIMELINE_LENGTH = 800
+	# 为 True 时 body_html 由后台线程在提交后生成
+	FLASK_ASYNC_RENDER = False
+	FLASK_RENDER_WORKERS = 2
+	# last_seen 写回的最长延迟(秒)和批量大小
+	FLASK_LAST_SEEN_INTERVAL = 60
+	FLASK_LAST_SEEN_BATCH = 500
+	# 用户身份 / HTTP Basic 凭据缓存的大小和有效期(秒)
+	FLASK_IDENTITY_CACHE_SIZE = 10000
+	FLASK_IDENTITY_CACHE_TTL = 300
+	FLASK_CREDENTIAL_CACHE_SIZE = 10000
+	FLASK_CREDENTIAL_CACHE_TTL = 60
+	# 密码哈希算法及迭代次数, 修改后用户下次登录时自动重新哈希
+	FLASK_PASSWORD_HASH_METHOD = 'pbkdf2:sha256:150000'
+	# 发信线程数, 队列长度, 队列满时的最长等待(秒), 每个 SMTP 连接发送的邮件数
+	FLASK_MAIL_WORKERS = 2
+	FLASK_MAIL_QUEUE_SIZE = 1000
+	FLASK_MAIL_QUEUE_TIMEOUT = 5
+	FLASK_MAIL_PER_CONNECTION = 50
+	# 为 True 时邮件先写入 outbox 表, 由 manager.py mail_worker 投递.
+	# 失败按 RETRY_BACKOFF * 2^n 秒退避重试; BASE_URL 用于生成邮件中的链接
+	FLASK_MAIL_OUTBOX = os.environ.get('FLASK_MAIL_OUTBOX') == '1'
+	FLASK_MAIL_OUTBOX_LEASE = 300
+	FLASK_MAIL_MAX_ATTEMPTS = 5
+	FLASK_MAIL_RETRY_BACKOFF = 30
+	FLASK_BASE_URL = os.environ.get('FLASK_BASE_URL') or 'http://localhost:5000'
+	# 只读副本, 取值为 SQLALCHEMY_BINDS 中的键, 例如
+	# SQLALCHEMY_BINDS = {'replica1': 'sqlite:///replica1.sqlite'}
+	# FLASK_DB_REPLICAS = ['replica1']
+	FLASK_DB_REPLICAS = []
+	# 把写入频繁的表放到单独的 SQLite 文件, 各库写锁互不影响. 需要 WAL, 例如
+	# SQLALCHEMY_BINDS = {'follows': 'sqlite:///data-follows.sqlite',
+	#	'comments': 'sqlite:///data-comments.sqlite'}
+	# FLASK_TABLE_BINDS = {'follows': 'follows', 'comments': 'comments'}
+	FLASK_TABLE_BINDS = {}
+	# 匿名用户页面的响应缓存: 'simple' (进程内 LRU), 'filesystem' 或 None 关闭
+	FLASK_RESPONSE_CACHE = 'simple'
+	FLASK_RESPONSE_CACHE_SIZE = 1024
+	FLASK_RESPONSE_CACHE_TTL = 60
+	# 文章/评论渲染片段缓存, 键包含 updated_at, 内容修改后自动换键
+	FLASK_FRAGMENT_CACHE = True
+	FLASK_FRAGMENT_CACHE_SIZE = 4096
+	# 批量查询接口 (?ids= / ?usernames=) 一次最多查询的条数
+	FLASK_API_BATCH_LIMIT = 100
+	# 导出接口和 manager.py export 每次从数据库读取的行数
+	FLASK_EXPORT_BATCH_SIZE = 1000
+	# FTS5 分词器和每页搜索结果数, 修改分词器后需要 manager.py reindex
+	FLASK_SEARCH_TOKENIZER = 'porter unicode61'
+	FLASK_SEARCH_PER_PAGE = 20
 
 
 	@staticmethod
@@ -21,6 +73,11 @@ class Config:
 
 class DevelopmentConfig(Config):
 	DEBUG = True
+	SQLALCHEMY_TRACK_MODIFICATIONS = True
+	FLASK_SQLITE_PRAGMAS = {
+		'journal_mode': 'WAL',
+		'busy_timeout': 5000
+	}
 	SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(base_dir, 'data-dev.sqlite')
 	MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
 	MAIL_SERVER = 'smtp.googlemail.com'
@@ -30,10 +87,31 @@ class DevelopmentConfig(Config):
 
 class TestConfig(Config):
 	TESTING = True
+	FLASK_LAST_SEEN_INTERVAL = 0
+	FLASK_PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+	FLASK_SQLITE_PRAGMAS = {
+		'busy_timeout': 5000,
+		'synchronous': 'OFF'
+	}
+	FLASK_RESPONSE_CACHE = None
 	SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(base_dir, 'data-test.sqlite')
 
 class ProductionConfig(Config):
 	SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(base_dir, 'data.sqlite')
+	# WAL 下读写互不阻塞; 写锁冲突时最多等待 busy_timeout 毫秒而不是立即报错
+	FLASK_SQLITE_PRAGMAS = {
+		'journal_mode': 'WAL',
+		'synchronous': 'NORMAL',
+		'busy_timeout': 5000,
+		'mmap_size': 256 * 1024 * 1024,
+		'cache_size': -64 * 1024,
+		'temp_store': 'MEMORY'
+	}
+	SQLALCHEMY_POOL_SIZE = 10
+	SQLALCHEMY_MAX_OVERFLOW = 10
+	SQLALCHEMY_POOL_TIMEOUT = 30
+	FLASK_RESPONSE_CACHE = 'filesystem'
+	FLASK_RESPONSE_CACHE_DIR = os.path.join(base_dir, 'cache', 'responses')
 
 config = {
 	'developemnt': DevelopmentConfig,
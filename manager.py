@@ -1,17 +1,28 @@
 from flask_script import Shell, Manager
 from flask_migrate import MigrateCommand, Migrate
 from config import config
-from app import create_app, db
-from app.models import Role, User, Post, Follow
+from app import create_app, db, renderer
+from app.models import Role, User, Post, Follow, Timeline, Comment, Outbox
+from app.email import deliver_outbox
+from app.search import search_index
+from app.seed import Seeder
+from app.export import EXPORTS, parse_since, export_lines, gzip_chunks
+from datetime import datetime
 import unittest
 import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
 migrate = Migrate(app, db, render_as_batch=True)
 manager = Manager(app)
 
 def make_shell_context():
-	return dict(Role=Role, User=User, Post=Post, Follow=Follow, db=db, app=app)
+	return dict(Role=Role, User=User, Post=Post, Follow=Follow, db=db, app=app,
+		renderer=renderer)
 
 
 @manager.command
@@ -20,6 +31,115 @@ def test():
 	tests = unittest.TestLoader().discover('tests')
 	unittest.TextTestRunner(verbosity=2).run(tests)
 
+@manager.command
+def recount():
+	"""Recompute the stored post, comment and follow counters."""
+	User.recount()
+	Post.recount()
+
+@manager.option('-w', '--workers', dest='workers', type=int, default=None,
+	help='Number of rendering processes (default: one per CPU)')
+def rerender(workers):
+	"""Re-render body_html of every post and comment with a process pool."""
+	print('%d posts rendered' % renderer.rerender(Post, 'post', workers))
+	print('%d comments rendered' % renderer.rerender(Comment, 'comment', workers))
+
+@manager.command
+def dbinfo():
+	"""Show the effective database engine, pool and SQLite settings."""
+	for key, value in sorted(db.diagnostics().items()):
+		if isinstance(value, dict):
+			for name, setting in sorted(value.items()):
+				print('%s.%s = %s' % (key, name, setting))
+		else:
+			print('%s = %s' % (key, value))
+
+@manager.command
+def rebuild_timelines():
+	"""Refill the materialized home timelines from the follow graph."""
+	Timeline.rebuild()
+
+@manager.command
+def reindex():
+	"""Rebuild the full-text search index of posts and comments."""
+	print('%d documents indexed' % search_index.rebuild())
+
+@manager.option('-u', '--users', dest='users', type=int, default=1000)
+@manager.option('-p', '--posts', dest='posts', type=int, default=10000)
+@manager.option('-c', '--comments', dest='comments', type=int, default=20000)
+@manager.option('-f', '--follows', dest='follows', type=int, default=20,
+	help='Average number of users each user follows')
+@manager.option('-s', '--seed', dest='seed', type=int, default=1)
+@manager.option('-w', '--workers', dest='workers', type=int, default=None,
+	help='Number of rendering processes (default: one per CPU)')
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=5000)
+def seed(users, posts, comments, follows, seed, workers, batch_size):
+	"""Fill the database with a large generated dataset for load testing."""
+	start = time.time()
+	def log(message):
+		print('[%7.1fs] %s' % (time.time() - start, message))
+	Seeder(seed, workers, batch_size, log=log).run(users, posts, comments, follows)
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=50)
+@manager.option('-i', '--interval', dest='interval', type=float, default=5,
+	help='Seconds to wait when the outbox is empty')
+@manager.option('--once', dest='once', action='store_true', default=False,
+	help='Exit once the outbox has been drained')
+def mail_worker(batch_size, interval, once):
+	"""Deliver mail queued in the outbox table."""
+	worker = '%s-%d-%s' % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+	while True:
+		if deliver_outbox(worker, batch_size):
+			continue
+		if once:
+			break
+		time.sleep(interval)
+
+@manager.option('kind', choices=sorted(EXPORTS), help='Table to export')
+@manager.option('-o', '--output', dest='output', default=None,
+	help='File to write (default: stdout)')
+@manager.option('-s', '--since', dest='since', default=None,
+	help='Only rows updated at or after this UTC time, e.g. 2017-01-01T00:00:00')
+@manager.option('-z', '--gzip', dest='gzip', action='store_true', default=False)
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=None)
+def export(kind, output, since, gzip, batch_size):
+	"""Export users, posts or comments as newline-delimited JSON."""
+	started = datetime.utcnow()
+	chunks = export_lines(kind, parse_since(since),
+		batch_size or app.config['FLASK_EXPORT_BATCH_SIZE'])
+	if gzip:
+		chunks = gzip_chunks(chunks)
+	out = open(output, 'wb') if output else getattr(sys.stdout, 'buffer', sys.stdout)
+	try:
+		for chunk in chunks:
+			out.write(chunk)
+	finally:
+		if output:
+			out.close()
+	sys.stderr.write('next --since %s\n' % started.isoformat())
+
+@manager.option('-d', '--dataset', dest='dataset', default='small',
+	choices=('tiny', 'small', 'medium'))
+@manager.option('-n', '--requests', dest='requests', type=int, default=100,
+	help='Requests per endpoint and mode')
+@manager.option('-o', '--output', dest='output', default=None,
+	help='Write the results as JSON')
+@manager.option('--no-budgets', dest='no_budgets', action='store_true', default=False)
+@manager.option('--save-baseline', dest='save_baseline', action='store_true', default=False,
+	help='Record the latency baseline instead of checking it')
+def bench(dataset, requests, output, no_budgets, save_baseline):
+	"""Benchmark the endpoints on a seeded dataset and check the budgets."""
+	# 在独立进程中运行, 使用临时数据库, 不影响当前配置的库
+	args = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+		'benchmarks', 'endpoints.py'), '--dataset', dataset, '--requests', str(requests)]
+	if output:
+		args += ['--output', output]
+	if no_budgets:
+		args.append('--no-budgets')
+	if save_baseline:
+		args.append('--save-baseline')
+	return subprocess.call(args)
+
 manager.add_command('shell', Shell(make_context=make_shell_context))
 manager.add_command('db', MigrateCommand)
 
@@ -0,0 +1,216 @@
+from __future__ import with_statement
+
+import logging
+from logging.config import fileConfig
+import re
+
+from sqlalchemy import engine_from_config
+from sqlalchemy import pool
+from sqlalchemy.engine.reflection import Inspector
+from flask import current_app
+
+from alembic import context
+
+USE_TWOPHASE = False
+
+# this is the Alembic Config object, which provides
+# access to the values within the .ini file in use.
+config = context.config
+
+# Interpret the config file for Python logging.
+# This line sets up loggers basically.
+fileConfig(config.config_file_name)
+logger = logging.getLogger('alembic.env')
+
+# add your model's MetaData object here
+# for 'autogenerate' support
+# from myapp import mymodel
+# target_metadata = mymodel.Base.metadata
+db = current_app.extensions['migrate'].db
+config.set_main_option(
+    'sqlalchemy.url',
+    str(db.engine.url).replace('%', '%%'))
+# Only binds that hold tables get a migration stream. Read replicas in
+# SQLALCHEMY_BINDS are copies of the primary and are skipped, and tables moved
+# with FLASK_TABLE_BINDS are migrated in the database they live in.
+bind_names = []
+for bind in db.table_binds(current_app):
+    context.config.set_section_option(
+        bind, "sqlalchemy.url",
+        str(db.get_engine(current_app, bind).url).replace('%', '%%'))
+    bind_names.append(bind)
+target_metadata = db.metadata
+
+
+# other values from the config, defined by the needs of env.py,
+# can be acquired:
+# my_important_option = config.get_main_option("my_important_option")
+# ... etc.
+
+
+def get_metadata(bind):
+    """Return the metadata for a bind."""
+    return target_metadata
+
+
+def get_include_object(bind):
+    """Limit a bind's migrations to the tables that live in it.
+
+    All tables stay in one MetaData so that foreign keys to tables in other
+    binds still resolve.
+    """
+    if bind == '':
+        bind = None
+    names = set(t.name for t in db.get_tables_for_bind(bind))
+
+    def include_object(object, name, type_, reflected, compare_to):
+        if type_ == 'table':
+            return name in names
+        return True
+    return include_object
+
+
+class SplitBindInspector(Inspector):
+    """Reflect tables whose foreign keys point into another bind.
+
+    A table moved to its own SQLite file may refer to tables in the primary
+    database, which cannot be reflected from that file. The model definition
+    of such a table is copied into the reflection metadata instead.
+    """
+
+    def reflecttable(self, table, *args, **kwargs):
+        names = set(self.get_table_names(table.schema))
+        for fk in self.get_foreign_keys(table.name, table.schema):
+            referred = fk['referred_table']
+            if referred not in names and \
+                    referred not in table.metadata.tables and \
+                    referred in target_metadata.tables:
+                target_metadata.tables[referred].tometadata(table.metadata)
+        return super(SplitBindInspector, self).reflecttable(
+            table, *args, **kwargs)
+
+
+def get_engine(section):
+    engine = engine_from_config(section, prefix='sqlalchemy.',
+                                poolclass=pool.NullPool)
+    engine.dialect.inspector = SplitBindInspector
+    return engine
+
+
+def run_migrations_offline():
+    """Run migrations in 'offline' mode.
+
+    This configures the context with just a URL
+    and not an Engine, though an Engine is acceptable
+    here as well.  By skipping the Engine creation
+    we don't even need a DBAPI to be available.
+
+    Calls to context.execute() here emit the given string to the
+    script output.
+
+    """
+    # for the --sql use case, run migrations for each URL into
+    # individual files.
+
+    engines = {
+        '': {
+            'url': context.config.get_main_option('sqlalchemy.url')
+        }
+    }
+    for name in bind_names:
+        engines[name] = rec = {}
+        rec['url'] = context.config.get_section_option(name, "sqlalchemy.url")
+
+    for name, rec in engines.items():
+        logger.info("Migrating database %s" % (name or '<default>'))
+        file_ = "%s.sql" % name
+        logger.info("Writing output to %s" % file_)
+        with open(file_, 'w') as buffer:
+            context.configure(
+                url=rec['url'],
+                output_buffer=buffer,
+                target_metadata=get_metadata(name),
+                include_object=get_include_object(name),
+                literal_binds=True,
+            )
+            with context.begin_transaction():
+                context.run_migrations(engine_name=name)
+
+
+def run_migrations_online():
+    """Run migrations in 'online' mode.
+
+    In this scenario we need to create an Engine
+    and associate a connection with the context.
+
+    """
+
+    # this callback is used to prevent an auto-migration from being generated
+    # when there are no changes to the schema
+    # reference: http://alembic.zzzcomputing.com/en/latest/cookbook.html
+    def process_revision_directives(context, revision, directives):
+        if getattr(config.cmd_opts, 'autogenerate', False):
+            script = directives[0]
+            if len(script.upgrade_ops_list) >= len(bind_names) + 1:
+                empty = True
+                for upgrade_ops in script.upgrade_ops_list:
+                    if not upgrade_ops.is_empty():
+                        empty = False
+                if empty:
+                    directives[:] = []
+                    logger.info('No changes in schema detected.')
+
+    # for the direct-to-DB use case, start a transaction on all
+    # engines, then run all migrations, then commit all transactions.
+    engines = {
+        '': {
+            'engine': get_engine(
+                config.get_section(config.config_ini_section))
+        }
+    }
+    for name in bind_names:
+        engines[name] = rec = {}
+        rec['engine'] = get_engine(context.config.get_section(name))
+
+    for name, rec in engines.items():
+        engine = rec['engine']
+        rec['connection'] = conn = engine.connect()
+
+        if USE_TWOPHASE:
+            rec['transaction'] = conn.begin_twophase()
+        else:
+            rec['transaction'] = conn.begin()
+
+    try:
+        for name, rec in engines.items():
+            logger.info("Migrating database %s" % (name or '<default>'))
+            context.configure(
+                connection=rec['connection'],
+                upgrade_token="%s_upgrades" % name,
+                downgrade_token="%s_downgrades" % name,
+                target_metadata=get_metadata(name),
+                include_object=get_include_object(name),
+                process_revision_directives=process_revision_directives,
+                **current_app.extensions['migrate'].configure_args
+            )
+            context.run_migrations(engine_name=name)
+
+        if USE_TWOPHASE:
+            for rec in engines.values():
+                rec['transaction'].prepare()
+
+        for rec in engines.values():
+            rec['transaction'].commit()
+    except:
+        for rec in engines.values():
+            rec['transaction'].rollback()
+        raise
+    finally:
+        for rec in engines.values():
+            rec['connection'].close()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
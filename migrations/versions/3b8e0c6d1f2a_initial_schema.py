@@ -0,0 +1,173 @@
+"""initial schema
+
+Revision ID: 3b8e0c6d1f2a
+Revises:
+Create Date: 2026-10-18 22:40:00.000000
+
+The tables of the original application. Databases made with db.create_all()
+before there were migrations already have them, so only missing tables and
+indexes are created. The older column layout found in data-dev.sqlite.bak
+(comments.commentator_id, roles.default_user, follows.id) is converted to the
+one the models use.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8e0c6d1f2a'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+TABLES = ('roles', 'users', 'posts', 'follows', 'comments')
+
+
+def _tables(engine_name):
+    """Names of the tables that live in this bind (see FLASK_TABLE_BINDS)."""
+    db = current_app.extensions['migrate'].db
+    return set(t.name for t in db.get_tables_for_bind(engine_name or None))
+
+
+def _columns(table):
+    return set(c['name'] for c in sa.inspect(op.get_bind()).get_columns(table))
+
+
+def _create_index(name, table, columns, unique=False):
+    indexes = sa.inspect(op.get_bind()).get_indexes(table)
+    if name not in set(index['name'] for index in indexes):
+        op.create_index(name, table, columns, unique=unique)
+
+
+def _drop_index(name, table):
+    indexes = sa.inspect(op.get_bind()).get_indexes(table)
+    if name in set(index['name'] for index in indexes):
+        op.drop_index(name, table_name=table)
+
+
+def upgrade(engine_name):
+    tables = _tables(engine_name)
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    for name in TABLES:
+        if name in tables:
+            globals()['upgrade_%s' % name](name in existing)
+
+
+def downgrade(engine_name):
+    tables = _tables(engine_name)
+    for name in reversed(TABLES):
+        if name in tables:
+            op.drop_table(name)
+
+
+def upgrade_roles(existing):
+    if not existing:
+        op.create_table(
+            'roles',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(length=64), nullable=True),
+            sa.Column('default', sa.Boolean(), nullable=True),
+            sa.Column('permissions', sa.Integer(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('name')
+        )
+    elif 'default_user' in _columns('roles'):
+        _drop_index('ix_roles_default_user', 'roles')
+        with op.batch_alter_table('roles') as batch_op:
+            batch_op.alter_column('default_user', new_column_name='default',
+                                  existing_type=sa.Boolean())
+            batch_op.create_unique_constraint('uq_roles_name', ['name'])
+    _create_index('ix_roles_default', 'roles', ['default'])
+
+
+def upgrade_users(existing):
+    if not existing:
+        op.create_table(
+            'users',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('username', sa.String(length=64), nullable=True),
+            sa.Column('email', sa.String(length=64), nullable=True),
+            sa.Column('role_id', sa.Integer(), nullable=True),
+            sa.Column('password_hash', sa.String(length=128), nullable=True),
+            sa.Column('confirmed', sa.Boolean(), nullable=True),
+            sa.Column('name', sa.String(length=64), nullable=True),
+            sa.Column('location', sa.String(length=64), nullable=True),
+            sa.Column('about_me', sa.Text(), nullable=True),
+            sa.Column('member_since', sa.DateTime(), nullable=True),
+            sa.Column('last_seen', sa.DateTime(), nullable=True),
+            sa.Column('avatar_hash', sa.String(length=128), nullable=True),
+            sa.ForeignKeyConstraint(['role_id'], ['roles.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+    elif op.get_bind().dialect.name == 'sqlite':
+        # Old SQLite databases stored these as DATE, which DateTime cannot read.
+        for column in ('member_since', 'last_seen'):
+            op.execute("UPDATE users SET %s = %s || ' 00:00:00.000000' "
+                       "WHERE length(%s) = 10" % (column, column, column))
+    _create_index('ix_users_email', 'users', ['email'], unique=True)
+    _create_index('ix_users_username', 'users', ['username'], unique=True)
+
+
+def upgrade_posts(existing):
+    if not existing:
+        op.create_table(
+            'posts',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('body', sa.Text(), nullable=True),
+            sa.Column('body_html', sa.Text(), nullable=True),
+            sa.Column('timestamp', sa.DateTime(), nullable=True),
+            sa.Column('author_id', sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(['author_id'], ['users.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+    _create_index('ix_posts_timestamp', 'posts', ['timestamp'])
+
+
+def _create_follows(name):
+    op.create_table(
+        name,
+        sa.Column('follower_id', sa.Integer(), nullable=False),
+        sa.Column('followed_id', sa.Integer(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['followed_id'], ['users.id']),
+        sa.ForeignKeyConstraint(['follower_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('follower_id', 'followed_id')
+    )
+
+
+def upgrade_follows(existing):
+    if not existing:
+        _create_follows('follows')
+    elif 'id' in _columns('follows'):
+        # The old table had a surrogate key; the pair is the key now.
+        _create_follows('_follows_new')
+        op.execute('INSERT INTO _follows_new (follower_id, followed_id, timestamp) '
+                   'SELECT follower_id, followed_id, min(timestamp) FROM follows '
+                   'WHERE follower_id IS NOT NULL AND followed_id IS NOT NULL '
+                   'GROUP BY follower_id, followed_id')
+        op.drop_table('follows')
+        op.rename_table('_follows_new', 'follows')
+
+
+def upgrade_comments(existing):
+    if not existing:
+        op.create_table(
+            'comments',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('body', sa.Text(), nullable=True),
+            sa.Column('body_html', sa.Text(), nullable=True),
+            sa.Column('timestamp', sa.DateTime(), nullable=True),
+            sa.Column('disabled', sa.Boolean(), nullable=True),
+            sa.Column('author_id', sa.Integer(), nullable=True),
+            sa.Column('post_id', sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(['author_id'], ['users.id']),
+            sa.ForeignKeyConstraint(['post_id'], ['posts.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+    elif 'commentator_id' in _columns('comments'):
+        with op.batch_alter_table('comments') as batch_op:
+            batch_op.alter_column('commentator_id', new_column_name='author_id',
+                                  existing_type=sa.Integer())
+    _create_index('ix_comments_timestamp', 'comments', ['timestamp'])
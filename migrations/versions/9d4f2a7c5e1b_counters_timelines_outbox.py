@@ -0,0 +1,208 @@
+"""counters, updated_at, timelines, outbox and search index
+
+Revision ID: 9d4f2a7c5e1b
+Revises: 3b8e0c6d1f2a
+Create Date: 2026-10-18 22:45:00.000000
+
+Existing rows get their counters filled in with the same queries as
+User.recount and Post.recount, so profiles do not show -1 followers after the
+upgrade. A counter whose source table lives in another bind cannot be counted
+from here; the upgrade logs it and ``python manager.py recount`` fixes it.
+
+"""
+from datetime import datetime
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4f2a7c5e1b'
+down_revision = '3b8e0c6d1f2a'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.env')
+
+TABLES = ('users', 'posts', 'follows', 'comments', 'timelines', 'outbox')
+
+# (table, counter, source table, source column)
+COUNTERS = (
+    ('users', 'posts_count', 'posts', 'author_id'),
+    ('users', 'comments_count', 'comments', 'author_id'),
+    ('users', 'followed_count', 'follows', 'follower_id'),
+    ('users', 'followers_count', 'follows', 'followed_id'),
+    ('posts', 'comments_count', 'comments', 'post_id'),
+)
+
+
+def _tables(engine_name):
+    """Names of the tables that live in this bind (see FLASK_TABLE_BINDS)."""
+    db = current_app.extensions['migrate'].db
+    return set(t.name for t in db.get_tables_for_bind(engine_name or None))
+
+
+def _create_index(name, table, columns, unique=False):
+    indexes = sa.inspect(op.get_bind()).get_indexes(table)
+    if name not in set(index['name'] for index in indexes):
+        op.create_index(name, table, columns, unique=unique)
+
+
+def upgrade(engine_name):
+    tables = _tables(engine_name)
+    for name in TABLES:
+        if name in tables:
+            globals()['upgrade_%s' % name]()
+    for table, counter, source, column in COUNTERS:
+        if table not in tables:
+            continue
+        if source not in tables:
+            logger.warning('%s.%s counts rows in another database; run '
+                           '"python manager.py recount" after the upgrade',
+                           table, counter)
+            continue
+        target = sa.table(table, sa.column('id'), sa.column(counter))
+        rows = sa.table(source, sa.column(column))
+        op.execute(target.update().values({
+            counter: sa.select([sa.func.count()]).select_from(rows).
+            where(rows.c[column] == target.c.id).as_scalar()}))
+    if 'posts' in tables and op.get_bind().dialect.name == 'sqlite':
+        _build_search_index('comments' in tables)
+
+
+def downgrade(engine_name):
+    tables = _tables(engine_name)
+    for name in reversed(TABLES):
+        if name in tables:
+            globals()['downgrade_%s' % name]()
+
+
+def _touch(table):
+    """Give existing rows an updated_at, the column's default covers new ones."""
+    rows = sa.table(table, sa.column('updated_at'))
+    op.execute(rows.update().values(updated_at=datetime.utcnow()))
+
+
+def _build_search_index(with_comments):
+    from app.search import search_index
+    connection = op.get_bind()
+    search_index.create(connection)
+    op.execute('DELETE FROM search_index')
+    op.execute('INSERT INTO search_index (rowid, body) SELECT id * 2, body '
+               'FROM posts WHERE body IS NOT NULL')
+    if with_comments:
+        op.execute('INSERT INTO search_index (rowid, body) SELECT id * 2 + 1, '
+                   'body FROM comments WHERE body IS NOT NULL AND '
+                   'NOT coalesce(disabled, 0)')
+    else:
+        logger.warning('comments live in another database; run '
+                       '"python manager.py reindex" after the upgrade')
+
+
+def upgrade_users():
+    op.add_column('users', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    for counter in ('posts_count', 'comments_count', 'followed_count',
+                    'followers_count'):
+        op.add_column('users', sa.Column(counter, sa.Integer(), nullable=True,
+                                         server_default='0'))
+    _touch('users')
+    _create_index('ix_users_updated_at', 'users', ['updated_at'])
+
+
+def downgrade_users():
+    op.drop_index('ix_users_updated_at', table_name='users')
+    with op.batch_alter_table('users') as batch_op:
+        for column in ('followers_count', 'followed_count', 'comments_count',
+                       'posts_count', 'updated_at'):
+            batch_op.drop_column(column)
+
+
+def upgrade_posts():
+    op.add_column('posts', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.add_column('posts', sa.Column('comments_count', sa.Integer(), nullable=True,
+                                     server_default='0'))
+    _touch('posts')
+    _create_index('ix_posts_updated_at', 'posts', ['updated_at'])
+    _create_index('ix_posts_author_id', 'posts', ['author_id'])
+
+
+def downgrade_posts():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS search_index')
+    op.drop_index('ix_posts_author_id', table_name='posts')
+    op.drop_index('ix_posts_updated_at', table_name='posts')
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('comments_count')
+        batch_op.drop_column('updated_at')
+
+
+def upgrade_follows():
+    _create_index('ix_follows_followed_id', 'follows', ['followed_id'])
+
+
+def downgrade_follows():
+    op.drop_index('ix_follows_followed_id', table_name='follows')
+
+
+def upgrade_comments():
+    op.add_column('comments', sa.Column('updated_at', sa.DateTime(),
+                                        nullable=True))
+    _touch('comments')
+    _create_index('ix_comments_updated_at', 'comments', ['updated_at'])
+    _create_index('ix_comments_author_id', 'comments', ['author_id'])
+    _create_index('ix_comments_post_id', 'comments', ['post_id'])
+
+
+def downgrade_comments():
+    op.drop_index('ix_comments_post_id', table_name='comments')
+    op.drop_index('ix_comments_author_id', table_name='comments')
+    op.drop_index('ix_comments_updated_at', table_name='comments')
+    with op.batch_alter_table('comments') as batch_op:
+        batch_op.drop_column('updated_at')
+
+
+def upgrade_timelines():
+    op.create_table(
+        'timelines',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['post_id'], ['posts.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('user_id', 'post_id')
+    )
+    op.create_index('ix_timelines_post_id', 'timelines', ['post_id'])
+    op.create_index('ix_timelines_user_id_timestamp', 'timelines',
+                    ['user_id', 'timestamp'])
+
+
+def downgrade_timelines():
+    op.drop_table('timelines')
+
+
+def upgrade_outbox():
+    op.create_table(
+        'outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('recipient', sa.String(length=64), nullable=True),
+        sa.Column('subject', sa.String(length=128), nullable=True),
+        sa.Column('template', sa.String(length=128), nullable=True),
+        sa.Column('context', sa.Text(), nullable=True),
+        sa.Column('status', sa.String(length=16), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=True),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=True),
+        sa.Column('claimed_by', sa.String(length=64), nullable=True),
+        sa.Column('claimed_until', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outbox_status_next_attempt_at', 'outbox',
+                    ['status', 'next_attempt_at'])
+
+
+def downgrade_outbox():
+    op.drop_table('outbox')
@@ -0,0 +1,308 @@
+import gzip
+import time
+import unittest
+import json
+from base64 import b64encode
+from werkzeug.http import http_date
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import create_app, db
+from app.models import User, Role, Post, Comment
+
+
+class APITestCase(unittest.TestCase):
+	def setUp(self):
+		self.app = create_app('testing')
+		self.app_context = self.app.app_context()
+		self.app_context.push()
+		db.create_all()
+		Role.insert_roles()
+		self.client = self.app.test_client()
+
+	def tearDown(self):
+		db.session.remove()
+		db.drop_all()
+		self.app_context.pop()
+
+	def get_api_headers(self, username, password):
+		return {
+			'Authorization': 'Basic ' + b64encode(
+				(username + ':' + password).encode('utf-8')).decode('utf-8'),
+			'Accept': 'application/json',
+			'Content-Type': 'application/json'
+		}
+
+	def get_json(self, url):
+		response = self.client.get(url, headers=self.get_api_headers('', ''))
+		self.assertEqual(response.status_code, 200)
+		return json.loads(response.get_data(as_text=True))
+
+	def test_cursor_pagination_walks_every_post(self):
+		u = User(email='john@example.com', username='john', password='cat',
+			confirmed=True)
+		for i in range(12):
+			db.session.add(Post(body='post %d' % i, author=u))
+		db.session.commit()
+		url = '/api/v1.0/posts/?cursor='
+		seen = []
+		while url:
+			data = self.get_json(url)
+			self.assertNotIn('posts_count', data)
+			seen.extend(post['url'] for post in data['posts'])
+			url = data['next']
+		self.assertEqual(len(seen), 12)
+		self.assertEqual(len(set(seen)), 12)
+		expected = [post.id for post in
+			Post.query.order_by(Post.timestamp.desc(), Post.id.desc())]
+		self.assertEqual([int(url.rsplit('/', 1)[1]) for url in seen], expected)
+
+	def test_cursor_pagination_count(self):
+		u = User(email='john@example.com', username='john', password='cat')
+		db.session.add(Post(body='post', author=u))
+		db.session.commit()
+		data = self.get_json('/api/v1.0/posts/?cursor=&count=1')
+		self.assertEqual(data['posts_count'], 1)
+		self.assertIsNone(data['next'])
+
+	def test_invalid_cursor(self):
+		response = self.client.get('/api/v1.0/posts/?cursor=garbage',
+			headers=self.get_api_headers('', ''))
+		self.assertEqual(response.status_code, 400)
+
+	def test_conditional_get(self):
+		u = User(email='john@example.com', username='john', password='cat')
+		p = Post(body='post', author=u)
+		db.session.add(p)
+		db.session.commit()
+		headers = self.get_api_headers('', '')
+		for url in ('/api/v1.0/post/%d' % p.id, '/api/v1.0/posts/',
+			'/api/v1.0/user/john/timeline/?cursor='):
+			response = self.client.get(url, headers=headers)
+			self.assertEqual(response.status_code, 200)
+			last_modified = response.headers.get('Last-Modified')
+			headers['If-None-Match'] = response.headers['ETag']
+			response = self.client.get(url, headers=headers)
+			self.assertEqual(response.status_code, 304)
+			self.assertEqual(response.get_data(), b'')
+			del headers['If-None-Match']
+			if url.endswith('/') or '?' in url:
+				# 列表只用 ETag 校验
+				self.assertIsNone(last_modified)
+				continue
+			headers['If-Modified-Since'] = last_modified
+			self.assertEqual(self.client.get(url, headers=headers).status_code, 304)
+			del headers['If-Modified-Since']
+		headers['If-None-Match'] = self.client.get('/api/v1.0/posts/',
+			headers=headers).headers['ETag']
+		db.session.add(Comment(body='comment', commentator=u, post=p))
+		db.session.commit()
+		self.assertEqual(self.client.get('/api/v1.0/posts/', headers=headers).status_code, 200)
+		self.assertEqual(self.client.get('/api/v1.0/post/12345', headers=headers).status_code, 404)
+
+	def test_collection_revalidates_after_delete(self):
+		u = User(email='john@example.com', username='john', password='cat')
+		p1 = Post(body='post 1', author=u)
+		p2 = Post(body='post 2', author=u)
+		db.session.add_all([p1, p2])
+		db.session.commit()
+		headers = self.get_api_headers('', '')
+		response = self.client.get('/api/v1.0/posts/', headers=headers)
+		headers['If-None-Match'] = response.headers['ETag']
+		headers['If-Modified-Since'] = http_date(time.time() + 60)
+		db.session.delete(p1)
+		db.session.commit()
+		response = self.client.get('/api/v1.0/posts/', headers=headers)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(len(json.loads(response.get_data(as_text=True))['posts']), 1)
+		del headers['If-None-Match']
+		response = self.client.get('/api/v1.0/posts/', headers=headers)
+		self.assertEqual(response.status_code, 200)
+
+	def test_collection_revalidates_after_rename(self):
+		u = User(email='john@example.com', username='john', password='cat')
+		p = Post(body='post', author=u)
+		db.session.add_all([p, Comment(body='comment', commentator=u, post=p)])
+		db.session.commit()
+		urls = ('/api/v1.0/posts/', '/api/v1.0/comments/',
+			'/api/v1.0/post/%d/comments/' % p.id, '/api/v1.0/comments/?expand=post')
+		etags = {}
+		for url in urls:
+			etags[url] = self.client.get(url,
+				headers=self.get_api_headers('', '')).headers['ETag']
+		u.username = 'johnny'
+		db.session.commit()
+		for url in urls:
+			headers = self.get_api_headers('', '')
+			headers['If-None-Match'] = etags[url]
+			response = self.client.get(url, headers=headers)
+			self.assertEqual(response.status_code, 200)
+			self.assertIn('/api/v1.0/user/johnny', response.get_data(as_text=True))
+
+	def test_next_links_keep_fields_and_expand(self):
+		u = User(email='john@example.com', username='john', password='cat')
+		db.session.add_all([Post(body='post %d' % i, author=u) for i in range(7)])
+		db.session.commit()
+		for url in ('/api/v1.0/posts/?cursor=&count=1&fields=body,author.username'
+			'&expand=author', '/api/v1.0/posts/?fields=body,author.username&expand=author',
+			'/api/v1.0/user/john/posts/?fields=body,author.username&expand=author'):
+			first = self.get_json(url)
+			second = self.get_json(first['next'])
+			for page in (first, second):
+				for post in page['posts']:
+					self.assertEqual(sorted(post), ['author', 'body'])
+					self.assertEqual(post['author'], {'username': 'john'})
+			self.assertEqual(len(first['posts']) + len(second['posts']), 7)
+			self.assertIsNone(second['next'])
+			if 'cursor' in url:
+				self.assertEqual(second['posts_count'], 7)
+			else:
+				self.assertEqual(sorted(self.get_json(second['prev'])['posts'][0]),
+					['author', 'body'])
+
+	def test_fields_and_expand(self):
+		u = User(email='john@example.com', username='john', password='cat')
+		p = Post(body='post', author=u)
+		c = Comment(body='comment', commentator=u, post=p)
+		db.session.add_all([p, c])
+		db.session.commit()
+		post = self.get_json('/api/v1.0/post/%d?fields=body,comment_count' % p.id)
+		self.assertEqual(post, {'body': 'post', 'comment_count': 1})
+		post = self.get_json('/api/v1.0/post/%d?fields=body,author.username&expand=author'
+			% p.id)
+		self.assertEqual(post, {'body': 'post', 'author': {'username': 'john'}})
+		comments = self.get_json('/api/v1.0/comments/?expand=post.author&fields=post')
+		self.assertEqual(comments['comments'][0]['post']['body'], 'post')
+		self.assertEqual(comments['comments'][0]['post']['author']['username'], 'john')
+		self.assertTrue(self.get_json('/api/v1.0/comments/')['comments'][0]['post'].
+			startswith('/api/v1.0/post/'))
+		response = self.client.get('/api/v1.0/posts/?fields=body,,', 
+			headers=self.get_api_headers('', ''))
+		self.assertEqual(response.status_code, 200)
+		response = self.client.get('/api/v1.0/posts/?fields=author..username',
+			headers=self.get_api_headers('', ''))
+		self.assertEqual(response.status_code, 400)
+
+	def test_nested_expand_query_count(self):
+		def count_queries(url):
+			statements = []
+			def record(*args):
+				statements.append(1)
+			event.listen(Engine, 'before_cursor_execute', record)
+			try:
+				data = self.get_json(url)
+			finally:
+				event.remove(Engine, 'before_cursor_execute', record)
+			return len(statements), data
+		url = '/api/v1.0/comments/?expand=post.author'
+		reader = User(email='reader@example.com', username='reader', password='cat')
+		db.session.add(reader)
+		db.session.commit()
+		counts = []
+		for i in range(3):
+			u = User(email='user%d@example.com' % i, username='user%d' % i,
+				password='cat')
+			p = Post(body='post %d' % i, author=u)
+			db.session.add(Comment(body='comment %d' % i, commentator=reader, post=p))
+			db.session.commit()
+			db.session.remove()
+			count, data = count_queries(url)
+			counts.append(count)
+		self.assertEqual(counts[0], counts[2])
+		self.assertEqual(sorted(comment['post']['author']['username']
+			for comment in data['comments']), ['user0', 'user1', 'user2'])
+		etag = self.client.get(url, headers=self.get_api_headers('', '')).headers['ETag']
+		u = User.query.filter_by(username='user0').first()
+		u.name = 'John'
+		db.session.commit()
+		self.assertNotEqual(self.client.get(url,
+			headers=self.get_api_headers('', '')).headers['ETag'], etag)
+
+	def test_batch_lookup(self):
+		u1 = User(email='john@example.com', username='john', password='cat')
+		u2 = User(email='susan@example.com', username='susan', password='dog')
+		p1 = Post(body='post 1', author=u1)
+		p2 = Post(body='post 2', author=u2)
+		c = Comment(body='comment', commentator=u2, post=p1)
+		db.session.add_all([p1, p2, c])
+		db.session.commit()
+		posts = self.get_json('/api/v1.0/posts/?ids=%d,12345,%d&fields=body' %
+			(p2.id, p1.id))
+		self.assertEqual(posts['posts'], [{'body': 'post 2'}, {'body': 'post 1'}])
+		self.assertEqual(posts['missing'], [12345])
+		users = self.get_json('/api/v1.0/users/?usernames=susan,nobody,john')
+		self.assertEqual([user['username'] for user in users['users']], ['susan', 'john'])
+		self.assertEqual(users['missing'], ['nobody'])
+		comments = self.get_json('/api/v1.0/comments/?ids=%d' % c.id)
+		self.assertEqual(comments['comments'][0]['body'], 'comment')
+		self.app.config['FLASK_API_BATCH_LIMIT'] = 2
+		for url in ('/api/v1.0/posts/?ids=1,2,3', '/api/v1.0/posts/?ids=x'):
+			response = self.client.get(url, headers=self.get_api_headers('', ''))
+			self.assertEqual(response.status_code, 400)
+
+	def test_batch_writes(self):
+		u = User(email='john@example.com', username='john', password='cat',
+			confirmed=True)
+		susan = User(email='susan@example.com', username='susan', password='dog')
+		db.session.add_all([u, susan])
+		db.session.commit()
+		headers = self.get_api_headers('john@example.com', 'cat')
+		response = self.client.post('/api/v1.0/posts/batch', headers=headers,
+			data=json.dumps({'posts': [{'body': 'one'}, {'body': ''}, {'body': 'two'}]}))
+		self.assertEqual(response.status_code, 200)
+		results = json.loads(response.get_data(as_text=True))['results']
+		self.assertEqual([result['status'] for result in results], [201, 400, 201])
+		self.assertEqual(results[2]['post']['body'], 'two')
+		self.assertEqual(User.query.get(u.id).posts_count, 2)
+		post_id = Post.query.filter_by(body='one').first().id
+		response = self.client.post('/api/v1.0/comments/batch', headers=headers,
+			data=json.dumps({'comments': [{'post_id': post_id, 'body': 'nice'},
+				{'post_id': 12345, 'body': 'lost'}, 'junk']}))
+		results = json.loads(response.get_data(as_text=True))['results']
+		self.assertEqual([result['status'] for result in results], [201, 400, 400])
+		self.assertEqual(Post.query.get(post_id).comments_count, 1)
+		response = self.client.post('/api/v1.0/follows/batch', headers=headers,
+			data=json.dumps({'follows': [{'username': 'susan'}, {'username': 'susan'},
+				{'username': 'nobody'}]}))
+		results = json.loads(response.get_data(as_text=True))['results']
+		self.assertEqual([result['status'] for result in results], [201, 200, 404])
+		self.assertTrue(User.query.get(u.id).is_following(User.query.get(susan.id)))
+		response = self.client.post('/api/v1.0/posts/batch', headers=headers,
+			data=json.dumps({'posts': 'nope'}))
+		self.assertEqual(response.status_code, 400)
+		response = self.client.post('/api/v1.0/posts/batch',
+			headers=self.get_api_headers('', ''), data=json.dumps({'posts': []}))
+		self.assertEqual(response.status_code, 403)
+
+	def test_export(self):
+		admin = User(email=self.app.config['FLASK_ADMIN'], username='admin',
+			password='cat', confirmed=True)
+		u = User(email='john@example.com', username='john', password='cat',
+			confirmed=True)
+		db.session.add_all([admin, u] + [Post(body='post %d' % i, author=u)
+			for i in range(5)])
+		db.session.commit()
+		self.app.config['FLASK_EXPORT_BATCH_SIZE'] = 2
+		headers = self.get_api_headers(self.app.config['FLASK_ADMIN'], 'cat')
+		response = self.client.get('/api/v1.0/export/posts', headers=headers)
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue(response.is_streamed)
+		posts = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+		self.assertEqual([post['body'] for post in posts], ['post %d' % i for i in range(5)])
+		since = response.headers['X-Export-Timestamp']
+		post = Post.query.filter_by(body='post 3').first()
+		post.body = 'post 3 edited'
+		db.session.add(post)
+		db.session.commit()
+		headers['Accept-Encoding'] = 'gzip'
+		response = self.client.get('/api/v1.0/export/posts?since=' + since,
+			headers=headers)
+		self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+		lines = gzip.decompress(response.get_data()).decode('utf-8').splitlines()
+		self.assertEqual([json.loads(line)['body'] for line in lines], ['post 3 edited'])
+		users = gzip.decompress(self.client.get('/api/v1.0/export/users',
+			headers=headers).get_data()).decode('utf-8')
+		self.assertIn('"username": "john"', users)
+		self.assertNotIn('password_hash', users)
+		response = self.client.get('/api/v1.0/export/posts',
+			headers=self.get_api_headers('john@example.com', 'cat'))
+		self.assertEqual(response.status_code, 403)
@@ -0,0 +1,55 @@
+import unittest
+from app import create_app, db
+from app.models import User, Role, Post, Comment
+
+
+class CountersTestCase(unittest.TestCase):
+	def setUp(self):
+		self.app = create_app('testing')
+		self.app_context = self.app.app_context()
+		self.app_context.push()
+		db.create_all()
+		Role.insert_roles()
+
+	def tearDown(self):
+		db.session.remove()
+		db.drop_all()
+		self.app_context.pop()
+
+	def test_follow_counters(self):
+		u1 = User(email='john@example.com', username='john', password='cat')
+		u2 = User(email='susan@example.com', username='susan', password='dog')
+		u1.follow(u2)
+		self.assertEqual(u1.followed_count, 2)
+		self.assertEqual(u2.followers_count, 2)
+		u1.unfollow(u2)
+		self.assertEqual(u1.followed_count, 1)
+		self.assertEqual(u2.followers_count, 1)
+
+	def test_post_and_comment_counters(self):
+		u = User(email='john@example.com', username='john', password='cat')
+		post = Post(body='post', author=u)
+		db.session.add(post)
+		db.session.commit()
+		comment = Comment(body='comment', post=post, commentator=u)
+		db.session.add(comment)
+		db.session.commit()
+		self.assertEqual(u.posts_count, 1)
+		self.assertEqual(u.comments_count, 1)
+		self.assertEqual(post.comments_count, 1)
+		db.session.delete(comment)
+		db.session.commit()
+		self.assertEqual(u.comments_count, 0)
+		self.assertEqual(post.comments_count, 0)
+
+	def test_recount(self):
+		u = User(email='john@example.com', username='john', password='cat')
+		db.session.add(Post(body='post', author=u))
+		db.session.commit()
+		db.session.execute(User.__table__.update().values(posts_count=7,
+			followers_count=0))
+		db.session.commit()
+		User.recount()
+		Post.recount()
+		self.assertEqual(u.posts_count, 1)
+		self.assertEqual(u.followers_count, 1)
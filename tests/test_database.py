@@ -0,0 +1,267 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from flask_migrate import Migrate, upgrade, migrate
+from sqlalchemy import event
+from app import create_app, db
+from app.identity import identity_cache
+from app.models import User, Role, Post, Comment, Follow, Outbox
+
+base_dir = os.path.abspath(os.path.dirname(__file__))
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+	def setUp(self):
+		self.app = create_app('testing')
+		self.replica = os.path.join(base_dir, 'data-test-replica.sqlite')
+		self.app.config['SQLALCHEMY_BINDS'] = {'replica': 'sqlite:///' + self.replica}
+		self.app.config['FLASK_DB_REPLICAS'] = ['replica']
+		self.app_context = self.app.app_context()
+		self.app_context.push()
+		db.create_all()
+		db.metadata.create_all(bind=db.get_engine(self.app, 'replica'))
+		Role.insert_roles()
+
+	def tearDown(self):
+		db.session.remove()
+		db.drop_all()
+		self.app_context.pop()
+		os.remove(self.replica)
+
+	def test_reads_go_to_replica_until_a_write(self):
+		# 副本里还没有同步到这个用户
+		db.session.add(User(email='john@example.com', username='john', password='cat'))
+		db.session.commit()
+		db.session.remove()
+		self.assertIsNone(User.query.filter_by(username='john').first())
+		self.assertEqual(Role.query.count(), 0)
+		db.session.add(User(email='susan@example.com', username='susan', password='dog'))
+		db.session.commit()
+		self.assertIsNotNone(User.query.filter_by(username='john').first())
+		db.session.remove()
+		self.assertEqual(User.query.count(), 0)
+
+	def replica_statements(self):
+		statements = []
+		event.listen(db.get_engine(self.app, 'replica'), 'before_cursor_execute',
+			lambda conn, cursor, statement, *args: statements.append(statement))
+		return statements
+
+	# 副本是空的, 查到副本上就拿不到刚写入主库的数据
+	def test_identity_checks_read_the_primary(self):
+		u = User(email='john@example.com', username='john', password='cat')
+		db.session.add(u)
+		db.session.commit()
+		id = u.id
+		db.session.remove()
+		statements = self.replica_statements()
+		self.assertEqual(identity_cache.get_user(id).username, 'john')
+		db.session.remove()
+		user = identity_cache.get_user(id)
+		self.assertEqual(user.username, 'john')
+		self.assertNotIn('use_primary', db.session().info)
+		self.assertEqual(statements, [])
+
+	def test_outbox_claim_reads_the_primary(self):
+		db.session.add(Outbox(recipient='john@example.com', subject='hello',
+			template='auth/email/confirm', context='{}'))
+		db.session.commit()
+		db.session.remove()
+		statements = self.replica_statements()
+		self.assertEqual(len(Outbox.claim('worker', 10, 60)), 1)
+		self.assertEqual(statements, [])
+
+	def test_replicas_are_not_migrated(self):
+		self.assertEqual(db.table_binds(), [])
+
+	def test_without_replicas_everything_uses_primary(self):
+		self.app.config['FLASK_DB_REPLICAS'] = []
+		db.session.add(User(email='john@example.com', username='john', password='cat'))
+		db.session.commit()
+		db.session.remove()
+		self.assertIsNotNone(User.query.filter_by(username='john').first())
+
+
+class SplitBindsTestCase(unittest.TestCase):
+	def setUp(self):
+		self.app = create_app('testing')
+		self.files = dict((key, os.path.join(base_dir, 'data-test-%s.sqlite' % key))
+			for key in ('follows', 'comments'))
+		self.app.config['SQLALCHEMY_BINDS'] = dict((key, 'sqlite:///' + path)
+			for key, path in self.files.items())
+		self.app.config['FLASK_TABLE_BINDS'] = {'follows': 'follows', 'comments': 'comments'}
+		self.app.config['FLASK_SQLITE_PRAGMAS'] = {'journal_mode': 'WAL', 'busy_timeout': 1000}
+		self.app.config['FLASK_TIMELINE_ENABLED'] = True
+		self.app_context = self.app.app_context()
+		self.app_context.push()
+		db.create_all()
+		Role.insert_roles()
+
+	def tearDown(self):
+		db.session.remove()
+		db.drop_all()
+		self.app_context.pop()
+		for path in self.files.values():
+			for suffix in ('', '-wal', '-shm'):
+				if os.path.exists(path + suffix):
+					os.remove(path + suffix)
+
+	def tables(self, path):
+		connection = sqlite3.connect(path)
+		try:
+			return set(name for name, in connection.execute(
+				"SELECT name FROM sqlite_master WHERE type = 'table'"))
+		finally:
+			connection.close()
+
+	def test_tables_live_in_their_own_files(self):
+		self.assertEqual(self.tables(self.files['follows']), set(['follows']))
+		self.assertEqual(self.tables(self.files['comments']), set(['comments']))
+		self.assertEqual(db.session.get_bind(Follow.__mapper__),
+			db.get_engine(self.app, 'follows'))
+		self.assertEqual(db.table_binds(), ['comments', 'follows'])
+		self.assertEqual([table.name for table in db.get_tables_for_bind('follows')],
+			['follows'])
+		self.assertNotIn('follows', [table.name for table in db.get_tables_for_bind()])
+
+	def test_cross_bind_writes_and_queries(self):
+		u1 = User(email='john@example.com', username='john', password='cat')
+		u2 = User(email='susan@example.com', username='susan', password='dog')
+		db.session.add_all([u1, u2])
+		db.session.commit()
+		u1.follow(u2)
+		p = Post(body='hello', author=u2)
+		db.session.add(p)
+		db.session.commit()
+		db.session.add(Comment(body='hi', commentator=u1, post=p))
+		db.session.commit()
+		self.assertEqual(u1.followed_count, 2)
+		self.assertEqual(u2.followers_count, 2)
+		self.assertEqual(p.comments_count, 1)
+		self.assertEqual(u1.followed_posts.all(), [p])
+		self.assertEqual(Post.query.join(Follow, Follow.followed_id == Post.author_id).
+			filter(Follow.follower_id == u1.id).all(), [p])
+		u1.unfollow(u2)
+		db.session.commit()
+		self.assertEqual(u1.followed_posts.all(), [])
+		User.recount()
+		self.assertEqual(u1.comments_count, 1)
+		self.assertEqual(u2.followers_count, 1)
+
+
+class SQLitePragmaTestCase(unittest.TestCase):
+	def setUp(self):
+		self.app = create_app('testing')
+		self.path = os.path.join(base_dir, 'data-test-pragmas.sqlite')
+		self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + self.path
+		self.app.config['FLASK_SQLITE_PRAGMAS'] = {'journal_mode': 'WAL',
+			'busy_timeout': 1234, 'synchronous': 'NORMAL'}
+		self.app.config['SQLALCHEMY_POOL_SIZE'] = 2
+		self.app_context = self.app.app_context()
+		self.app_context.push()
+		db.create_all()
+
+	def tearDown(self):
+		db.session.remove()
+		db.drop_all()
+		db.get_engine(self.app).dispose()
+		self.app_context.pop()
+		for suffix in ('', '-wal', '-shm'):
+			if os.path.exists(self.path + suffix):
+				os.remove(self.path + suffix)
+
+	def test_pragmas_on_every_pooled_connection(self):
+		engine = db.get_engine(self.app)
+		self.assertEqual(type(engine.pool).__name__, 'QueuePool')
+		connections = [engine.connect() for i in range(2)]
+		try:
+			for connection in connections:
+				self.assertEqual(connection.execute('PRAGMA journal_mode').scalar(), 'wal')
+				self.assertEqual(connection.execute('PRAGMA busy_timeout').scalar(), 1234)
+				# NORMAL = 1
+				self.assertEqual(connection.execute('PRAGMA synchronous').scalar(), 1)
+		finally:
+			for connection in connections:
+				connection.close()
+		info = db.diagnostics(self.app)
+		self.assertEqual(info['pool'], 'QueuePool')
+		self.assertEqual(info['pragmas']['journal_mode'], 'wal')
+		self.assertEqual(info['pragmas']['busy_timeout'], 1234)
+
+
+class MigrationsTestCase(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.migrations = os.path.join(self.dir, 'migrations')
+		shutil.copytree(os.path.join(base_dir, '..', 'migrations'), self.migrations)
+		self.app = create_app('testing')
+		self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+			os.path.join(self.dir, 'data.sqlite')
+		Migrate(self.app, db, render_as_batch=True)
+		self.app_context = self.app.test_request_context()
+		self.app_context.push()
+
+	def tearDown(self):
+		db.session.remove()
+		db.get_engine(self.app).dispose()
+		self.app_context.pop()
+		shutil.rmtree(self.dir)
+
+	def split_binds(self):
+		self.app.config['SQLALCHEMY_BINDS'] = dict((key, 'sqlite:///' +
+			os.path.join(self.dir, '%s.sqlite' % key)) for key in ('follows', 'comments'))
+		self.app.config['FLASK_TABLE_BINDS'] = {'follows': 'follows', 'comments': 'comments'}
+
+	# 升级后再 autogenerate 不应产生新的迁移, 即迁移得到的库与模型一致
+	def assertMigrated(self):
+		versions = os.path.join(self.migrations, 'versions')
+		before = set(os.listdir(versions))
+		migrate(directory=self.migrations, message='check')
+		self.assertEqual(set(os.listdir(versions)) - before, set())
+
+	def test_upgrade_empty_database(self):
+		upgrade(directory=self.migrations)
+		self.assertMigrated()
+		Role.insert_roles()
+		db.session.add(User(email='john@example.com', username='john', password='cat'))
+		db.session.commit()
+		self.assertEqual(User.query.one().followers_count, 1)
+
+	def test_upgrade_split_binds(self):
+		self.split_binds()
+		upgrade(directory=self.migrations)
+		self.assertMigrated()
+		for key, table in (('follows', 'follows'), ('comments', 'comments')):
+			connection = sqlite3.connect(os.path.join(self.dir, '%s.sqlite' % key))
+			try:
+				self.assertIn((table,), connection.execute(
+					"SELECT name FROM sqlite_master WHERE type = 'table'").fetchall())
+			finally:
+				connection.close()
+
+	# 迁移之前用 db.create_all() 建的旧库
+	def test_upgrade_existing_database(self):
+		shutil.copy(os.path.join(base_dir, '..', 'data-dev.sqlite.bak'),
+			os.path.join(self.dir, 'data.sqlite'))
+		upgrade(directory=self.migrations)
+		self.assertMigrated()
+		user = User.query.first()
+		self.assertIsNotNone(user.updated_at)
+		# 计数列已按现有数据回填, 与 recount 的结果一致
+		counters = (User.id, User.posts_count, User.comments_count, User.followed_count,
+			User.followers_count)
+		users = db.session.query(*counters).order_by(User.id).all()
+		posts = db.session.query(Post.id, Post.comments_count).order_by(Post.id).all()
+		self.assertEqual(db.session.query(User).filter(User.followers_count < 1).count(), 0)
+		self.assertGreater(sum(count for id, count in posts), 0)
+		User.recount()
+		Post.recount()
+		self.assertEqual(db.session.query(*counters).order_by(User.id).all(), users)
+		self.assertEqual(db.session.query(Post.id, Post.comments_count).
+			order_by(Post.id).all(), posts)
+		client = self.app.test_client()
+		for url in ('/', '/user/%s' % user.username, '/api/v1.0/posts/',
+			'/search?q=the'):
+			self.assertEqual(client.get(url).status_code, 200)
@@ -0,0 +1,99 @@
+import unittest
+from app import create_app, db
+from app.follow_graph import IdSet, follow_graph
+from app.models import User, Role, Follow
+
+
+class FollowGraphTestCase(unittest.TestCase):
+	def setUp(self):
+		self.app = create_app('testing')
+		self.app_context = self.app.app_context()
+		self.app_context.push()
+		db.create_all()
+		Role.insert_roles()
+
+	def tearDown(self):
+		db.session.remove()
+		db.drop_all()
+		self.app_context.pop()
+
+	def test_id_set(self):
+		dense = IdSet([3, 1, 2, 2, 8])
+		sparse = IdSet([5, 1000000])
+		self.assertIsNotNone(dense._bitmap)
+		self.assertIsNone(sparse._bitmap)
+		self.assertEqual(len(dense), 4)
+		self.assertIn(8, dense)
+		self.assertNotIn(9, dense)
+		self.assertNotIn(-1, dense)
+		self.assertIn(1000000, sparse)
+		self.assertNotIn(6, sparse)
+		self.assertEqual(list(dense.intersection(IdSet([2, 8, 9]))), [2, 8])
+
+	def test_follows_invalidate_cache(self):
+		u1 = User(email='john@example.com', username='john', password='cat')
+		u2 = User(email='susan@example.com', username='susan', password='dog')
+		db.session.add_all([u1, u2])
+		db.session.commit()
+		self.assertFalse(u1.is_following(u2))
+		self.assertEqual(follow_graph.followers_count(u2.id), 1)
+		u1.follow(u2)
+		self.assertTrue(u1.is_following(u2))
+		self.assertTrue(u2.is_followed_by(u1))
+		self.assertFalse(u1.is_mutual_follow(u2))
+		u2.follow(u1)
+		self.assertTrue(u1.is_mutual_follow(u2))
+		self.assertEqual(sorted(u1.mutual_follow_ids), sorted([u1.id, u2.id]))
+		u1.unfollow(u2)
+		self.assertFalse(u1.is_following(u2))
+		self.assertEqual(follow_graph.followers_count(u2.id), 1)
+
+	def test_rollback_invalidates_cache(self):
+		u1 = User(email='john@example.com', username='john', password='cat')
+		u2 = User(email='susan@example.com', username='susan', password='dog')
+		db.session.add(Follow(follower=u1, followed=u2))
+		db.session.flush()
+		self.assertTrue(u1.is_following(u2))
+		db.session.rollback()
+		self.assertFalse(u1.is_following(u2))
+
+	def test_writes_ignore_stale_cache(self):
+		u1 = User(email='john@example.com', username='john', password='cat')
+		u2 = User(email='susan@example.com', username='susan', password='dog')
+		db.session.add_all([u1, u2])
+		db.session.commit()
+		u1.follow(u2)
+		self.assertTrue(u1.is_following(u2))
+		# 模拟其他进程删除了关注关系, 本进程缓存未失效
+		db.session.execute(Follow.__table__.delete().where(
+			Follow.follower_id == u1.id).where(Follow.followed_id == u2.id))
+		db.session.commit()
+		self.assertTrue(u1.is_following(u2))
+		self.assertTrue(u1.unfollow(u2))
+		u1.follow(u2)
+		self.assertEqual(u1.followed.filter_by(followed_id=u2.id).count(), 1)
+		# 缓存认为未关注, 数据库中已有关注关系
+		db.session.execute(Follow.__table__.delete().where(Follow.follower_id == u1.id))
+		db.session.commit()
+		follow_graph.clear()
+		self.assertFalse(u1.is_following(u2))
+		db.session.execute(Follow.__table__.insert().values(follower_id=u1.id,
+			followed_id=u2.id))
+		db.session.commit()
+		self.assertFalse(u1.is_following(u2))
+		u1.unfollow(u2)
+		self.assertEqual(u1.followed.filter_by(followed_id=u2.id).count(), 0)
+
+	def test_invalidate_during_load_is_not_overwritten(self):
+		calls = []
+		def load():
+			calls.append(1)
+			follow_graph.invalidate(1)
+			return [2]
+		self.assertIn(2, follow_graph._get(('following', 1), load))
+		self.assertIn(2, follow_graph._get(('following', 1), load))
+		self.assertEqual(len(calls), 2)
+		self.assertEqual(follow_graph._state.loading, {})
+		self.assertIn(2, follow_graph._get(('following', 1), lambda: [2]))
+		self.assertIn(2, follow_graph._get(('following', 1), load))
+		self.assertEqual(len(calls), 2)
@@ -0,0 +1,103 @@
+import unittest
+from base64 import b64encode
+from app import create_app, db, identity_cache, credential_cache
+from app.models import User, Role, Permission
+from app.credentials import hash_password
+
+
+class IdentityCacheTestCase(unittest.TestCase):
+	def setUp(self):
+		self.app = create_app('testing')
+		self.app_context = self.app.app_context()
+		self.app_context.push()
+		db.create_all()
+		Role.insert_roles()
+
+	def tearDown(self):
+		db.session.remove()
+		db.drop_all()
+		self.app_context.pop()
+
+	def test_cached_user(self):
+		u = User(email='john@example.com', username='john', password='cat')
+		db.session.add(u)
+		db.session.commit()
+		user_id = u.id
+		db.session.remove()
+		self.assertEqual(identity_cache.get_user(user_id).username, 'john')
+		db.session.remove()
+		u = identity_cache.get_user(user_id)
+		self.assertEqual(identity_cache.stats()['hits'], 1)
+		self.assertEqual(u.username, 'john')
+		self.assertTrue(u.can(Permission.WRITE_ARTICLES))
+		self.assertIs(identity_cache.get_user(user_id), u)
+
+	def test_update_invalidates(self):
+		u = User(email='john@example.com', username='john', password='cat')
+		db.session.add(u)
+		db.session.commit()
+		user_id = u.id
+		identity_cache.get_user(user_id)
+		u.confirmed = True
+		db.session.commit()
+		db.session.remove()
+		self.assertTrue(identity_cache.get_user(user_id).confirmed)
+		self.assertIsNone(identity_cache.get_user(user_id + 1))
+
+	def test_credential_cache(self):
+		u = User(email='john@example.com', username='john', password='cat',
+			confirmed=True)
+		db.session.add(u)
+		db.session.commit()
+		headers = {
+			'Authorization': 'Basic ' + b64encode(b'john@example.com:cat').decode('utf-8'),
+			'Accept': 'application/json'
+		}
+		client = self.app.test_client()
+		self.assertEqual(client.get('/api/v1.0/posts/', headers=headers).status_code, 200)
+		self.assertEqual(client.get('/api/v1.0/posts/', headers=headers).status_code, 200)
+		self.assertEqual(credential_cache.stats()['hits'], 1)
+		u = User.query.filter_by(email='john@example.com').first()
+		u.password = 'dog'
+		db.session.commit()
+		self.assertEqual(client.get('/api/v1.0/posts/', headers=headers).status_code, 401)
+
+	def test_rehash_on_login(self):
+		self.app.config['FLASK_PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:500'
+		u = User(email='john@example.com', username='john', password='cat')
+		db.session.add(u)
+		db.session.commit()
+		self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:500$'))
+		self.app.config['FLASK_PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:600'
+		self.assertFalse(u.verify_password('dog'))
+		self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:500$'))
+		self.assertTrue(u.verify_password('cat'))
+		self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:600$'))
+		self.assertTrue(u.verify_password('cat'))
+
+	def test_changes_from_other_processes(self):
+		u = User(email='john@example.com', username='john', password='cat',
+			confirmed=True)
+		db.session.add(u)
+		db.session.commit()
+		user_id = u.id
+		headers = {
+			'Authorization': 'Basic ' + b64encode(b'john@example.com:cat').decode('utf-8'),
+			'Accept': 'application/json'
+		}
+		client = self.app.test_client()
+		self.assertEqual(client.get('/api/v1.0/posts/', headers=headers).status_code, 200)
+		self.assertEqual(client.get('/api/v1.0/posts/', headers=headers).status_code, 200)
+		self.assertEqual(credential_cache.stats()['hits'], 1)
+		# 直接写表, 不触发本进程的失效事件, 相当于其他进程做的修改
+		users = User.__table__
+		db.session.execute(users.update().where(users.c.id == user_id).
+			values(confirmed=False))
+		db.session.commit()
+		db.session.remove()
+		self.assertFalse(identity_cache.get_user(user_id).confirmed)
+		db.session.execute(users.update().where(users.c.id == user_id).
+			values(password_hash=hash_password('dog')))
+		db.session.commit()
+		db.session.remove()
+		self.assertEqual(client.get('/api/v1.0/posts/', headers=headers).status_code, 401)
@@ -0,0 +1,78 @@
+import time
+import unittest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import create_app, db, last_seen
+from app.models import User, Role
+
+
+class LastSeenTestCase(unittest.TestCase):
+	def setUp(self):
+		self.app = create_app('testing')
+		self.app_context = self.app.app_context()
+		self.app_context.push()
+		db.create_all()
+		Role.insert_roles()
+		self.users = [User(email='user%d@example.com' % i, username='user%d' % i,
+			password='cat') for i in range(3)]
+		db.session.add_all(self.users)
+		db.session.commit()
+		self.statements = []
+		event.listen(Engine, 'before_cursor_execute', self.record)
+
+	def tearDown(self):
+		last_seen.flush()
+		event.remove(Engine, 'before_cursor_execute', self.record)
+		db.session.remove()
+		db.drop_all()
+		self.app_context.pop()
+
+	def record(self, connection, cursor, statement, *args):
+		if statement.startswith('UPDATE users SET last_seen'):
+			self.statements.append(statement)
+
+	def configure(self, interval, batch_size):
+		self.app.config['FLASK_LAST_SEEN_INTERVAL'] = interval
+		self.app.config['FLASK_LAST_SEEN_BATCH'] = batch_size
+		last_seen.init_app(self.app)
+
+	def stored(self, user):
+		return db.session.execute(db.select([User.last_seen]).
+			where(User.id == user.id)).scalar()
+
+	def test_batch_size_triggers_one_bulk_write(self):
+		self.configure(3600, 3)
+		before = self.stored(self.users[0])
+		last_seen.touch(self.users[0])
+		last_seen.touch(self.users[1])
+		self.assertEqual(last_seen.stats()['pending'], 2)
+		self.assertEqual(self.statements, [])
+		self.assertEqual(self.stored(self.users[0]), before)
+		last_seen.touch(self.users[2])
+		self.assertEqual(len(self.statements), 1)
+		stats = last_seen.stats()
+		self.assertEqual((stats['pending'], stats['flushes'], stats['flushed_rows']),
+			(0, 1, 3))
+		for user in self.users:
+			self.assertEqual(self.stored(user), user.last_seen)
+
+	def test_interval_triggers_write_on_next_touch(self):
+		self.configure(3600, 100)
+		last_seen.touch(self.users[0])
+		self.assertEqual(self.statements, [])
+		self.app.extensions['last_seen'].last_flush -= 3600
+		last_seen.touch(self.users[1])
+		self.assertEqual(len(self.statements), 1)
+		self.assertEqual(last_seen.stats()['flushed_rows'], 2)
+
+	def test_idle_worker_flushes_on_timer(self):
+		self.configure(0.1, 100)
+		last_seen.touch(self.users[0])
+		self.assertEqual(last_seen.stats()['pending'], 1)
+		deadline = time.time() + 5
+		while not last_seen.stats()['flushes'] and time.time() < deadline:
+			time.sleep(0.05)
+		self.assertEqual(last_seen.stats()['flushes'], 1)
+		self.assertEqual(len(self.statements), 1)
+		db.session.expire_all()
+		self.assertEqual(self.stored(self.users[0]), self.users[0].last_seen)
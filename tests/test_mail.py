@@ -0,0 +1,145 @@
+import smtplib
+import unittest
+from datetime import datetime
+from unittest import mock
+from app import create_app, db, mail
+from app.email import send_mail, mail_pool, deliver_outbox, queue_mail
+from app.models import User, Role, Outbox
+
+
+class MailPoolTestCase(unittest.TestCase):
+	def setUp(self):
+		self.app = create_app('testing')
+		self.app_context = self.app.test_request_context()
+		self.app_context.push()
+
+	def tearDown(self):
+		mail_pool.shutdown()
+		self.app_context.pop()
+
+	def test_pool_sends_over_shared_connections(self):
+		self.app.config['FLASK_MAIL_WORKERS'] = 1
+		with mail.record_messages() as outbox:
+			for i in range(5):
+				self.assertTrue(send_mail('user%d@example.com' % i, 'Confirm Your Account',
+					'auth/email/confirm', user={'username': 'user%d' % i}, token='token'))
+			mail_pool.flush()
+		self.assertEqual(sorted(msg.recipients[0] for msg in outbox),
+			['user%d@example.com' % i for i in range(5)])
+		stats = mail_pool.stats()
+		self.assertEqual(stats['sent'], 5)
+		self.assertEqual(stats['queued'], 0)
+		self.assertEqual(stats['connections'], 1)
+
+	def test_pool_reuses_smtp_connection(self):
+		self.app.config['FLASK_MAIL_WORKERS'] = 1
+		self.app.config['FLASK_MAIL_IDLE_TIMEOUT'] = 30
+		self.app.extensions['mail'].suppress = False
+		hosts = []
+
+		# 假的 SMTP 服务器: 记录每个连接发出的收件人, 遇到 bad@ 时断开
+		class FakeSMTP(object):
+			def __init__(self, host, port):
+				self.sent = []
+				self.closed = False
+				hosts.append(self)
+
+			def set_debuglevel(self, level):
+				pass
+
+			def sendmail(self, sender, recipients, msg, mail_options, rcpt_options):
+				if self.closed:
+					raise smtplib.SMTPServerDisconnected()
+				if 'bad@example.com' in recipients:
+					self.closed = True
+					raise smtplib.SMTPServerDisconnected()
+				self.sent.extend(recipients)
+
+			def quit(self):
+				self.closed = True
+
+		with mock.patch('flask_mail.smtplib.SMTP', FakeSMTP):
+			for i in range(3):
+				send_mail('user%d@example.com' % i, 'Confirm Your Account',
+					'auth/email/confirm', user={'username': 'user%d' % i}, token='token')
+			mail_pool.flush()
+			self.assertEqual(len(hosts), 1)
+			self.assertEqual(hosts[0].sent, ['user%d@example.com' % i for i in range(3)])
+			self.assertFalse(hosts[0].closed)
+
+			for to in ('a@example.com', 'bad@example.com', 'b@example.com', 'c@example.com'):
+				send_mail(to, 'Confirm Your Account', 'auth/email/confirm',
+					user={'username': 'x'}, token='token')
+			mail_pool.flush()
+		self.assertEqual(len(hosts), 2)
+		self.assertEqual(hosts[0].sent,
+			['user%d@example.com' % i for i in range(3)] + ['a@example.com'])
+		self.assertEqual(hosts[1].sent, ['b@example.com', 'c@example.com'])
+		stats = mail_pool.stats()
+		self.assertEqual(stats['sent'], 6)
+		self.assertEqual(stats['failed'], 1)
+		self.assertEqual(stats['connections'], 2)
+
+
+class OutboxTestCase(unittest.TestCase):
+	def setUp(self):
+		self.app = create_app('testing')
+		self.app.config['FLASK_MAIL_OUTBOX'] = True
+		self.app.config['WTF_CSRF_ENABLED'] = False
+		self.app_context = self.app.app_context()
+		self.app_context.push()
+		db.create_all()
+		Role.insert_roles()
+		self.client = self.app.test_client()
+
+	def tearDown(self):
+		db.session.remove()
+		db.drop_all()
+		self.app_context.pop()
+
+	def test_register_writes_outbox(self):
+		with mail.record_messages() as outbox:
+			response = self.client.post('/auth/register', data={
+				'email': 'john@example.com',
+				'username': 'john',
+				'password': 'cat',
+				'confirm': 'cat'
+			})
+			self.assertEqual(response.status_code, 302)
+			self.assertEqual(len(outbox), 0)
+			item = Outbox.query.one()
+			self.assertEqual(item.recipient, 'john@example.com')
+			self.assertEqual(deliver_outbox('worker'), 1)
+			self.assertEqual(deliver_outbox('worker'), 0)
+		self.assertEqual(len(outbox), 1)
+		self.assertIn('http://localhost:5000/auth/confirm/', outbox[0].body)
+		item = Outbox.query.one()
+		self.assertEqual(item.status, 'sent')
+		self.assertIsNone(item.claimed_by)
+
+	def test_user_and_outbox_share_transaction(self):
+		u = User(email='john@example.com', username='john', password='cat')
+		db.session.add(u)
+		db.session.flush()
+		queue_mail(u.email, 'Confirm Your Account', 'auth/email/confirm', user=u,
+			token=u.generate_confirmation_token())
+		db.session.rollback()
+		self.assertEqual(User.query.count(), 0)
+		self.assertEqual(Outbox.query.count(), 0)
+
+	def test_failed_delivery_backs_off(self):
+		u = User(email='john@example.com', username='john', password='cat')
+		db.session.add(u)
+		db.session.flush()
+		item = Outbox.enqueue(u.email, 'hello', 'auth/email/missing', u)
+		db.session.commit()
+		self.assertEqual(deliver_outbox('worker'), 1)
+		self.assertEqual(item.status, 'pending')
+		self.assertEqual(item.attempts, 1)
+		self.assertGreater(item.next_attempt_at, datetime.utcnow())
+		self.assertEqual(deliver_outbox('worker'), 0)
+		self.app.config['FLASK_MAIL_MAX_ATTEMPTS'] = 2
+		item.next_attempt_at = datetime.utcnow()
+		db.session.commit()
+		self.assertEqual(deliver_outbox('worker'), 1)
+		self.assertEqual(item.status, 'failed')
@@ -0,0 +1,95 @@
+import json
+import unittest
+from base64 import b64encode
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import create_app, db
+from app.models import User, Role, Post, Comment
+
+
+# 列表页的 SQL 语句数与页面上的条数无关: 每条记录的作者/评论者都一起 join 进来
+class QueryCountTestCase(unittest.TestCase):
+	def setUp(self):
+		self.app = create_app('testing')
+		# 片段缓存命中时不会访问关联对象, 会掩盖逐条查询
+		self.app.config['FLASK_FRAGMENT_CACHE'] = False
+		self.app.config['WTF_CSRF_ENABLED'] = False
+		self.app_context = self.app.app_context()
+		self.app_context.push()
+		db.create_all()
+		Role.insert_roles()
+		self.client = self.app.test_client()
+		self.post = Post(body='post', author=User(email='john@example.com',
+			username='john', password='cat', confirmed=True))
+		db.session.add(self.post)
+		db.session.commit()
+		self.authors = 0
+
+	def tearDown(self):
+		db.session.remove()
+		db.drop_all()
+		self.app_context.pop()
+
+	def count_queries(self, url, headers=None):
+		statements = []
+		def record(*args):
+			statements.append(1)
+		db.session.remove()
+		event.listen(Engine, 'before_cursor_execute', record)
+		try:
+			response = self.client.get(url, headers=headers)
+		finally:
+			event.remove(Engine, 'before_cursor_execute', record)
+		self.assertEqual(response.status_code, 200)
+		return len(statements), response
+
+	# 每次加 n 条, 每条出自不同的用户
+	def add_items(self, n):
+		for i in range(n):
+			self.authors += 1
+			u = User(email='user%d@example.com' % self.authors,
+				username='user%d' % self.authors, password='cat')
+			db.session.add(Post(body='post by %d' % self.authors, author=u))
+			db.session.add(Comment(body='comment by %d' % self.authors, commentator=u,
+				post=self.post))
+		db.session.commit()
+
+	def assertConstantQueries(self, url, headers=None, n=2):
+		self.add_items(n)
+		small, response = self.count_queries(url, headers)
+		self.add_items(n)
+		large, response = self.count_queries(url, headers)
+		self.assertEqual(small, large, url)
+		return response
+
+	def test_index(self):
+		response = self.assertConstantQueries('/')
+		self.assertIn(b'user4', response.get_data())
+
+	def test_post_link(self):
+		response = self.assertConstantQueries('/post/%d' % self.post.id)
+		self.assertIn(b'user4', response.get_data())
+
+	def test_moderate(self):
+		moderator = User(email=self.app.config['FLASK_ADMIN'], username='admin',
+			password='dog', confirmed=True)
+		db.session.add(moderator)
+		db.session.commit()
+		self.client.post('/auth/login', data={
+			'email': moderator.email,
+			'password': 'dog'
+		})
+		response = self.assertConstantQueries('/moderate')
+		self.assertIn(b'user4', response.get_data())
+
+	def test_api_lists(self):
+		headers = {
+			'Authorization': 'Basic ' + b64encode(b':').decode('utf-8'),
+			'Accept': 'application/json'
+		}
+		for url in ('/api/v1.0/posts/', '/api/v1.0/posts/?cursor=',
+			'/api/v1.0/comments/', '/api/v1.0/comments/?cursor=',
+			'/api/v1.0/post/%d/comments/' % self.post.id):
+			response = self.assertConstantQueries(url, headers, n=1)
+			data = json.loads(response.get_data(as_text=True))
+			self.assertGreater(len(data['posts' if 'posts/' in url else 'comments']), 1)
@@ -0,0 +1,87 @@
+import unittest
+from app import create_app, db, renderer
+from app.models import User, Role, Post
+
+
+class RenderTestCase(unittest.TestCase):
+	def setUp(self):
+		self.app = create_app('testing')
+		self.app_context = self.app.app_context()
+		self.app_context.push()
+		db.create_all()
+		Role.insert_roles()
+		self.user = User(email='john@example.com', username='john', password='cat')
+		db.session.add(self.user)
+		db.session.commit()
+
+	def tearDown(self):
+		renderer.flush()
+		db.session.remove()
+		db.drop_all()
+		self.app_context.pop()
+
+	def body_html(self, post):
+		return db.session.execute(db.select([Post.body_html]).
+			where(Post.id == post.id)).scalar()
+
+	def test_deferred_render_after_commit(self):
+		self.app.config['FLASK_ASYNC_RENDER'] = True
+		post = Post(body='*hello*', author=self.user)
+		db.session.add(post)
+		db.session.flush()
+		self.assertIsNone(post.body_html)
+		self.assertEqual(len(db.session.info['pending_render']), 1)
+		db.session.commit()
+		self.assertNotIn('pending_render', db.session.info)
+		renderer.flush()
+		self.assertEqual(self.body_html(post), '<p><em>hello</em></p>')
+
+	def test_rollback_drops_pending_render(self):
+		self.app.config['FLASK_ASYNC_RENDER'] = True
+		db.session.add(Post(body='*hello*', author=self.user))
+		db.session.flush()
+		db.session.rollback()
+		self.assertNotIn('pending_render', db.session.info)
+
+	def test_stale_render_does_not_overwrite_newer_body(self):
+		post = Post(body='old', author=self.user)
+		db.session.add(post)
+		db.session.commit()
+		post.body = 'new'
+		db.session.add(post)
+		db.session.commit()
+		renderer._render_later(self.app, Post.__table__, post.id, 'old', 'post',
+			post.cache_tags())
+		self.assertEqual(self.body_html(post), '<p>new</p>')
+		renderer._render_later(self.app, Post.__table__, post.id, 'new', 'post',
+			post.cache_tags())
+		self.assertEqual(self.body_html(post), '<p>new</p>')
+
+	def test_rerender_backfills_every_row(self):
+		posts = [Post(body='post **%d**' % i, author=self.user) for i in range(5)]
+		db.session.add_all(posts)
+		db.session.commit()
+		db.session.execute(Post.__table__.update().values(body_html=None))
+		db.session.commit()
+		self.assertEqual(renderer.rerender(Post, 'post', workers=1, batch_size=2), 5)
+		for i, post in enumerate(posts):
+			self.assertEqual(self.body_html(post), '<p>post <strong>%d</strong></p>' % i)
+
+	def test_render_cache_counts_hits_and_misses(self):
+		body = 'cached *%d*' % id(self)
+		before = renderer.stats()
+		db.session.add(Post(body=body, author=self.user))
+		db.session.commit()
+		stats = renderer.stats()
+		self.assertEqual(stats['misses'], before['misses'] + 1)
+		self.assertEqual(stats['hits'], before['hits'])
+		post = Post(body=body, author=self.user)
+		db.session.add(post)
+		db.session.commit()
+		stats = renderer.stats()
+		self.assertEqual(stats['misses'], before['misses'] + 1)
+		self.assertEqual(stats['hits'], before['hits'] + 1)
+		self.assertEqual(self.body_html(post), renderer.render(body, 'post'))
+		# 标签策略不同, 缓存键也不同
+		renderer.render(body, 'comment')
+		self.assertEqual(renderer.stats()['misses'], before['misses'] + 2)
@@ -0,0 +1,100 @@
+import threading
+import time
+import unittest
+from flask import g
+from app import create_app, db, response_cache, fragment_cache
+from app.models import User, Role, Post, Comment
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+	def setUp(self):
+		self.app = create_app('testing')
+		self.app.config['FLASK_RESPONSE_CACHE'] = 'simple'
+		self.app.config['WTF_CSRF_ENABLED'] = False
+		response_cache.init_app(self.app)
+		self.app_context = self.app.app_context()
+		self.app_context.push()
+		db.create_all()
+		Role.insert_roles()
+		self.client = self.app.test_client()
+		self.user = User(email='john@example.com', username='john', password='cat',
+			confirmed=True)
+		self.post = Post(body='first post', author=self.user)
+		db.session.add(self.post)
+		db.session.commit()
+
+	def tearDown(self):
+		db.session.remove()
+		db.drop_all()
+		self.app_context.pop()
+
+	def get(self, url):
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, 200)
+		return response.get_data(as_text=True)
+
+	def test_anonymous_pages_are_cached_until_rows_change(self):
+		for url in ('/', '/user/john', '/post/%d' % self.post.id, '/api/v1.0/posts/'):
+			self.get(url)
+			misses = response_cache.stats()['misses']
+			self.get(url)
+			self.assertEqual(response_cache.stats()['misses'], misses)
+		db.session.add(Post(body='second post', author=self.user))
+		db.session.commit()
+		self.assertIn('second post', self.get('/'))
+		self.assertIn('second post', self.get('/api/v1.0/posts/'))
+		db.session.add(Comment(body='a comment', commentator=self.user, post=self.post))
+		db.session.commit()
+		self.assertIn('a comment', self.get('/post/%d' % self.post.id))
+
+	def test_logged_in_users_bypass_cache(self):
+		self.get('/')
+		response = self.client.post('/auth/login', data={
+			'email': 'john@example.com',
+			'password': 'cat'
+		})
+		self.assertEqual(response.status_code, 302)
+		self.assertIn('Logout', self.get('/'))
+		self.assertEqual(response_cache.stats()['hits'], 0)
+
+	def test_cold_key_is_computed_once(self):
+		calls = []
+		@self.app.route('/slow')
+		@response_cache.cached(['posts'])
+		def slow():
+			calls.append(1)
+			time.sleep(0.2)
+			return 'slow'
+		threads = [threading.Thread(target=self.get, args=('/slow',)) for i in range(5)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(len(calls), 1)
+
+	def test_post_fragments_follow_updates(self):
+		self.client.post('/auth/login', data={
+			'email': 'john@example.com',
+			'password': 'cat'
+		})
+		self.assertIn('first post', self.get('/'))
+		misses = fragment_cache.stats()['misses']
+		self.assertIn('first post', self.get('/'))
+		self.assertEqual(fragment_cache.stats()['misses'], misses)
+		self.post.body = 'edited post'
+		db.session.add(self.post)
+		db.session.commit()
+		self.assertIn('edited post', self.get('/'))
+
+	def test_admin_stats(self):
+		admin = User(email=self.app.config['FLASK_ADMIN'], username='admin',
+			password='dog', confirmed=True)
+		db.session.add(admin)
+		db.session.commit()
+		self.client.post('/auth/login', data={
+			'email': admin.email,
+			'password': 'dog'
+		})
+		response = self.client.get('/admin/stats')
+		self.assertEqual(response.status_code, 200)
+		self.assertIn('fragment_cache', response.get_json())
@@ -0,0 +1,82 @@
+import json
+import unittest
+from base64 import b64encode
+from app import create_app, db
+from app.models import User, Role, Post, Comment
+from app.search import search_index
+
+
+class SearchTestCase(unittest.TestCase):
+	def setUp(self):
+		self.app = create_app('testing')
+		self.app_context = self.app.app_context()
+		self.app_context.push()
+		db.create_all()
+		Role.insert_roles()
+		self.client = self.app.test_client()
+		self.user = User(email='john@example.com', username='john', password='cat',
+			confirmed=True)
+		db.session.add(self.user)
+		db.session.commit()
+
+	def tearDown(self):
+		db.session.remove()
+		db.drop_all()
+		self.app_context.pop()
+
+	def found(self, q, **kwargs):
+		return [(result.kind, result.item.id) for result in
+			search_index.search(q, **kwargs)[0]]
+
+	def test_index_follows_writes(self):
+		post = Post(body='Flask and SQLite', author=self.user)
+		other = Post(body='nothing to see', author=self.user)
+		comment = Comment(body='sqlite is fast', commentator=self.user, post=other)
+		db.session.add_all([post, other, comment])
+		db.session.commit()
+		self.assertEqual(sorted(self.found('sqlite')),
+			[('comment', comment.id), ('post', post.id)])
+		self.assertEqual(self.found('flask sqlite'), [('post', post.id)])
+		post.body = 'renamed'
+		comment.disabled = True
+		db.session.add_all([post, comment])
+		db.session.commit()
+		self.assertEqual(self.found('sqlite'), [])
+		self.assertEqual(self.found('renamed'), [('post', post.id)])
+		comment.disabled = False
+		db.session.add(comment)
+		db.session.delete(post)
+		db.session.commit()
+		self.assertEqual(self.found('sqlite renamed'), [])
+		self.assertEqual(self.found('sqlite'), [('comment', comment.id)])
+		self.assertEqual(search_index.rebuild(), 2)
+		self.assertEqual(self.found('sqlite'), [('comment', comment.id)])
+		self.assertEqual(self.found('"sqlite" (fast*'), [('comment', comment.id)])
+
+	def test_cursor_pagination(self):
+		db.session.add_all([Post(body='word %d' % i, author=self.user) for i in range(5)])
+		db.session.commit()
+		seen = []
+		results, cursor = search_index.search('word', per_page=2)
+		seen.extend(result.item.id for result in results)
+		while cursor:
+			results, cursor = search_index.search('word', cursor, per_page=2)
+			seen.extend(result.item.id for result in results)
+		self.assertEqual(sorted(seen), [post.id for post in Post.query.order_by(Post.id)])
+
+	def test_views(self):
+		db.session.add(Post(body='<b>hello</b> world', author=self.user))
+		db.session.commit()
+		response = self.client.get('/search?q=hello')
+		self.assertEqual(response.status_code, 200)
+		self.assertIn('<mark>hello</mark>', response.get_data(as_text=True))
+		self.assertNotIn('<b>', response.get_data(as_text=True))
+		response = self.client.get('/search?q=x&cursor=bogus')
+		self.assertEqual(response.status_code, 400)
+		response = self.client.get('/api/v1.0/search?q=world', headers={
+			'Authorization': 'Basic ' + b64encode(b':').decode('utf-8'),
+			'Accept': 'application/json'})
+		self.assertEqual(response.status_code, 200)
+		data = json.loads(response.get_data(as_text=True))
+		self.assertEqual(data['results'][0]['type'], 'post')
+		self.assertEqual(data['results'][0]['post']['body'], '<b>hello</b> world')
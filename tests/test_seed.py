@@ -0,0 +1,41 @@
+import unittest
+from app import create_app, db
+from app.models import User, Post, Comment, Follow
+from app.search import search_index
+from app.seed import Seeder
+
+
+class SeedTestCase(unittest.TestCase):
+	def setUp(self):
+		self.app = create_app('testing')
+		self.app_context = self.app.app_context()
+		self.app_context.push()
+		db.create_all()
+
+	def tearDown(self):
+		db.session.remove()
+		db.drop_all()
+		self.app_context.pop()
+
+	def seed(self):
+		Seeder(seed=3, workers=1, batch_size=7).run(20, 30, 40, 3)
+		return [tuple(row) for row in db.session.query(Post.author_id, Post.body,
+			Post.timestamp).order_by(Post.id)]
+
+	def test_seed(self):
+		posts = self.seed()
+		self.assertEqual(User.query.count(), 20)
+		self.assertEqual(len(posts), 30)
+		self.assertEqual(Comment.query.count(), 40)
+		self.assertTrue(all(post.body_html for post in Post.query))
+		for user in User.query:
+			self.assertTrue(user.is_following(user))
+			self.assertEqual(user.posts_count, user.posts.count())
+			self.assertEqual(user.followers_count, user.followers.count())
+		self.assertEqual(sum(post.comments_count for post in Post.query), 40)
+		self.assertGreater(Follow.query.count(), 20)
+		self.assertTrue(search_index.search('lorem')[0])
+		db.session.remove()
+		db.drop_all()
+		db.create_all()
+		self.assertEqual(self.seed(), posts)
@@ -0,0 +1,102 @@
+import unittest
+from base64 import b64encode
+from app import create_app, db
+from app.models import User, Role, Post, Timeline
+
+
+class TimelineTestCase(unittest.TestCase):
+	def setUp(self):
+		self.app = create_app('testing')
+		self.app.config['FLASK_TIMELINE_ENABLED'] = True
+		self.app_context = self.app.app_context()
+		self.app_context.push()
+		db.create_all()
+		Role.insert_roles()
+		self.john = User(email='john@example.com', username='john', password='cat')
+		self.susan = User(email='susan@example.com', username='susan', password='dog')
+
+	def tearDown(self):
+		db.session.remove()
+		db.drop_all()
+		self.app_context.pop()
+
+	def post(self, author, body):
+		post = Post(body=body, author=author)
+		db.session.add(post)
+		db.session.commit()
+		return post
+
+	def timeline(self, user):
+		return sorted(post.id for post in user.followed_posts)
+
+	def test_fan_out_on_write(self):
+		self.john.follow(self.susan)
+		p1 = self.post(self.susan, 'hello')
+		p2 = self.post(self.john, 'world')
+		self.assertEqual(self.timeline(self.john), [p1.id, p2.id])
+		self.assertEqual(self.timeline(self.susan), [p1.id])
+		self.assertEqual(Timeline.query.count(), 3)
+
+	def test_backfill_and_trim_on_follow(self):
+		old = self.post(self.susan, 'old')
+		self.john.follow(self.susan)
+		self.assertEqual(self.timeline(self.john), [old.id])
+		self.john.unfollow(self.susan)
+		self.assertEqual(self.timeline(self.john), [])
+
+	def test_fan_out_trims_to_length(self):
+		self.app.config['FLASK_TIMELINE_LENGTH'] = 3
+		self.john.follow(self.susan)
+		posts = [self.post(self.susan, 'post %d' % i) for i in range(10)]
+		for user in (self.john, self.susan):
+			self.assertEqual(Timeline.query.filter_by(user_id=user.id).count(), 3)
+			self.assertEqual(self.timeline(user), [post.id for post in posts[-3:]])
+
+	def test_backfill_trims_to_length(self):
+		self.app.config['FLASK_TIMELINE_LENGTH'] = 3
+		posts = [self.post(self.susan, 'post %d' % i) for i in range(5)]
+		mine = self.post(self.john, 'mine')
+		self.john.follow(self.susan)
+		self.assertEqual(Timeline.query.filter_by(user_id=self.john.id).count(), 3)
+		self.assertEqual(self.timeline(self.john), [posts[3].id, posts[4].id, mine.id])
+
+	def test_reads_order_by_timeline(self):
+		self.john.follow(self.susan)
+		posts = [self.post(self.susan, 'post %d' % i) for i in range(4)]
+		timestamp, id = self.john.followed_posts_order
+		self.assertIs(timestamp, Timeline.timestamp)
+		self.assertEqual([post.id for post in self.john.followed_posts.
+			order_by(timestamp.desc())], [post.id for post in reversed(posts)])
+		sql = str(self.john.followed_posts.order_by(timestamp.desc()).limit(2).statement.
+			compile(compile_kwargs={'literal_binds': True}))
+		plan = ' '.join(str(row) for row in db.session.execute('EXPLAIN QUERY PLAN ' + sql))
+		self.assertIn('ix_timelines_user_id_timestamp', plan)
+		self.assertNotIn('TEMP B-TREE', plan)
+		self.john.confirmed = True
+		db.session.add(self.john)
+		db.session.commit()
+		headers = {'Authorization': 'Basic ' + b64encode(b'john@example.com:cat').
+			decode('utf-8')}
+		client = self.app.test_client()
+		url = '/api/v1.0/user/john/timeline/?cursor='
+		seen = []
+		while url:
+			data = client.get(url, headers=headers).get_json()
+			seen.extend(post['url'].rsplit('/', 1)[-1] for post in data['posts'])
+			url = data['next']
+		self.assertEqual(seen, [str(post.id) for post in reversed(posts)])
+
+	def test_fan_out_on_read_for_popular_authors(self):
+		self.app.config['FLASK_TIMELINE_FANOUT_LIMIT'] = 1
+		self.john.follow(self.susan)
+		p = self.post(self.susan, 'hello')
+		self.assertEqual(Timeline.query.filter_by(post_id=p.id).count(), 0)
+		self.assertEqual(self.timeline(self.john), [p.id])
+
+	def test_rebuild(self):
+		self.john.follow(self.susan)
+		p = self.post(self.susan, 'hello')
+		Timeline.query.delete()
+		db.session.commit()
+		Timeline.rebuild()
+		self.assertEqual(self.timeline(self.john), [p.id])